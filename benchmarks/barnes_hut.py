@@ -0,0 +1,73 @@
+"""
+Accuracy and speed of the Barnes-Hut solver against direct summation.
+
+Direct summation is only evaluated for a random sample of bodies at large N;
+its full time is extrapolated from the sample.
+
+    python benchmarks/barnes_hut.py --sizes 1000 10000 100000 --thetas 0.3 0.5 0.8
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from qraft import physics
+from qraft.barneshut import BarnesHut
+
+
+def plummer_sphere(n, seed=0):
+    """Positions and masses of a Plummer sphere with total mass 1 and scale radius 1"""
+    rng = np.random.default_rng(seed)
+    radii = (rng.uniform(0, 0.99, n)**(-2/3) - 1)**-0.5
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return radii[:, None] * directions, np.full(n, 1/n)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(sizes, thetas, sample_size=1000, softening=1e-2, seed=0):
+    results = []
+    for n in sizes:
+        positions, masses = plummer_sphere(n, seed)
+        sample = np.random.default_rng(seed).choice(n, min(n, sample_size), replace=False)
+
+        exact, direct_time = timed(physics.direct_accelerations, positions, masses, 1, softening, targets=sample)
+        direct_time *= n / len(sample)
+
+        for theta in thetas:
+            approximate, tree_time = timed(BarnesHut(theta), positions, masses, 1, softening)
+            errors = np.linalg.norm(approximate[sample] - exact, axis=1) / np.linalg.norm(exact, axis=1)
+            results.append({
+                'n': n,
+                'theta': theta,
+                'direct_seconds': direct_time,
+                'direct_extrapolated': len(sample) < n,
+                'barnes_hut_seconds': tree_time,
+                'speedup': direct_time / tree_time,
+                'median_relative_error': float(np.median(errors)),
+                'p99_relative_error': float(np.percentile(errors, 99)),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--thetas', type=float, nargs='+', default=[0.3, 0.5, 0.8])
+    parser.add_argument('--sample-size', type=int, default=1000)
+    parser.add_argument('--output', help="JSON file to write the results to, instead of printing them")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.thetas, args.sample_size)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
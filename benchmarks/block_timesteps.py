@@ -0,0 +1,137 @@
+"""
+Block timesteps against a uniform step on a hierarchical system: a star with planets,
+each with a close moon, and a belt of light bodies.
+
+A uniform Hermite run (the same fourth order integrator) takes the smallest step that the block run
+used for any body, which is what a single global dt needs to resolve the moons. Uniform leapfrog runs
+start from that step and are compared to the block run at matched accuracy: the largest uniform step
+whose position error is no worse.
+
+    python benchmarks/block_timesteps.py --planets 4 --belt 200 --duration 6.3
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from qraft import physics
+
+
+def planetary_system(planets, belt, seed=0):
+    """Positions, velocities and masses (G = 1) of a star, planets with moons, and a belt"""
+    rng = np.random.default_rng(seed)
+    positions, velocities, masses = [np.zeros(3)], [np.zeros(3)], [1.0]
+
+    def add(center, velocity, mass, distance, central_mass, angle):
+        direction = np.array([np.cos(angle), np.sin(angle), 0])
+        positions.append(center + distance*direction)
+        velocities.append(velocity + np.sqrt(central_mass/distance)*np.array([-direction[1], direction[0], 0]))
+        masses.append(mass)
+
+    for i in range(planets):
+        add(np.zeros(3), np.zeros(3), 1e-3, 1 + i, 1, rng.uniform(0, 2*np.pi))
+        add(positions[-1], velocities[-1], 1e-8, 0.01, 1e-3, rng.uniform(0, 2*np.pi))
+    for distance, angle in zip(rng.uniform(planets + 0.5, planets + 2, belt), rng.uniform(0, 2*np.pi, belt)):
+        add(np.zeros(3), np.zeros(3), 1e-10, distance, 1, angle)
+    return np.array(positions), np.array(velocities), np.array(masses)
+
+
+def block_run(positions, velocities, masses, steps, dt, accuracy):
+    integrator = physics.BlockHermite(accuracy)
+    system = physics.NBody(positions, velocities, masses, integrator=integrator)
+    smallest = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        system.step(dt)
+        smallest = max(smallest, np.max(system.levels))
+    return system, time.perf_counter() - start, integrator.evaluations, dt / 2**smallest
+
+
+def uniform_run(positions, velocities, masses, steps, dt, integrator='leapfrog'):
+    """A run with one step for every body, by leapfrog or by Hermite integration"""
+    if integrator == 'hermite':
+        # Without levels, every body takes the full step
+        integrator = physics.BlockHermite(max_level=0)
+    system = physics.NBody(positions, velocities, masses, integrator=integrator)
+    start = time.perf_counter()
+    system.step(dt, steps)
+    return system, time.perf_counter() - start, len(system) * steps, dt
+
+
+def run(planets, belt, duration, dt=2**-4, accuracy=0.02, seed=0, max_halvings=3, reference_refinement=8):
+    """
+    The block run, a uniform Hermite run at the smallest block step, then uniform leapfrog runs from that step,
+    halving or doubling it to the largest one whose position error is within that of the block run.
+
+    Errors are the largest distance of any body from a reference uniform Hermite run whose step is
+    reference_refinement times smaller than the smallest block step, so that they don't share the block run's own.
+    """
+    positions, velocities, masses = planetary_system(planets, belt, seed)
+    # Every run ends at the same time, a whole number of block steps
+    steps = round(duration / dt)
+    start_energy = physics.NBody(positions, velocities, masses).energy()
+
+    def uniform(step, integrator='leapfrog'):
+        return uniform_run(positions, velocities, masses, round(steps * dt / step), step, integrator)
+
+    block_system, *block_stats = block_run(positions, velocities, masses, steps, dt, accuracy)
+    smallest = block_stats[-1]
+    reference = uniform(smallest / reference_refinement, 'hermite')[0]
+
+    def result(name, system, seconds, evaluations, step):
+        return {
+            'integrator': name,
+            'seconds': seconds,
+            'evaluations': evaluations,
+            'smallest_step': step,
+            'position_error': np.max(np.linalg.norm(system.positions - reference.positions, axis=1)),
+            'relative_energy_error': abs(system.energy() / start_energy - 1),
+        }
+
+    block = result('block_hermite', block_system, *block_stats)
+    hermite = result('uniform_hermite', *uniform(smallest, 'hermite'))
+    leapfrog = result('uniform_leapfrog', *uniform(smallest))
+    results = [block, hermite, leapfrog]
+    block['hermite_speedup'] = hermite['seconds'] / block['seconds']
+    block['leapfrog_speedup_at_smallest_step'] = leapfrog['seconds'] / block['seconds']
+
+    step = smallest
+    if leapfrog['position_error'] > block['position_error']:
+        # Too coarse: halve until the error is matched (or give up after max_halvings)
+        for _ in range(max_halvings):
+            step /= 2
+            leapfrog = result('uniform_leapfrog', *uniform(step))
+            results.append(leapfrog)
+            if leapfrog['position_error'] <= block['position_error']:
+                break
+    else:
+        # Finer than needed: double while the error stays matched
+        while step < dt:
+            coarser = result('uniform_leapfrog', *uniform(2*step))
+            results.append(coarser)
+            if coarser['position_error'] > block['position_error']:
+                break
+            step, leapfrog = 2*step, coarser
+
+    matched = leapfrog['position_error'] <= block['position_error']
+    block['matched_leapfrog_speedup'] = leapfrog['seconds'] / block['seconds'] if matched else None
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--planets', type=int, default=4)
+    parser.add_argument('--belt', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=6.3)
+    parser.add_argument('--accuracy', type=float, default=0.02)
+    parser.add_argument('--output', help="JSON file to write the results to, instead of printing them")
+    args = parser.parse_args()
+
+    results = run(args.planets, args.belt, args.duration, accuracy=args.accuracy)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
@@ -0,0 +1,233 @@
+"""
+Timings of the render and physics hot paths, without a window or GL context.
+
+Every case is run with fixed sizes and seeds, and timed as the best of a few repeats
+of enough calls to take at least 0.2 seconds. With --baseline, the results are compared
+to an earlier output file, case by case.
+
+    python benchmarks/hot_paths.py --output results.json
+    python benchmarks/hot_paths.py --baseline results.json --output new.json
+"""
+
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+
+import numpy as np
+
+import aquaternion as aq
+
+from qraft import graphics, physics, raster, collision, picking
+from qraft import geometry as gm
+from qraft.barneshut import BarnesHut
+
+from barnes_hut import plummer_sphere
+
+
+def measure(function, repeat=5):
+    """Seconds per call of function(), the best of `repeat` runs"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def sphere_construction(resolutions=((10, 10), (20, 20), (40, 40), (80, 80))):
+    results = []
+    for vertical_n, horizontal_n in resolutions:
+        # Without the shared template, as for the first sphere of a resolution
+        def construct():
+            gm.Sphere.templates.clear()
+            gm.Sphere(radius=1, vertical_n=vertical_n, horizontal_n=horizontal_n)
+        results.append({'case': 'sphere_construction', 'vertical_n': vertical_n, 'horizontal_n': horizontal_n,
+                        'seconds': measure(construct)})
+    return results
+
+
+def mesh_transform(resolutions=((10, 10), (40, 40), (160, 160))):
+    """Vertex transform and shading of Mesh.render, after the mesh has moved"""
+    results = []
+    light_vector = np.array([-1.0, -2.0, -3.0])
+    for vertical_n, horizontal_n in resolutions:
+        sphere = gm.Sphere(radius=1, vertical_n=vertical_n, horizontal_n=horizontal_n)
+
+        def transform():
+            sphere.rotate(aq.Q([0, 1, 0]), 0.01)
+            sphere.update_transform()
+            sphere.get_world_triangles()
+            sphere.shade(light_vector)
+        results.append({'case': 'mesh_transform', 'triangles': len(sphere.triangles), 'seconds': measure(transform)})
+    return results
+
+
+def build_tree(depth, breadth):
+    if depth == 0:
+        return gm.Cuboid(size=(0.1, 0.1, 0.1))
+    return gm.Group([build_tree(depth - 1, breadth) for _ in range(breadth)], position=(1, 0, 0))
+
+
+def group_traversal(shapes=((1, 64), (2, 8), (3, 4), (6, 2))):
+    """Transform update and traversal of a whole Group tree, moved at the root every time"""
+    results = []
+    light_vector = np.array([-1.0, -2.0, -3.0])
+    for depth, breadth in shapes:
+        root = build_tree(depth, breadth)
+
+        def traverse():
+            root.rotate(aq.Q([0, 0, 1]), 0.01)
+            root.update_transform()
+            for triangles, colors in raster.get_triangles(root, light_vector):
+                pass
+        results.append({'case': 'group_traversal', 'depth': depth, 'breadth': breadth, 'leaves': breadth**depth,
+                        'seconds': measure(traverse)})
+    return results
+
+
+def light_factor(n=1000, seed=0):
+    """triangle_light_factor on every triangle of n, against light_factors on all of them at once"""
+    rng = np.random.default_rng(seed)
+    triangles = rng.normal(size=(n, 3, 3))
+    quaternion_triangles = [[aq.Q(vertex.tolist()) for vertex in triangle] for triangle in triangles]
+    normals = graphics.triangle_normals(triangles)
+    light_vector = aq.Q([-1, -2, -3])
+
+    def per_triangle():
+        for vertices in quaternion_triangles:
+            graphics.triangle_light_factor(vertices, light_vector, 0.5)
+
+    return [
+        {'case': 'triangle_light_factor', 'triangles': n, 'seconds': measure(per_triangle, repeat=3)},
+        {'case': 'light_factors', 'triangles': n, 'seconds': measure(lambda: graphics.light_factors(normals, light_vector))},
+    ]
+
+
+def nbody_step(sizes=(3, 100, 1000, 10000), seed=0):
+    """One leapfrog step of physics.NBody, as in the gravity scene, with direct summation and Barnes-Hut"""
+    results = []
+    for n in sizes:
+        positions, masses = plummer_sphere(n, seed)
+        velocities = np.zeros_like(positions)
+        solvers = {'direct': physics.direct_accelerations}
+        if n >= 1000:
+            solvers['barnes_hut'] = BarnesHut(0.5)
+
+        for name, solver in solvers.items():
+            system = physics.NBody(positions, velocities, masses, G=1, softening=1e-2, solver=solver)
+            # Direct summation at large N is slow enough that a single step is measured
+            seconds = measure(lambda: system.step(1e-3), repeat=3 if n < 10000 else 1)
+            results.append({'case': 'nbody_step', 'solver': name, 'n': n, 'seconds': seconds})
+    return results
+
+
+def contact_detection(sizes=(1000, 10000, 50000), seed=0):
+    """Broad and narrow phase of collision.Colliders over moving spheres, with a few contacts per hundred bodies"""
+    results = []
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        centers = rng.uniform(0, n**(1/3), (n, 3))
+        radii = rng.uniform(0.05, 0.15, n)
+        colliders = collision.Colliders.from_spheres(centers, radii)
+
+        def detect():
+            colliders.centers += rng.normal(0, 0.01, (n, 3))
+            colliders.detect()
+        results.append({'case': 'contact_detection', 'n': n, 'seconds': measure(detect, repeat=3)})
+    return results
+
+
+def ray_casting(resolutions=((10, 10), (40, 40), (160, 160)), seed=0):
+    """One ray through picking.Picker against a sphere, after its triangle BVH has been built"""
+    results = []
+    rng = np.random.default_rng(seed)
+    for vertical_n, horizontal_n in resolutions:
+        sphere = gm.Sphere(radius=1, vertical_n=vertical_n, horizontal_n=horizontal_n)
+        sphere.update_transform()
+        picker = picking.Picker([sphere])
+
+        # Axis-aligned rays run along the boxes of the triangles on the sphere's first meridian (y = 0),
+        # and have to hit the near side, about 4 away, and not the far side, about 6 away
+        for origin, direction in (((0.3, 0, 5), (0, 0, -1)), ((0, 0, 5), (0, 0, -1)), ((5, 0, 0.5), (-1, 0, 0))):
+            hit = picker.cast_ray(origin, direction)
+            assert hit is not None and hit.distance < 5, f"Ray from {origin} along {direction} gave {hit}"
+
+        def cast():
+            picker.cast_ray((0, 0, 5), rng.normal(0, 0.1, 3) + (0, 0, -1))
+        results.append({'case': 'ray_casting', 'triangles': len(sphere.triangles), 'seconds': measure(cast)})
+    return results
+
+
+suites = {
+    'sphere_construction': sphere_construction,
+    'mesh_transform': mesh_transform,
+    'group_traversal': group_traversal,
+    'light_factor': light_factor,
+    'nbody_step': nbody_step,
+    'contact_detection': contact_detection,
+    'ray_casting': ray_casting,
+}
+
+
+# Fields of a result that are measurements rather than what identifies the case
+measured = ('seconds', 'baseline_seconds', 'speedup')
+
+
+def get_key(result):
+    return tuple((key, value) for key, value in result.items() if key not in measured)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Adds the baseline time and speedup to every result that has a match in the baseline"""
+    baseline = {get_key(result): result['seconds'] for result in baseline['results']}
+    regressions = []
+    matched = 0
+    for result in results:
+        key = get_key(result)
+        if key in baseline:
+            matched += 1
+            result['baseline_seconds'] = baseline[key]
+            result['speedup'] = baseline[key] / result['seconds']
+            if result['speedup'] < 1 - tolerance:
+                regressions.append(result)
+    if results and not matched:
+        print("No results match a case of the baseline, so nothing was compared.", file=sys.stderr)
+    return regressions
+
+
+def run(names=tuple(suites)):
+    start = time.perf_counter()
+    results = [result for name in names for result in suites[name]()]
+    return {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'total_seconds': time.perf_counter() - start,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', nargs='+', choices=list(suites), default=list(suites))
+    parser.add_argument('--baseline', help="earlier output file to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="slowdown that counts as a regression")
+    parser.add_argument('--output', help="JSON file to write the results to, instead of printing them")
+    args = parser.parse_args()
+
+    report = run(args.suites)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report['results'], json.load(file), args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    for result in regressions:
+        print(f"Slower than the baseline: {result}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -4,6 +4,8 @@ os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'
 
 import datetime
 
+import numpy as np
+
 import pygame
 from pygame.locals import *
 
@@ -13,6 +15,20 @@ from OpenGL.GLU import *
 from . import graphics
 from . import geometry as gm
 from . import environment as env
+from . import polylines
+from . import physics
+from . import barneshut
+from . import orbits
+from . import transfer
+from . import rigidbody
+from . import collision
+from . import picking
+from . import autopilot
+from . import craft
+from . import runner
+from . import raster
+from . import capture
+from . import profiler
 from . import utils
 
 from aquaternion import *
@@ -1,13 +1,114 @@
+import numpy as np
 
 from aquaternion import *
 
+from . import geometry as gm
+
+
 class Autopilot:
+    """
+    Points a craft's forward axis at target_direction, and keeps its center of mass at target
+    (moving with target_velocity), by setting its control actions.
+
+    The targets live in the craft's row of its Fleet, and the control laws of the whole fleet
+    are evaluated together by steer when the fleet steps. None switches a part of the autopilot off,
+    leaving those control actions to whoever else sets them.
+
+    Both laws are PD controllers, tuned as critically damped oscillators of the given frequency,
+    whose torque or force is turned into on/off actions past a deadband of the largest one.
+    """
+
+    forward = (0, 0, -1)
+    attitude_frequency = 1.0
+    translation_frequency = 0.2
+    damping = 1.0
+    deadband = 0.1
 
     def __init__(self, craft):
         self.craft = craft
-        self.target_direction = None
-        self.target = None
+
+    def get_row(self, name):
+        value = getattr(self.craft.fleet, name)[self.craft.index]
+        return None if np.isnan(value[0]) else Q(value.tolist())
+
+    def set_row(self, name, value):
+        getattr(self.craft.fleet, name)[self.craft.index] = np.nan if value is None else gm.vector3(value)
+
+    @property
+    def target_direction(self):
+        return self.get_row('target_directions')
+
+    @target_direction.setter
+    def target_direction(self, direction):
+        if direction is not None:
+            direction = gm.vector3(direction) / np.linalg.norm(gm.vector3(direction))
+        self.set_row('target_directions', direction)
+
+    @property
+    def target(self):
+        return self.get_row('targets')
+
+    @target.setter
+    def target(self, target):
+        self.set_row('targets', target)
+
+    @property
+    def target_velocity(self):
+        return Q(self.craft.fleet.target_velocities[self.craft.index].tolist())
+
+    @target_velocity.setter
+    def target_velocity(self, velocity):
+        self.craft.fleet.target_velocities[self.craft.index] = gm.vector3(velocity)
 
     def update(self):
-        if self.target_direction is not None:
-            anomaly = self.target_direction.unmorphed(*self.craft.unit_vectors)
\ No newline at end of file
+        steer(self.craft.fleet, [self.craft.index])
+
+
+def bang_bang(commands, limits, deadband):
+    """(n, 6) on/off actions (+, - for every axis) for (n, 3) commands, with dead bands of deadband*limits"""
+    on = np.abs(commands) > deadband*limits
+    actions = np.empty((len(commands), 6), dtype=bool)
+    actions[:, 0::2] = on & (commands > 0)
+    actions[:, 1::2] = on & (commands < 0)
+    return actions
+
+
+def pointing_errors(directions, forward):
+    """Body-frame rotation vectors turning `forward` onto (n, 3) unit directions"""
+    crosses = np.cross(forward, directions)
+    sines = np.linalg.norm(crosses, axis=1)
+    angles = np.arctan2(sines, directions @ forward)
+    # Pointing straight away from the target: any axis perpendicular to forward will do
+    perpendicular = np.cross(forward, (1, 0, 0) if abs(forward[0]) < 0.9 else (0, 1, 0))
+    axes = np.where(sines[:, None] > 1e-9, crosses / np.maximum(sines, 1e-9)[:, None], perpendicular / np.linalg.norm(perpendicular))
+    return axes * angles[:, None]
+
+
+def steer(fleet, rows=None):
+    """Evaluates the autopilots of a fleet (or of some rows of it) at once, and writes their control actions"""
+    rows = np.arange(len(fleet)) if rows is None else np.asarray(rows, dtype=int)
+    bodies = fleet.bodies
+    forward = np.array(Autopilot.forward, dtype=float)
+
+    pointing = rows[~np.isnan(fleet.target_directions[rows, 0])]
+    if len(pointing):
+        bases = bodies.get_bases(pointing)
+        # World vectors into body coordinates are basis @ v, since the rows of a basis are the body axes
+        directions = np.einsum('nij,nj->ni', bases, fleet.target_directions[pointing])
+        angular_velocities = np.einsum('nij,nj->ni', bases, bodies.get_angular_velocities(pointing, bases))
+
+        frequency = Autopilot.attitude_frequency
+        accelerations = frequency**2*pointing_errors(directions, forward) - 2*Autopilot.damping*frequency*angular_velocities
+        torques = np.einsum('nij,nj->ni', bodies.inertias[pointing], accelerations)
+        fleet.controls[pointing, :6] = bang_bang(torques, fleet.max_torques[pointing], Autopilot.deadband)
+
+    holding = rows[~np.isnan(fleet.targets[rows, 0])]
+    if len(holding):
+        bases = bodies.get_bases(holding)
+        offsets = fleet.targets[holding] - bodies.positions[holding]
+        velocities = bodies.velocities[holding] - fleet.target_velocities[holding]
+
+        frequency = Autopilot.translation_frequency
+        accelerations = frequency**2*offsets - 2*Autopilot.damping*frequency*velocities
+        forces = np.einsum('nij,nj->ni', bases, bodies.masses[holding, None]*accelerations)
+        fleet.controls[holding, 6:] = bang_bang(forces, fleet.max_forces[holding], Autopilot.deadband)
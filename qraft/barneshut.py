@@ -0,0 +1,245 @@
+import numpy as np
+
+
+MAX_DEPTH = 21 # 3*21 bits of a Morton key fit in 64 bits
+
+
+def spread_bits(x):
+    """Spreads the lowest 21 bits of x so that there are two zero bits between each of them"""
+    x = x.astype(np.uint64) & np.uint64(0x1fffff)
+    x = (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    x = (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    x = (x | x << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    x = (x | x << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    x = (x | x << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return x
+
+
+def morton_keys(cells):
+    """Interleaves (n, 3) integer cell coordinates into (n,) Morton keys"""
+    return spread_bits(cells[:, 0]) << np.uint64(2) | spread_bits(cells[:, 1]) << np.uint64(1) | spread_bits(cells[:, 2])
+
+
+def concatenated_ranges(counts):
+    """Returns arange(c) for every c in counts, concatenated"""
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
+
+
+class Octree:
+    """
+    A linear octree over bodies sorted by Morton key.
+
+    Every node covers the contiguous range start:end of the sorted bodies, and its children
+    are the nodes first_child:first_child+child_count (first_child is -1 for leaves).
+    The topology only depends on the positions at build time; refit updates the
+    mass, center of mass and size of every node for new positions without rebuilding.
+    """
+
+    def __init__(self, positions, masses, leaf_size=8, max_depth=MAX_DEPTH):
+        self.leaf_size = leaf_size
+        self.max_depth = min(max_depth, MAX_DEPTH)
+        self.build(positions)
+        self.refit(positions, masses)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def build(self, positions):
+        n = len(positions)
+        low = positions.min(axis=0)
+        side = np.max(positions.max(axis=0) - low) or 1
+        resolution = 2**self.max_depth
+        cells = np.clip(((positions - low) / side * resolution).astype(np.int64), 0, resolution - 1)
+
+        keys = morton_keys(cells)
+        self.order = np.argsort(keys, kind='stable')
+        keys = keys[self.order]
+
+        starts, ends, first_child, child_count = [np.array([0])], [np.array([n])], [], []
+        node_count = 1
+        split = np.array([0]) if n > self.leaf_size else np.array([], dtype=int)
+
+        for level in range(1, self.max_depth + 1):
+            level_starts, level_ends = starts[-1], ends[-1]
+            level_first_child = np.full(len(level_starts), -1)
+            level_child_count = np.zeros(len(level_starts), dtype=int)
+
+            if len(split):
+                split_starts, split_ends = level_starts[split], level_ends[split]
+
+                # Bodies inside a node being split, and where their level prefix changes
+                inside = np.cumsum(np.bincount(split_starts, minlength=n+1) - np.bincount(split_ends, minlength=n+1))[:n] > 0
+                prefixes = keys >> np.uint64(3*(self.max_depth - level))
+                changes = np.flatnonzero(prefixes[1:] != prefixes[:-1]) + 1
+                changes = changes[inside[changes]]
+
+                child_starts = np.union1d(split_starts, changes)
+                parents = np.searchsorted(split_starts, child_starts, side='right') - 1
+                child_ends = np.minimum(np.append(child_starts[1:], n), split_ends[parents])
+
+                level_first_child[split] = node_count + np.searchsorted(child_starts, split_starts)
+                level_child_count[split] = np.bincount(parents, minlength=len(split))
+
+                starts.append(child_starts)
+                ends.append(child_ends)
+
+            first_child.append(level_first_child)
+            child_count.append(level_child_count)
+
+            if not len(split):
+                break
+
+            node_count += len(starts[-1])
+            split = np.flatnonzero(ends[-1] - starts[-1] > self.leaf_size) if level < self.max_depth else np.array([], dtype=int)
+
+        if len(first_child) < len(starts):
+            first_child.append(np.full(len(starts[-1]), -1))
+            child_count.append(np.zeros(len(starts[-1]), dtype=int))
+
+        self.starts = np.concatenate(starts)
+        self.ends = np.concatenate(ends)
+        self.first_child = np.concatenate(first_child)
+        self.child_count = np.concatenate(child_count)
+
+    def refit(self, positions, masses):
+        """Recomputes node masses, centers of mass and sizes, keeping the topology"""
+        sorted_positions = positions[self.order]
+        sorted_masses = masses[self.order]
+
+        cumulative_masses = np.concatenate([[0], np.cumsum(sorted_masses)])
+        cumulative_moments = np.concatenate([np.zeros((1, 3)), np.cumsum(sorted_masses[:, None] * sorted_positions, axis=0)])
+        self.masses = cumulative_masses[self.ends] - cumulative_masses[self.starts]
+        moments = cumulative_moments[self.ends] - cumulative_moments[self.starts]
+
+        # Node sizes come from the bounding boxes of their bodies, which stay valid as bodies move
+        padded = np.concatenate([sorted_positions, sorted_positions[-1:]])
+        bounds = np.column_stack([self.starts, self.ends]).ravel()
+        low = np.minimum.reduceat(padded, bounds)[::2]
+        high = np.maximum.reduceat(padded, bounds)[::2]
+        self.sizes = np.max(high - low, axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.centers = np.where(self.masses[:, None] > 0, moments / self.masses[:, None], (low + high) / 2)
+
+
+def evaluate(targets, sources, masses, G=1, softening=0):
+    """
+    Accelerations of (k, 3) targets from (m, 3) sources of (m,) masses, by direct summation.
+
+    Sources at the same position as a target (the target itself, without softening) exert no force on it.
+    The pairs are worked on one coordinate at a time, as in physics.direct_jerks.
+    """
+    x, y = targets.T, sources.T
+    dx, dy, dz = separations = y[:, None, :] - x[:, :, None]
+    with np.errstate(divide='ignore'):
+        inverse_squares = 1 / (dx*dx + dy*dy + dz*dz + softening**2)
+    inverse_squares[np.isinf(inverse_squares)] = 0
+    weights = G * masses * inverse_squares * np.sqrt(inverse_squares)
+    return np.einsum('kn,ckn->kc', weights, separations)
+
+
+class BarnesHut:
+    """
+    Barnes-Hut force solver, usable as NBody(..., solver=BarnesHut()).
+
+    The tree is walked once per group of bodies rather than once per body: groups are runs of group_size bodies
+    in Morton order, and a node is used as a point mass for the whole group when size / distance < theta
+    for the nearest point of the group's bounding box. The accepted nodes and the bodies of the opened leaves
+    then act on all bodies of the group at once.
+
+    theta: opening angle; a node is used as a point mass when size / distance < theta
+    leaf_size: maximum number of bodies in a leaf, which is summed directly
+    rebuild_interval: the tree is rebuilt every this many evaluations and only refit in between
+    chunk_size: number of bodies (in whole groups) walking the tree at once, which bounds memory use
+    group_size: number of bodies sharing one walk of the tree
+    """
+
+    def __init__(self, theta=0.5, leaf_size=8, rebuild_interval=1, chunk_size=4096, group_size=32):
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.rebuild_interval = rebuild_interval
+        self.chunk_size = chunk_size
+        self.group_size = group_size
+        self.tree = None
+        self.evaluations = 0
+
+    def get_tree(self, positions, masses):
+        if self.tree is None or len(self.tree.order) != len(positions) or self.evaluations % self.rebuild_interval == 0:
+            self.tree = Octree(positions, masses, self.leaf_size)
+        else:
+            self.tree.refit(positions, masses)
+        self.evaluations += 1
+        return self.tree
+
+    def __call__(self, positions, masses, G=1, softening=0):
+        n = len(positions)
+        accelerations = np.zeros((n, 3))
+        if n == 0:
+            return accelerations
+
+        tree = self.get_tree(positions, masses)
+        size = self.group_size
+        group_count = -(-n // size)
+        # The last group is filled up with copies of the last body, whose accelerations are dropped
+        sorted_positions = positions[tree.order]
+        padded = np.concatenate([sorted_positions, np.repeat(sorted_positions[-1:], group_count*size - n, axis=0)])
+        group_positions = padded.reshape(group_count, size, 3)
+        lows, highs = group_positions.min(axis=1), group_positions.max(axis=1)
+
+        sorted_accelerations = np.zeros((group_count, size, 3))
+        groups_per_chunk = max(1, self.chunk_size // size)
+        for first in range(0, group_count, groups_per_chunk):
+            groups = np.arange(first, min(first + groups_per_chunk, group_count))
+            source_groups, source_positions, source_masses = self.walk(
+                tree, positions, masses, lows[groups], highs[groups], groups*size, np.minimum(groups*size + size, n))
+            order = np.argsort(source_groups, kind='stable')
+            bounds = np.searchsorted(source_groups[order], np.arange(len(groups) + 1))
+            for group, start, end in zip(groups, bounds[:-1], bounds[1:]):
+                sorted_accelerations[group] = evaluate(
+                    group_positions[group], source_positions[order[start:end]], source_masses[order[start:end]], G, softening)
+
+        accelerations[tree.order] = sorted_accelerations.reshape(-1, 3)[:n]
+        return accelerations
+
+    def walk(self, tree, positions, masses, lows, highs, starts, ends):
+        """
+        Walks the tree for groups of bodies at once, given by the (g, 3) corners of their bounding boxes
+        and their ranges starts:ends of the sorted bodies, one level of (group, node) pairs at a time.
+
+        Returns the interaction lists of all groups, as the group index, (m, 3) position and (m,) mass
+        of every point mass (accepted node) or body (of an opened leaf) that acts on a group's bodies.
+        """
+        groups = np.arange(len(lows))
+        nodes = np.zeros(len(lows), dtype=int)
+        source_groups, source_positions, source_masses = [], [], []
+
+        while len(groups):
+            centers = tree.centers[nodes]
+            # From the center of mass to the nearest point of the group's box (0 inside it)
+            gaps = np.maximum(lows[groups] - centers, 0) + np.maximum(centers - highs[groups], 0)
+            far = tree.sizes[nodes]**2 < self.theta**2 * np.einsum('ij,ij->i', gaps, gaps)
+            # Nodes holding bodies of the group itself are always opened, so that no body attracts itself
+            far &= (tree.starts[nodes] >= ends[groups]) | (tree.ends[nodes] <= starts[groups])
+            leaf = tree.first_child[nodes] < 0
+
+            source_groups.append(groups[far])
+            source_positions.append(centers[far])
+            source_masses.append(tree.masses[nodes[far]])
+
+            # Open leaves are summed body by body; a body acting on itself is left out by evaluate
+            near_leaves = ~far & leaf
+            leaf_nodes = nodes[near_leaves]
+            counts = tree.ends[leaf_nodes] - tree.starts[leaf_nodes]
+            bodies = tree.order[np.repeat(tree.starts[leaf_nodes], counts) + concatenated_ranges(counts)]
+            source_groups.append(np.repeat(groups[near_leaves], counts))
+            source_positions.append(positions[bodies])
+            source_masses.append(masses[bodies])
+
+            # Open internal nodes are replaced by their children
+            opened = ~far & ~leaf
+            counts = tree.child_count[nodes[opened]]
+            groups = np.repeat(groups[opened], counts)
+            nodes = np.repeat(tree.first_child[nodes[opened]], counts) + concatenated_ranges(counts)
+
+        return np.concatenate(source_groups), np.concatenate(source_positions), np.concatenate(source_masses)
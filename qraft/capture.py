@@ -0,0 +1,217 @@
+import os
+import ctypes
+import queue
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+import pygame
+from OpenGL.GL import glGenBuffers, glDeleteBuffers, glBindBuffer, glBufferData, glMapBuffer, glUnmapBuffer, glReadPixels
+from OpenGL.GL import GL_PIXEL_PACK_BUFFER, GL_STREAM_READ, GL_READ_ONLY, GL_RGBA, GL_UNSIGNED_BYTE
+
+
+def write_png(frame, filename, flip=False):
+    """Encodes a (height, width, 4) uint8 frame; flip turns a bottom-up GL frame the right way up"""
+    if flip:
+        frame = frame[::-1]
+    height, width = frame.shape[:2]
+    pygame.image.save(pygame.image.frombuffer(np.ascontiguousarray(frame).tobytes(), (width, height), "RGBA"), filename)
+
+
+class PNGSequence:
+    """
+    Encodes frames as numbered PNG files on a pool of worker threads (or processes).
+
+    max_queue: frames waiting to be encoded; further frames are refused instead of blocking the caller
+    """
+
+    def __init__(self, directory='.', prefix='frame', workers=2, processes=False, max_queue=16):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_queue = max_queue
+        self.executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    def submit(self, frame, index, flip=False):
+        with self.lock:
+            if len(self.pending) >= self.max_queue:
+                return False
+            future = self.executor.submit(write_png, frame, os.path.join(self.directory, f"{self.prefix}{index:06d}.png"), flip)
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return True
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class EncoderPipe:
+    """
+    Writes raw RGBA frames, in order, to the standard input of an encoder process on a background thread.
+
+    command: e.g. ['ffmpeg', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '800x600', '-r', '60', '-i', '-', 'out.mp4']
+    timeout: seconds that close waits for the writer before giving up on the encoder
+
+    If the encoder exits (a bad codec, a full disk), the error is kept in self.error
+    and further frames are refused.
+    """
+
+    def __init__(self, command, max_queue=16, timeout=10):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.queue = queue.Queue(max_queue)
+        self.timeout = timeout
+        self.error = None
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def submit(self, frame, index, flip=False):
+        if self.error is not None:
+            return False
+        try:
+            self.queue.put_nowait((frame, flip))
+            return True
+        except queue.Full:
+            return False
+
+    def write_frames(self):
+        while (item := self.queue.get()) is not None:
+            if self.error is not None:
+                # Keep emptying the queue, so that close can always hand over its sentinel
+                continue
+            frame, flip = item
+            try:
+                self.process.stdin.write(np.ascontiguousarray(frame[::-1] if flip else frame).tobytes())
+            except (OSError, ValueError) as error:
+                self.error = error
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=self.timeout)
+            self.thread.join(self.timeout)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            # The writer is stuck on an encoder that stopped reading
+            self.error = self.error or TimeoutError("The encoder stopped taking frames.")
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError as error:
+            self.error = self.error or error
+        self.process.wait()
+
+
+class FrameCapture:
+    """
+    Captures frames without stalling the render loop, and hands them to a sink (PNGSequence or EncoderPipe).
+
+    With an OpenGL Scene, pixels are read back through two pixel buffer objects in turn: each call starts
+    an asynchronous read of the current frame and collects the one started the call before, so frames
+    arrive one call late. A HeadlessScene's framebuffer is handed over directly.
+    For a single frame (a screenshot), flush collects it on a later frame without starting another read.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pixel_buffers = None
+        self.pending_read = None
+        self.index = 0
+
+        self.captured = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self):
+        return self.sink.queue_depth
+
+    def capture(self, scene):
+        if hasattr(scene, 'rasterizer'):
+            self.submit(scene.get_buffer())
+        else:
+            self.read_pixels(*scene.window.get_size())
+
+    def submit(self, frame, flip=False):
+        if self.sink.submit(frame, self.index, flip):
+            self.captured += 1
+        else:
+            self.dropped += 1
+        self.index += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def read_pixels(self, width, height):
+        size = width * height * 4
+        if self.pixel_buffers is None or self.pixel_buffers[2] != (width, height):
+            if self.pending_read is not None:
+                # The frame still being read goes with the old buffers
+                self.dropped += 1
+                self.index += 1
+            self.delete_buffers()
+            buffers = glGenBuffers(2)
+            for buffer in buffers:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+                glBufferData(GL_PIXEL_PACK_BUFFER, size, None, GL_STREAM_READ)
+            self.pixel_buffers = [buffers[0], buffers[1], (width, height)]
+
+        # Start reading this frame into one buffer; glReadPixels returns at once since the target is a buffer
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pixel_buffers[0])
+        glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+
+        if self.pending_read is not None:
+            self.collect(*self.pending_read)
+        self.pending_read = (self.pixel_buffers[0], width, height)
+
+        self.pixel_buffers[0], self.pixel_buffers[1] = self.pixel_buffers[1], self.pixel_buffers[0]
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def collect(self, buffer, width, height):
+        """Copies a finished read out of its pixel buffer and submits it"""
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        address = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        if address:
+            frame = np.ctypeslib.as_array((ctypes.c_ubyte * (width*height*4)).from_address(address)).reshape(height, width, 4).copy()
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            self.submit(frame, flip=True)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def delete_buffers(self):
+        if self.pixel_buffers is not None:
+            glDeleteBuffers(2, self.pixel_buffers[:2])
+            self.pixel_buffers = None
+            self.pending_read = None
+
+    def flush(self):
+        """Collects the frame still being read, if any, without starting a new read"""
+        if self.pending_read is not None:
+            self.collect(*self.pending_read)
+            self.pending_read = None
+
+    def close(self):
+        """Collects the last frame still being read, waits for the sink to finish and frees the pixel buffers"""
+        self.flush()
+        self.delete_buffers()
+        self.sink.close()
+
+    def get_stats(self):
+        return {
+            'captured': self.captured,
+            'dropped': self.dropped,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+        }
@@ -0,0 +1,267 @@
+import numpy as np
+
+from . import geometry as gm
+
+
+SPHERE = 0
+BOX = 1
+
+
+def get_shapes(node):
+    """
+    Yields the collision shapes of a scene graph subtree as (kind, center, rotation, half_sizes) in world coordinates,
+    from the world transforms of the last update_transform. Spheres and cuboids are exact; other meshes,
+    the instances of an InstancedMesh and baked groups are taken as their bounding spheres.
+    """
+    if isinstance(node, gm.Sphere):
+        yield SPHERE, node.world_position, gm.IDENTITY, np.full(3, node.radius, dtype=float)
+    elif isinstance(node, gm.Cuboid):
+        yield BOX, node.world_position, node.world_rotation, 0.5*np.abs(gm.vector3(node.size))
+    elif isinstance(node, (gm.Mesh, gm.InstancedMesh)):
+        for center, radius in zip(*node.get_bounds()):
+            yield SPHERE, center, gm.IDENTITY, np.full(3, radius)
+    else:
+        for child in node.children:
+            yield from get_shapes(child)
+
+
+def get_pairs(lows, highs, cell_size=None, max_cells=64):
+    """
+    Returns the (m, 2) index pairs i < j of the axis-aligned boxes (lows, highs) that overlap, with a uniform spatial hash.
+
+    Every box is put in all the cells it touches, and a pair is only reported from the cell holding the low corner
+    of the overlap of its boxes, so that it comes up once. Boxes spanning more than max_cells cells (a planet among
+    small bodies) are tested against all the others directly instead.
+
+    cell_size: edge of the cells, the median box size by default
+    """
+    n = len(lows)
+    if cell_size is None:
+        cell_size = np.median(np.max(highs - lows, axis=1)) if n else 1
+    cell_size = cell_size or 1
+
+    first = np.floor(lows / cell_size).astype(np.int64)
+    extents = np.floor(highs / cell_size).astype(np.int64) - first + 1
+    large = np.prod(extents.astype(float), axis=1) > max_cells
+    pairs = []
+
+    small = np.flatnonzero(~large)
+    counts = np.prod(extents[small], axis=1)
+    owners = np.repeat(small, counts)
+    local = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    sizes = extents[owners]
+    cells = first[owners] + np.stack([local % sizes[:, 0], local // sizes[:, 0] % sizes[:, 1], local // (sizes[:, 0]*sizes[:, 1])], axis=1)
+
+    # Sorting brings the boxes in the same cell together; every pair within a run of equal cells is a candidate
+    order = np.lexsort(cells.T[::-1])
+    cells, owners = cells[order], owners[order]
+    new = np.ones(len(cells), dtype=bool)
+    new[1:] = np.any(cells[1:] != cells[:-1], axis=1)
+    starts = np.flatnonzero(new)
+    runs = np.diff(np.append(starts, len(cells)))
+    partners = np.repeat(runs, runs) - 1 - (np.arange(len(cells)) - np.repeat(starts, runs))
+    a = np.repeat(np.arange(len(cells)), partners)
+    b = a + 1 + np.arange(len(a)) - np.repeat(np.cumsum(partners) - partners, partners)
+
+    i, j = owners[a], owners[b]
+    overlapping = np.all((lows[i] <= highs[j]) & (lows[j] <= highs[i]), axis=1)
+    home = np.all(np.floor(np.maximum(lows[i], lows[j]) / cell_size).astype(np.int64) == cells[a], axis=1)
+    keep = overlapping & home
+    pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1)[keep])
+
+    for i in np.flatnonzero(large):
+        j = np.flatnonzero(np.all((lows[i] <= highs) & (lows <= highs[i]), axis=1))
+        j = j[~large[j] | (j > i)]
+        pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1))
+
+    pairs = np.concatenate(pairs).reshape(-1, 2)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def sphere_sphere(centers_a, radii_a, centers_b, radii_b):
+    """Normals (from a to b) and penetration depths of sphere pairs, positive where they overlap"""
+    offsets = centers_b - centers_a
+    distances = np.linalg.norm(offsets, axis=1)
+    # Concentric spheres: any direction will do
+    normals = np.where(distances[:, None] > 0, offsets / np.maximum(distances, 1e-300)[:, None], (1, 0, 0))
+    return normals, radii_a + radii_b - distances
+
+
+def box_sphere(box_centers, rotations, half_sizes, centers, radii):
+    """Normals (from the box to the sphere) and penetration depths of box-sphere pairs"""
+    local = np.einsum('nij,nj->ni', rotations, centers - box_centers)
+    closest = np.clip(local, -half_sizes, half_sizes)
+    outside = local - closest
+    distances = np.linalg.norm(outside, axis=1)
+
+    # A center inside the box is pushed out through the nearest face
+    gaps = half_sizes - np.abs(local)
+    rows, axes = np.arange(len(local)), np.argmin(gaps, axis=1)
+    inside_normals = np.zeros_like(local)
+    inside_normals[rows, axes] = np.where(local[rows, axes] < 0, -1, 1)
+
+    inside = distances == 0
+    normals = np.where(inside[:, None], inside_normals, outside / np.maximum(distances, 1e-300)[:, None])
+    depths = np.where(inside, radii + gaps[rows, axes], radii - distances)
+    return np.einsum('ni,nij->nj', normals, rotations), depths
+
+
+def box_box(centers_a, rotations_a, half_sizes_a, centers_b, rotations_b, half_sizes_b):
+    """
+    Normals (from a to b) and penetration depths of oriented box pairs, by the separating axis theorem:
+    the depth is the smallest overlap of the boxes' projections on the 15 candidate axes
+    """
+    crosses = np.cross(rotations_a[:, :, None, :], rotations_b[:, None, :, :]).reshape(-1, 9, 3)
+    lengths = np.linalg.norm(crosses, axis=2)
+    # Parallel edges give no axis
+    degenerate = lengths < 1e-9
+    crosses /= np.where(degenerate, 1, lengths)[:, :, None]
+    axes = np.concatenate([rotations_a, rotations_b, crosses], axis=1)
+
+    distances = np.einsum('nki,ni->nk', axes, centers_b - centers_a)
+    extents_a = np.einsum('nkj,nj->nk', np.abs(np.einsum('nji,nki->nkj', rotations_a, axes)), half_sizes_a)
+    extents_b = np.einsum('nkj,nj->nk', np.abs(np.einsum('nji,nki->nkj', rotations_b, axes)), half_sizes_b)
+    overlaps = extents_a + extents_b - np.abs(distances)
+    overlaps[:, 6:][degenerate] = np.inf
+
+    rows, best = np.arange(len(axes)), np.argmin(overlaps, axis=1)
+    normals = axes[rows, best] * np.where(distances[rows, best] < 0, -1, 1)[:, None]
+    return normals, overlaps[rows, best]
+
+
+def support(centers, rotations, half_sizes, directions):
+    """The corners of oriented boxes furthest along directions"""
+    signs = np.where(np.einsum('nji,ni->nj', rotations, directions) < 0, -1, 1)
+    return centers + np.einsum('nj,nji->ni', signs*half_sizes, rotations)
+
+
+class Contacts:
+    """
+    The contacts found in one step.
+
+    pairs: (m, 2) indices of the touching shapes, first < second
+    objects: (m, 2) indices of the objects (or bodies) the shapes belong to
+    normals: unit vectors pointing from the first shape into the second
+    depths: how far the shapes overlap along the normals
+    points: world points between the two surfaces (a corner of the overlap for two boxes)
+    """
+
+    def __init__(self, pairs, objects, normals, depths, points):
+        self.pairs = pairs
+        self.objects = objects
+        self.normals = normals
+        self.depths = depths
+        self.points = points
+
+    def __len__(self):
+        return len(self.pairs)
+
+
+class Colliders:
+    """
+    Collision shapes in world coordinates, kept as arrays: kinds (SPHERE or BOX), centers, rotations
+    (whose rows are the box axes), half_sizes (the radius three times for spheres) and bounding radii.
+    owners gives the index of the object that every shape belongs to; shapes of the same object never collide.
+
+    Built from scene objects (see get_shapes), which refresh reads again after they have moved,
+    or straight from arrays of spheres with set_spheres, e.g. for the bodies of an NBody.
+    """
+
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self.refresh()
+
+    @classmethod
+    def from_spheres(cls, centers, radii):
+        colliders = cls()
+        colliders.set_spheres(centers, radii)
+        return colliders
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def set_shapes(self, kinds, centers, rotations, half_sizes, owners):
+        self.kinds = np.asarray(kinds, dtype=int).reshape(-1)
+        self.centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        self.rotations = np.asarray(rotations, dtype=float).reshape(-1, 3, 3)
+        self.half_sizes = np.asarray(half_sizes, dtype=float).reshape(-1, 3)
+        self.owners = np.asarray(owners, dtype=int).reshape(-1)
+        self.radii = np.where(self.kinds == SPHERE, self.half_sizes[:, 0], np.linalg.norm(self.half_sizes, axis=1))
+
+    def set_spheres(self, centers, radii):
+        """Replaces the shapes with one sphere per object"""
+        centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=float), len(centers))
+        n = len(centers)
+        self.set_shapes(np.full(n, SPHERE), centers, np.broadcast_to(gm.IDENTITY, (n, 3, 3)), radii[:, None]*np.ones(3), np.arange(n))
+
+    def refresh(self):
+        """Reads the shapes of the objects again, after their transforms were updated (e.g. by Scene.update)"""
+        shapes = [(owner, *shape) for owner, obj in enumerate(self.objects) for shape in get_shapes(obj)]
+        owners, kinds, centers, rotations, half_sizes = zip(*shapes) if shapes else ((), (), (), (), ())
+        self.set_shapes(kinds, centers, rotations, half_sizes, owners)
+
+    def get_boxes(self):
+        """Axis-aligned world bounding boxes (lows, highs) of the shapes"""
+        extents = np.where((self.kinds == SPHERE)[:, None], self.half_sizes,
+                           np.einsum('ni,nij->nj', self.half_sizes, np.abs(self.rotations)))
+        return self.centers - extents, self.centers + extents
+
+    def detect(self, cell_size=None, max_cells=64):
+        """Returns the Contacts between the shapes as they are now (see get_pairs for the arguments)"""
+        pairs = get_pairs(*self.get_boxes(), cell_size, max_cells)
+        pairs = pairs[self.owners[pairs[:, 0]] != self.owners[pairs[:, 1]]]
+        i, j = pairs.T
+        normals, depths = np.zeros((len(pairs), 3)), np.zeros(len(pairs))
+        kinds = self.kinds
+
+        cases = (kinds[i] == SPHERE) & (kinds[j] == SPHERE)
+        normals[cases], depths[cases] = sphere_sphere(self.centers[i[cases]], self.radii[i[cases]], self.centers[j[cases]], self.radii[j[cases]])
+        cases = (kinds[i] == BOX) & (kinds[j] == BOX)
+        normals[cases], depths[cases] = box_box(
+            self.centers[i[cases]], self.rotations[i[cases]], self.half_sizes[i[cases]],
+            self.centers[j[cases]], self.rotations[j[cases]], self.half_sizes[j[cases]])
+        for box, sphere, sign in ((i, j, 1), (j, i, -1)):
+            cases = (kinds[box] == BOX) & (kinds[sphere] == SPHERE)
+            box_normals, depths[cases] = box_sphere(
+                self.centers[box[cases]], self.rotations[box[cases]], self.half_sizes[box[cases]],
+                self.centers[sphere[cases]], self.radii[sphere[cases]])
+            normals[cases] = sign*box_normals
+
+        # Halfway between the two surfaces, measured from a sphere where there is one
+        points = np.zeros((len(pairs), 3))
+        for shape, sign, cases in ((i, 1, kinds[i] == SPHERE), (j, -1, (kinds[i] == BOX) & (kinds[j] == SPHERE))):
+            points[cases] = self.centers[shape[cases]] \
+                + sign*normals[cases]*(self.radii[shape[cases]] - depths[cases]/2)[:, None]
+        cases = (kinds[i] == BOX) & (kinds[j] == BOX)
+        points[cases] = (support(self.centers[i[cases]], self.rotations[i[cases]], self.half_sizes[i[cases]], normals[cases])
+                         + support(self.centers[j[cases]], self.rotations[j[cases]], self.half_sizes[j[cases]], -normals[cases])) / 2
+
+        touching = depths > 0
+        pairs = pairs[touching]
+        return Contacts(pairs, self.owners[pairs], normals[touching], depths[touching], points[touching])
+
+
+def resolve(contacts, positions, velocities, masses, restitution=0, correction=1):
+    """
+    Pushes touching bodies apart: an impulse along the normal stops them approaching (bouncing back by restitution),
+    and they are moved apart by correction times the depth, both shared by inverse mass. All contacts are resolved
+    at once from the same state, so a body in several contacts gets the sum of their corrections.
+
+    positions, velocities, masses: arrays of the bodies that contacts.objects refer to, changed in place
+    """
+    i, j = contacts.objects.T
+    with np.errstate(divide='ignore'):
+        inverse_masses = np.where(masses > 0, 1 / masses, 0)
+    weights = inverse_masses[i] + inverse_masses[j]
+    weights = np.where(weights > 0, weights, np.inf)
+
+    normals = contacts.normals
+    approach = np.einsum('ni,ni->n', velocities[j] - velocities[i], normals)
+    impulses = np.where(approach < 0, -(1 + restitution)*approach / weights, 0)[:, None] * normals
+    np.add.at(velocities, i, -impulses*inverse_masses[i, None])
+    np.add.at(velocities, j, impulses*inverse_masses[j, None])
+
+    shifts = (correction*contacts.depths / weights)[:, None] * normals
+    np.add.at(positions, i, -shifts*inverse_masses[i, None])
+    np.add.at(positions, j, shifts*inverse_masses[j, None])
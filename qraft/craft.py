@@ -1,8 +1,14 @@
+from collections.abc import MutableMapping
+
+import numpy as np
 
 from aquaternion import *
 
-from autopilot import Autopilot
-from geometry import Mesh, Group
+from .autopilot import Autopilot
+from . import autopilot
+from .geometry import Mesh, Group
+from . import geometry as gm
+from . import rigidbody
 
 control_actions = {
     'pitch+': False,
@@ -19,31 +25,216 @@ control_actions = {
     'z-': False,
 }
 
+
+class ControlActions(MutableMapping):
+    """The control_actions of a craft, as a dict backed by the craft's row of Fleet.controls"""
+
+    columns = {action: i for i, action in enumerate(control_actions)}
+
+    def __init__(self, craft):
+        self.craft = craft
+
+    def __getitem__(self, action):
+        return bool(self.craft.fleet.controls[self.craft.index, ControlActions.columns[action]])
+
+    def __setitem__(self, action, value):
+        self.craft.fleet.controls[self.craft.index, ControlActions.columns[action]] = value
+
+    def __delitem__(self, action):
+        raise TypeError("Control actions can't be removed.")
+
+    def __iter__(self):
+        return iter(control_actions)
+
+    def __len__(self):
+        return len(control_actions)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class Craft:
+    """
+    A rigid body made of Parts, whose state lives in a row of its Fleet's arrays.
 
-    def __init__(self):
+    The position is that of the craft's own origin, which the parts are placed relative to;
+    the velocity is that of its center of mass. Reading position, velocity, unit_vectors or
+    angular_velocity gives a copy, so changes have to be assigned back (or use rotate).
+
+    max_force: largest thrust along the body axes (x, y, z)
+    max_torque: largest torque about the body axes (pitch, yaw, roll)
+    """
 
-        self.position = Q([0, 0, 0])
-        self.velocity = Q([0, 0, 0])
+    max_force = (1e4, 1e4, 1e4)
+    max_torque = (1e3, 1e3, 1e3)
 
-        self.unit_vectors = UV.copy()
-        self.axis_of_rotation = Q([0, 0, 0])
+    def __init__(self):
 
         if not hasattr(self, 'parts'):
             self.parts = []
-        
-        self.mass, self.center_of_mass = Craft.get_mass(self.parts)
 
-        self.control_actions = control_actions.copy()
+        self.fleet = None
+        self.index = None
+        self.mass, self.center_of_mass, self.inertia = Craft.get_mass_properties(self.parts)
+        Fleet([self])
+
+        self.control_actions = ControlActions(self)
         self.autopilot = Autopilot(self)
-    
+
+    @staticmethod
+    def get_mass_properties(parts):
+        """Mass, center of mass and inertia tensor (about the center of mass) of parts, in the craft frame"""
+        return rigidbody.combine([
+            rigidbody.transform(rigidbody.get_mass_properties(part), gm.basis(part.unit_vectors), gm.vector3(part.position))
+            for part in parts])
+
     @staticmethod
     def get_mass(parts):
-        mass = sum([part.mass for part in parts])
-        center_of_mass = sum([part.center_of_mass*part.mass for part in parts])/mass
+        mass, center_of_mass, _ = Craft.get_mass_properties(parts)
         return mass, center_of_mass
-    
+
+    def add_part(self, part):
+        self.parts.append(part)
+        self.fleet.changed.add(self)
+
+    def remove_part(self, part):
+        self.parts.remove(part)
+        self.fleet.changed.add(self)
+
+    def update_mass_properties(self):
+        """Recomputes the mass properties after the parts changed, keeping the craft's origin in place"""
+        position = self.position
+        self.mass, self.center_of_mass, self.inertia = Craft.get_mass_properties(self.parts)
+        self.fleet.bodies.set_mass(self.index, self.mass, self.inertia)
+        self.position = position
+
+    def get_basis(self):
+        return rigidbody.get_bases(self.fleet.bodies.orientations[self.index])
+
+    @property
+    def position(self):
+        return Q((self.fleet.bodies.positions[self.index] - self.center_of_mass @ self.get_basis()).tolist())
+
+    @position.setter
+    def position(self, position):
+        self.fleet.bodies.positions[self.index] = gm.vector3(position) + self.center_of_mass @ self.get_basis()
+
+    @property
+    def velocity(self):
+        return Q(self.fleet.bodies.velocities[self.index].tolist())
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self.fleet.bodies.velocities[self.index] = gm.vector3(velocity)
+
+    @property
+    def unit_vectors(self):
+        return UnitVectors([Q(row.tolist()) for row in self.get_basis()])
+
+    @unit_vectors.setter
+    def unit_vectors(self, unit_vectors):
+        position = self.position
+        self.fleet.bodies.orientations[self.index] = rigidbody.from_bases(gm.basis(unit_vectors))
+        self.position = position
+
+    @property
+    def angular_velocity(self):
+        """World-frame angular velocity, in radians per second"""
+        return Q(self.fleet.bodies.get_angular_velocities([self.index])[0].tolist())
+
+    @angular_velocity.setter
+    def angular_velocity(self, angular_velocity):
+        basis = self.get_basis()
+        self.fleet.bodies.angular_momenta[self.index] = (self.inertia @ (basis @ gm.vector3(angular_velocity))) @ basis
+
+    def rotate(self, axis, angle):
+        unit_vectors = self.unit_vectors
+        unit_vectors.rotate(axis, angle)
+        self.unit_vectors = unit_vectors
+
     def update(self, dt=1/60, key_presses=None):
+        self.fleet.step(dt, [self])
+
+
+class Fleet:
+    """
+    Crafts whose rigid-body states are kept in one RigidBodies and stepped together.
+
+    Every step, the autopilots of the fleet are evaluated first (see autopilot.steer), then
+    the thrust and torque that each craft's control actions ask for are applied along its body axes,
+    in batched operations over the whole fleet.
+    """
+
+    # Arrays with a row per craft, besides the rigid-body state
+    rows = ('controls', 'max_forces', 'max_torques', 'target_directions', 'targets', 'target_velocities')
+
+    def __init__(self, crafts=()):
+        self.crafts = []
+        self.bodies = rigidbody.RigidBodies()
+        self.controls = np.zeros((0, len(control_actions)), dtype=bool)
+        self.max_forces = np.zeros((0, 3))
+        self.max_torques = np.zeros((0, 3))
+        # Autopilot targets, NaN where there is none
+        self.target_directions = np.zeros((0, 3))
+        self.targets = np.zeros((0, 3))
+        self.target_velocities = np.zeros((0, 3))
+        # Crafts whose parts changed since the last step
+        self.changed = set()
+        for craft in crafts:
+            self.add(craft)
+
+    def __len__(self):
+        return len(self.crafts)
+
+    def add(self, craft):
+        """Moves a craft, with its state, controls and autopilot targets, into this fleet"""
+        if craft.fleet is not None:
+            rows = {name: getattr(craft.fleet, name)[craft.index].copy() for name in Fleet.rows}
+            state = craft.fleet.remove(craft)
+        else:
+            rows = {
+                'controls': np.zeros(len(control_actions), dtype=bool),
+                'max_forces': craft.max_force,
+                'max_torques': craft.max_torque,
+                'target_directions': np.full(3, np.nan),
+                'targets': np.full(3, np.nan),
+                'target_velocities': np.zeros(3),
+            }
+            state = {'mass': craft.mass, 'inertia': craft.inertia, 'position': craft.center_of_mass}
+
+        craft.index = self.bodies.add(**state)
+        craft.fleet = self
+        self.crafts.append(craft)
+        for name, row in rows.items():
+            setattr(self, name, np.concatenate([getattr(self, name), [row]]))
+        return self
+
+    def remove(self, craft):
+        """Takes a craft out of the fleet, returning its rigid-body state"""
+        index = craft.index
+        state = self.bodies.remove(index)
+        for name in Fleet.rows:
+            setattr(self, name, np.delete(getattr(self, name), index, axis=0))
+        self.changed.discard(craft)
+        self.crafts.pop(index)
+        for i in range(index, len(self.crafts)):
+            self.crafts[i].index = i
+        craft.fleet = None
+        craft.index = None
+        return state
+
+    def step(self, dt, crafts=None):
+        """Steps every craft in the fleet, or only the given ones"""
+        for craft in self.changed:
+            craft.update_mass_properties()
+        self.changed.clear()
+
+        rows = np.arange(len(self)) if crafts is None else np.array([craft.index for craft in crafts], dtype=int)
+        autopilot.steer(self, rows)
 
-        self.position += self.velocity * dt
-        self.unit_vectors.rotate(self.axis_of_rotation, self.axis_of_rotation.norm)
\ No newline at end of file
+        # +1, 0 or -1 for pitch, yaw, roll, x, y and z
+        signs = self.controls[rows, 0::2].astype(float) - self.controls[rows, 1::2]
+        bases = self.bodies.get_bases(rows)
+        self.bodies.torques[rows] += np.einsum('ni,nij->nj', signs[:, :3]*self.max_torques[rows], bases)
+        self.bodies.forces[rows] += np.einsum('ni,nij->nj', signs[:, 3:]*self.max_forces[rows], bases)
+        self.bodies.step(dt, rows)
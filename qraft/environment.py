@@ -1,24 +1,63 @@
+import os
+import math
+
 
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL
 
 from OpenGL.GL import glClearDepth, glDepthFunc, glEnable, glClearColor, glClear, glBegin, glEnd, glMatrixMode, glLoadIdentity, glColor3fv, glVertex3fv
 from OpenGL.GL import GL_LESS, GL_DEPTH_TEST, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_TRIANGLES, GL_LINES, GL_PROJECTION, GL_MODELVIEW
+from OpenGL.GL import glLoadMatrixf
 from OpenGL.GLU import gluPerspective
 
+import numpy as np
+
 import aquaternion as aq
 
+from . import graphics
+from . import geometry as gm
+from . import polylines
+from . import profiler
+
 class Scene:
+    """
+    renderer: 'retained' draws every mesh from GPU buffers with one call,
+              'immediate' sends every vertex with glVertex3fv (kept for comparison)
+    culling: skip nodes whose bounding spheres are outside the view frustum;
+             the counts of the last frame (nodes tested, drawn, culled, draw calls, triangles) are kept in self.stats
+    floating_origin: draw everything relative to the camera, so that positions far from the world origin
+                     are only cast to float32 after the (float64) camera position is taken off
+    dynamic_depth: fit the near and far planes to what is in front of the camera every frame; a range too
+                   deep for the depth buffer is drawn in slices of at most depth_ratio, from back to front
+    """
+
+    renderers = ('retained', 'immediate')
+
+    # Far/near ratio of one depth slice, and the most slices drawn per frame
+    depth_ratio = 1e4
+    max_depth_slices = 4
 
-    def __init__(self, name, width, height, background_color=(0.2, 0.2, 0.3, 1.0), FPS=60):
+    def __init__(self, name, width, height, background_color=(0.2, 0.2, 0.3, 1.0), FPS=60, renderer='retained', culling=True,
+                 floating_origin=False, dynamic_depth=False):
+        if renderer not in Scene.renderers:
+            raise ValueError(f"Unknown renderer {renderer!r}, expected one of {Scene.renderers}.")
+        
         self.name = name
         self.width = width
         self.height = height
         self.background_color = background_color
+        self.renderer = renderer
+        self.culling = culling
+        self.floating_origin = floating_origin
+        self.dynamic_depth = dynamic_depth
+        self.field_of_view = 60
+        self.near = 0.1
+        self.far = 200.0
+        self.stats = {'nodes': 0, 'drawn': 0, 'culled': 0, 'points': 0, 'depth_slices': 1, 'draw_calls': 0, 'triangles': 0}
 
         self.window = pygame.display.set_mode((width, height), DOUBLEBUF|OPENGL)
         pygame.display.set_caption(self.name)
-        pygame.display.set_icon(pygame.image.load('qraft/assets/icon.png'))
+        pygame.display.set_icon(pygame.image.load(os.path.join(os.path.dirname(__file__), 'assets', 'icon.png')))
 
         glClearDepth(1.0)
         glDepthFunc(GL_LESS)
@@ -33,35 +72,170 @@ class Scene:
 
     
     def render(self, camera, light_vector):
-        relative_light_vector = light_vector.unmorphed(*camera.unit_vectors)
+        """
+        Objects are kept in world space; the camera is applied once, as the model-view matrix.
+        """
+        origin = gm.vector3(camera.position) if self.floating_origin else gm.ORIGIN
+        glLoadMatrixf(camera.get_view_matrix(origin).astype(np.float32))
+
+        with profiler.stage('transform'):
+            for obj in self.objects:
+                obj.update_transform()
+
+        # Lines given as (points, color) are uploaded once, as Polylines
+        self.lines[:] = [polylines.as_polyline(line) for line in self.lines]
+
+        if self.dynamic_depth:
+            slices = self.get_depth_slices(*self.get_depth_range(camera))
+        else:
+            slices = [(self.near, self.far)]
+
+        self.stats = {'nodes': 0, 'drawn': 0, 'culled': 0, 'points': 0, 'depth_slices': len(slices)}
+        graphics.reset_counters()
+        for near, far in slices:
+            if self.dynamic_depth:
+                self.set_projection(near, far)
+                glClear(GL_DEPTH_BUFFER_BIT)
+
+            frustum = Frustum(camera, self.field_of_view, self.width/self.height, near, far, self.height, self.culling, origin)
+
+            with profiler.stage('draw'):
+                if self.renderer == 'retained':
+                    self.render_retained(light_vector, frustum)
+                else:
+                    self.render_immediate(light_vector, frustum)
+
+                # Meshes too small to be worth their triangles were queued as points
+                graphics.draw_points([(position - origin, color, size) for position, color, size in frustum.points])
+
+                for line in self.lines:
+                    line.draw(origin)
+
+            self.stats['nodes'] += frustum.tested
+            self.stats['drawn'] += frustum.drawn
+            self.stats['culled'] += frustum.culled
+            self.stats['points'] += len(frustum.points)
+        self.stats.update(graphics.reset_counters())
+
+    def get_depth_range(self, camera):
+        """
+        Returns the (near, far) view depths just enclosing the bounding spheres of the drawn leaves
+        and the line points in front of the camera
+        """
+        forward = -gm.basis(camera.unit_vectors)[2]
+        line_points = [line.get_points() for line in self.lines]
+        bounds = [obj.get_bounds() for obj in self.objects] + [(points, np.zeros(len(points))) for points in line_points]
+        if not bounds:
+            return self.near, self.far
+        centers = np.concatenate([centers for centers, _ in bounds])
+        radii = np.concatenate([radii for _, radii in bounds])
+
+        depths = (centers - gm.vector3(camera.position)) @ forward
+        in_front = depths + radii > 0
+        if not np.any(in_front):
+            return self.near, self.far
+        far = np.max(depths[in_front] + radii[in_front]) * 1.01
+        near = np.min(depths[in_front] - radii[in_front]) * 0.99
 
+        # The camera is inside a bounding sphere: take the deepest range the slices can cover
+        return max(near, far / self.depth_ratio**self.max_depth_slices), far
+
+    def get_depth_slices(self, near, far):
+        """Splits [near, far] into geometrically even (near, far) slices, from the farthest to the nearest"""
+        n = min(self.max_depth_slices, max(1, math.ceil(math.log(far / near) / math.log(self.depth_ratio))))
+        bounds = near * (far / near)**(np.arange(n + 1) / n)
+        # Neighbouring slices overlap a little, so that nothing falls in the gap between them
+        return [(bounds[i] * 0.999, bounds[i + 1]) for i in reversed(range(n))]
+
+    def render_immediate(self, light_vector, frustum=None):
         glBegin(GL_TRIANGLES)
         for obj in self.objects:
-            obj.render(
-                (obj.position - camera.position).unmorphed(*camera.unit_vectors),# - obj.position.morphed(*camera.unit_vectors),
-                aq.UNIT_QUATERNIONS.unmorphed(*camera.unit_vectors),
-                relative_light_vector)
+            obj.render(light_vector, frustum)
         glEnd()
+        graphics.counters['draw_calls'] += 1
 
-        for line in self.lines:
-            relative_vertices = (line[0] + (-camera.position)).unmorphed(*camera.unit_vectors)
-            #relative_vertices.unmorphed(*camera.unit_vectors)
-            #relative_vertices = [(vertex - camera.position) for vertex in line[0]]
-            glBegin(GL_LINES)
-            glColor3fv(line[1])
-            n = len(relative_vertices)
-            for i in range(n-1):
-                glVertex3fv(relative_vertices[i].vector3)
-                glVertex3fv(relative_vertices[i+1].vector3)
-            glEnd()
+    def render_retained(self, light_vector, frustum=None):
+        # The light position is transformed by the current (view) matrix, so it is given in world space
+        graphics.enable_lighting(light_vector)
+        for obj in self.objects:
+            obj.draw(frustum)
+        graphics.disable_lighting()
 
     def set_FOV(self, FOV):
+        self.field_of_view = FOV
+        self.set_projection(self.near, self.far)
+
+    def set_projection(self, near, far):
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(FOV, self.width/self.height, 0.1, 200.0)
+        gluPerspective(self.field_of_view, self.width/self.height, near, far)
         glMatrixMode(GL_MODELVIEW)
 
 
+class Frustum:
+    """
+    The view volume of a camera as six world-space planes, for rejecting bounding spheres.
+
+    Counts how many nodes were culled, and how many drawable nodes passed, while it is used.
+    With the viewport height in pixels it also gives projected sizes for level of detail,
+    and collects the (position, color, size) of meshes that chose to be drawn as points.
+
+    cull: when False, every node is reported visible (but still counted)
+    origin: world point drawn at (0, 0, 0), which nodes subtract from their world transforms
+    """
+
+    def __init__(self, camera, field_of_view, aspect_ratio, near, far, height=None, cull=True, origin=gm.ORIGIN):
+        vertical = self.vertical = math.radians(field_of_view) / 2
+        horizontal = math.atan(aspect_ratio * math.tan(vertical))
+
+        # Inward normals and offsets in camera space (looking down -z): normal . p + offset >= 0 inside
+        normals = np.array([
+            (0, 0, -1),
+            (0, 0, 1),
+            (0, -math.cos(vertical), -math.sin(vertical)),
+            (0, math.cos(vertical), -math.sin(vertical)),
+            (-math.cos(horizontal), 0, -math.sin(horizontal)),
+            (math.cos(horizontal), 0, -math.sin(horizontal))])
+        offsets = np.array([-near, far, 0, 0, 0, 0])
+
+        camera_basis = gm.basis(camera.unit_vectors)
+        self.normals = normals @ camera_basis
+        self.offsets = offsets - self.normals @ gm.vector3(camera.position)
+
+        self.camera_position = gm.vector3(camera.position)
+        self.height = height
+        self.cull = cull
+        self.origin = origin
+        self.points = []
+
+        self.tested = 0
+        self.drawn = 0
+        self.culled = 0
+
+    def projected_radius(self, node):
+        """Approximate radius in pixels of a node's bounding sphere on screen"""
+        distance = np.linalg.norm(node.world_center - self.camera_position)
+        if distance <= node.world_radius:
+            return math.inf
+        return node.world_radius / distance * self.height / 2 / math.tan(self.vertical)
+
+    def projected_radii(self, centers, radii):
+        """projected_radius of many bounding spheres at once, given as (n, 3) centers and (n,) radii"""
+        distances = np.linalg.norm(centers - self.camera_position, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pixels = radii / distances * self.height / 2 / math.tan(self.vertical)
+        return np.where(distances <= radii, math.inf, pixels)
+
+    def visible(self, node, drawable=False):
+        self.tested += 1
+        if self.cull and np.any(self.normals @ node.world_center + self.offsets < -node.world_radius):
+            self.culled += 1
+            return False
+        if drawable:
+            self.drawn += 1
+        return True
+
+
 class Camera:
 
     def __init__(self, position, unit_vectors, field_of_view):
@@ -69,9 +243,23 @@ class Camera:
         self.velocity = aq.Q([0,0,0])
         self.unit_vectors = unit_vectors
         self.field_of_view = field_of_view
+        # Distance that sets the movement speed; by default the distance to the world origin to the power 0.7
+        self.speed_distance = None
+    
+    def get_view_matrix(self, origin=gm.ORIGIN):
+        """
+        Returns the 4x4 row-vector matrix taking world coordinates to camera coordinates,
+        or coordinates relative to `origin` when everything is drawn around a floating origin
+        """
+        rotation = gm.basis(self.unit_vectors).T
+        matrix = np.identity(4)
+        matrix[:3, :3] = rotation
+        matrix[3, :3] = -(gm.vector3(self.position) - origin) @ rotation
+        return matrix
     
     def translate_rel(self, offset):
-        self.position += offset.morphed(*self.unit_vectors)*self.position.norm**0.7
+        distance = self.position.norm**0.7 if self.speed_distance is None else self.speed_distance
+        self.position += offset.morphed(*self.unit_vectors)*distance
 
     def translate_abs(self, offset):
         self.position += offset
@@ -79,7 +267,7 @@ class Camera:
     def rotate(self, axis, angle):
         self.unit_vectors.rotate(axis, angle)
 
-    def update(self, mouse, keyboard):
+    def update(self, mouse, keyboard, dt=1/60):
         self.rotate(self.unit_vectors[1], -mouse.delta_position[0]/600)
         self.rotate(self.unit_vectors[0], -mouse.delta_position[1]/600)
         
@@ -93,7 +281,7 @@ class Camera:
         if keyboard.state[pygame.K_SPACE]: self.translate_rel(aq.Q([0, 1, 0])*0.03)
         if keyboard.state[pygame.K_LSHIFT]: self.translate_rel(aq.Q([0, -1, 0])*0.03)
 
-        self.position += self.velocity / 60
+        self.position += self.velocity * dt
 
 
 class Mouse:
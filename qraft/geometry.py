@@ -1,9 +1,159 @@
 
 import math
 
+import numpy as np
+
 import aquaternion as aq
 
 from . import graphics
+from . import profiler
+
+
+def vector3(vector):
+    """Returns a Quaternion or a sequence of three numbers as a float array of shape (3,)"""
+    if isinstance(vector, aq.Quaternion):
+        return np.asarray(vector.vector3, dtype=float)
+    return np.asarray(vector, dtype=float).reshape(3)
+
+
+def basis(unit_vectors):
+    """Returns the unit vectors as rows of a (3, 3) array, so that v.morphed(*unit_vectors) == v @ basis(unit_vectors)"""
+    return np.array([vector3(unit_vector) for unit_vector in unit_vectors])
+
+
+def transform_matrix(position, unit_vectors):
+    """
+    Returns the 4x4 row-vector matrix of the map v -> v.morphed(*unit_vectors) + position
+    """
+    matrix = np.identity(4)
+    matrix[:3, :3] = basis(unit_vectors)
+    matrix[3, :3] = vector3(position)
+    return matrix
+
+
+def relative_matrix(matrix, origin):
+    """
+    Moves a 4x4 row-vector matrix so that the world point `origin` ends up at (0, 0, 0).
+    Done in float64, so that only small coordinates are left when the matrix is cast to float32.
+    """
+    if not np.any(origin):
+        return matrix
+    matrix = matrix.copy()
+    matrix[3, :3] -= origin
+    return matrix
+
+
+def enclosing_sphere(centers, radii):
+    """Returns a (center, radius) bounding sphere around (n, 3) sphere centers with (n,) radii"""
+    if not len(centers):
+        return ORIGIN, 0
+    center = (np.min(centers - radii[:, None], axis=0) + np.max(centers + radii[:, None], axis=0)) / 2
+    return center, np.max(np.linalg.norm(centers - center, axis=1) + radii)
+
+
+IDENTITY = np.identity(3)
+ORIGIN = np.zeros(3)
+
+
+# Index of every instance of an InstancedMesh (a slice, so that indexing with it doesn't copy)
+ALL = slice(None)
+
+
+def same_instances(a, b):
+    """Whether two instance indices (ALL or index arrays) select the same instances"""
+    if a is ALL or b is ALL:
+        return a is b
+    return a is not None and b is not None and np.array_equal(a, b)
+
+
+def get_origin(frustum):
+    """The world point that is drawn at (0, 0, 0): the camera position with a floating origin"""
+    return ORIGIN if frustum is None else frustum.origin
+
+
+class Node:
+    """
+    Anything that can be placed in the scene graph.
+
+    The world transform (world_rotation, world_position) is cached, and is only recomputed by
+    update_transform after position or unit_vectors have been reassigned, or after the parent's
+    transform changed. Mutating unit_vectors in place is not noticed; use rotate, or call invalidate.
+
+    Every node also keeps a world-space bounding sphere (world_center, world_radius) around its subtree,
+    updated along with the transforms, for culling.
+    """
+
+    children = ()
+
+    def __init__(self, position=None, unit_vectors=None):
+        self.position = (0,0,0) if position is None else position
+        self.unit_vectors = aq.UV.copy() if unit_vectors is None else unit_vectors
+        self.world_rotation = IDENTITY
+        self.world_position = ORIGIN
+        self.world_center = ORIGIN
+        self.world_radius = 0
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = aq.Q(vector3(position).tolist())
+        self.invalidate()
+
+    @property
+    def unit_vectors(self):
+        return self._unit_vectors
+
+    @unit_vectors.setter
+    def unit_vectors(self, unit_vectors):
+        self._unit_vectors = unit_vectors
+        self.invalidate()
+
+    def rotate(self, axis, angle):
+        self._unit_vectors.rotate(axis, angle)
+        self.invalidate()
+        return self
+
+    def invalidate(self):
+        """Marks the world transform as stale. Descendants are recomputed along with it."""
+        self.dirty = True
+
+    def update_transform(self, parent_rotation=IDENTITY, parent_position=ORIGIN, parent_changed=False):
+        """Returns whether anything in the subtree moved"""
+        changed = self.dirty or parent_changed
+        if changed:
+            self.world_rotation = basis(self._unit_vectors) @ parent_rotation
+            self.world_position = vector3(self._position) @ parent_rotation + parent_position
+            self.dirty = False
+            self.transform_changed()
+        
+        children_changed = False
+        for child in self.children:
+            children_changed |= child.update_transform(self.world_rotation, self.world_position, changed)
+
+        if changed or children_changed:
+            self.update_bounds()
+        return changed or children_changed
+
+    def transform_changed(self):
+        pass
+
+    def update_bounds(self):
+        children = self.children
+        self.world_center, self.world_radius = enclosing_sphere(
+            np.array([child.world_center for child in children]).reshape(-1, 3),
+            np.array([child.world_radius for child in children], dtype=float))
+        if not len(children):
+            self.world_center = self.world_position
+
+    def get_bounds(self):
+        """(n, 3) centers and (n,) radii of the world-space bounding spheres of the leaves of the subtree"""
+        if not self.children:
+            return self.world_center[None], np.array([self.world_radius], dtype=float)
+        bounds = [child.get_bounds() for child in self.children]
+        return np.concatenate([centers for centers, _ in bounds]), np.concatenate([radii for _, radii in bounds])
 
 
 # The Polygon class isn't used at the moment
@@ -38,32 +188,124 @@ class Tetragon(Polygon):
         super().initialize(self.n, vertices, color)
 
 
-class Mesh:
+class Mesh(Node):
+    """
+    vertices: (n, 3) array of vertex positions relative to the mesh position
+    faces: vertex index tuples, each a triangle or a tetragon
+    color: one color for the whole mesh, or an (m, 3) array with one color per triangle
+    scale: uniform scale applied to the vertices, which lets meshes share one vertex array
+    normals: precomputed unit normals of the triangles, if already known
+    """
     
-    def __init__(self, position):
-        self.position = aq.Q(position)
+    def __init__(self, position, vertices=(), faces=(), color=(1,1,1), scale=1, normals=None):
+        self.world_triangles = None
+        self.world_matrix = None
+        self.shaded_light = None
+        super().__init__(position)
+        
+        # An (n, 3) array is kept as it is, not as a new view, so that meshes sharing one (a Sphere template) share it
+        self.vertices = np.asarray(vertices, dtype=float)
+        if self.vertices.ndim != 2 or self.vertices.shape[1] != 3:
+            self.vertices = self.vertices.reshape(-1, 3)
+        self.faces = faces
+        self.triangles = Mesh.triangulate(faces)
+        self.color = color
+        self.scale = scale
         self.volume = 0
+        self.buffer = None
 
-    def render(self, position=aq.Q([0,0,0]), unit_vectors=aq.UV.copy(), light_vector=aq.Q([0,0,0])):
-        qvertices = aq.QuaternionArray([(vertex + self.position).morphed(*unit_vectors) for vertex in self.qvertices])
-        for face in self.faces:
-            match len(face):
-                case 3:
-                    graphics.draw_triangle(
-                        [(qvertices[vertex] + position) for vertex in face],
-                        self.color,
-                        light_vector)
-                case 4:
-                    graphics.draw_tetragon(
-                        [(qvertices[vertex] + position) for vertex in face],
-                        self.color,
-                        light_vector)
-            
+        # Rigid meshes never change shape, so normals are only computed once, in model space
+        self.normals = graphics.triangle_normals(self.vertices[self.triangles]) if normals is None else normals
+
+        # Bounding sphere in model space, before scaling
+        if len(self.vertices):
+            self.bounding_center = (self.vertices.min(axis=0) + self.vertices.max(axis=0)) / 2
+            self.bounding_radius = np.max(np.linalg.norm(self.vertices - self.bounding_center, axis=1))
+        else:
+            self.bounding_center, self.bounding_radius = ORIGIN, 0
+        self.colors = np.broadcast_to(np.asarray(color, dtype=float), (len(self.triangles), 3))
+        self.face_colors = self.colors.copy()
+
+    @staticmethod
+    def triangulate(faces):
+        """Splits faces into an (n, 3) index array of triangles, the same way draw_tetragon does."""
+        if isinstance(faces, np.ndarray) and faces.ndim == 2 and faces.shape[1] == 3:
+            return faces
+        triangles = []
+        for face in faces:
+            triangles.extend((face[0], face[i], face[i+1]) for i in range(1, len(face)-1))
+        return np.array(triangles, dtype=np.int32).reshape(-1, 3)
+
+    def transform(self, position=aq.Q([0,0,0]), unit_vectors=aq.UV.copy()):
+        """Returns all vertices as (vertex + self.position).morphed(*unit_vectors) + position, in one matrix product."""
+        rotation = basis(unit_vectors)
+        return self.vertices @ (self.scale*basis(self.unit_vectors) @ rotation) + (vector3(self.position) @ rotation + vector3(position))
+
+    def transform_changed(self):
+        self.world_triangles = None
+        self.world_matrix = None
+        self.shaded_light = None
+
+    def get_world_triangles(self):
+        """Returns the (n, 3, 3) world-space triangles, transformed once per change of the world transform"""
+        if self.world_triangles is None:
+            vertices = self.vertices @ (self.scale*self.world_rotation) + self.world_position
+            self.world_triangles = vertices[self.triangles]
+        return self.world_triangles
+
+    def get_world_matrix(self):
+        if self.world_matrix is None:
+            self.world_matrix = transform_matrix(self.world_position, self.scale*self.world_rotation)
+        return self.world_matrix
+
+    def update_bounds(self):
+        self.world_center = self.scale*self.bounding_center @ self.world_rotation + self.world_position
+        self.world_radius = self.scale*self.bounding_radius
+
+    @property
+    def model_vertices(self):
+        """Vertices relative to the mesh position, with the scale applied"""
+        return self.scale*self.vertices
+
+    def get_buffer(self):
+        """Uploads the mesh to the GPU on first use."""
+        if self.buffer is None:
+            corners = self.vertices[self.triangles]
+            self.buffer = graphics.MeshBuffer(
+                corners.reshape(-1, 3),
+                np.repeat(self.normals, 3, axis=0),
+                np.repeat(self.colors, 3, axis=0))
+        return self.buffer
+
+    def shade(self, light_vector, ambient_light=0.5):
+        """
+        Fills self.face_colors with the Lambert-shaded color of every triangle,
+        unless neither the world transform nor the (world-space) light has changed since last time.
+
+        The light is rotated into model space instead of rotating every normal out of it.
+        """
+        light_vector = vector3(light_vector)
+        if self.shaded_light is None or not np.array_equal(light_vector, self.shaded_light):
+            with profiler.stage('shading'):
+                model_light_vector = self.world_rotation @ light_vector
+                self.face_colors = self.colors * graphics.light_factors(self.normals, model_light_vector, ambient_light)[:, None]
+            self.shaded_light = light_vector
+        return self.face_colors
+
+    def draw(self, frustum=None):
+        """Retained-mode counterpart of render: one draw call with the world transform passed as a matrix."""
+        if frustum is None or frustum.visible(self, drawable=True):
+            self.get_buffer().draw(relative_matrix(self.get_world_matrix(), get_origin(frustum)))
+
+    def render(self, light_vector=aq.Q([0,0,0]), frustum=None):
+        """Sends the world-space triangles; call inside glBegin(GL_TRIANGLES), after update_transform."""
+        if frustum is None or frustum.visible(self, drawable=True):
+            graphics.draw_triangles(self.get_world_triangles() - get_origin(frustum), self.shade(light_vector))
 
 
 class Cuboid(Mesh):
 
-    vertices = ((-1, -1, -1), (-1, -1, 1),
+    unit_vertices = ((-1, -1, -1), (-1, -1, 1),
                 (-1, 1, -1), (-1, 1, 1),
                 (1, -1, -1), (1, -1, 1),
                 (1, 1, -1), (1, 1, 1))
@@ -79,15 +321,10 @@ class Cuboid(Mesh):
                  position=(0,0,0),
                  size=(1,1,1),
                  color=(1,1,1)):
-        super().__init__(position)
+        super().__init__(position, 0.5*np.multiply(Cuboid.unit_vertices, size), Cuboid.faces, color)
         
         self.size = size
         self.volume = math.prod(size)
-        self.color = color
-        
-        self.qvertices = aq.QuaternionArray(
-            [0.5*aq.Q(vertex).morphed(self.size[0]*aq.qi, self.size[1]*aq.qj, self.size[2]*aq.qk) for vertex in self.vertices]
-        )
 
 
 class Sphere(Mesh):
@@ -96,26 +333,89 @@ class Sphere(Mesh):
     
     vertical_n: number of vertical points (including poles)
     horizontal_n: number of horizontal points
+    levels: coarser (vertical_n, horizontal_n, pixels) resolutions for level of detail, each used
+            while the projected radius is below its number of pixels (so in decreasing order)
+    point_pixels: below this projected radius the sphere is drawn as a single point
+
+    Spheres of the same resolution share one unit sphere template (see Sphere.get_template),
+    which each instance scales by its radius.
     """
 
+    templates = {}
+
     def __init__(self,
                  position=(0,0,0),
                  radius=0.5,
                  color=(1,1,1),
                  vertical_n=10,
-                 horizontal_n=10):
-        super().__init__(position)
+                 horizontal_n=10,
+                 levels=(),
+                 point_pixels=None):
+        self.vertical_n, self.horizontal_n = Sphere.resolution(vertical_n, horizontal_n)
+        unit_vertices, triangles, normals = Sphere.get_template(self.vertical_n, self.horizontal_n)
+        super().__init__(position, unit_vertices, triangles, color, scale=radius, normals=normals)
 
         self.radius = radius
         self.diameter = 2*self.radius
         self.volume = 4/3*math.pi*self.radius**3
-        self.color = color
 
-        self.vertices = Sphere.get_vertices(radius, vertical_n, horizontal_n)
-        self.faces = Sphere.get_faces(vertical_n, horizontal_n)
-        self.qvertices = aq.QuaternionArray(
-            [aq.Q(vertex) for vertex in self.vertices]
-        )
+        self.levels = [(self.vertical_n, self.horizontal_n, math.inf), *levels]
+        self.level = 0
+        self.level_buffers = {}
+        self.point_pixels = point_pixels
+
+    def set_level(self, level):
+        """Switches to the shared template of another resolution, keeping the GPU buffer of each one used"""
+        if level == self.level:
+            return
+        self.level_buffers[self.level] = self.buffer
+        self.level = level
+        self.vertices, self.triangles, self.normals = Sphere.get_template(*self.levels[level][:2])
+        self.colors = np.broadcast_to(np.asarray(self.color, dtype=float), (len(self.triangles), 3))
+        self.buffer = self.level_buffers.get(level)
+        self.transform_changed()
+
+    def use_level_of_detail(self, frustum):
+        """
+        Picks this frame's resolution from the projected radius.
+        Returns False if the sphere was queued on the frustum as a point instead.
+        """
+        if frustum is None or frustum.height is None or (len(self.levels) == 1 and self.point_pixels is None):
+            return True
+        pixels = frustum.projected_radius(self)
+        if self.point_pixels is not None and pixels < self.point_pixels:
+            frustum.points.append((self.world_center, self.color, 2*pixels))
+            return False
+        self.set_level(sum(pixels < level[2] for level in self.levels[1:]))
+        return True
+
+    def draw(self, frustum=None):
+        if (frustum is None or frustum.visible(self, drawable=True)) and self.use_level_of_detail(frustum):
+            self.get_buffer().draw(relative_matrix(self.get_world_matrix(), get_origin(frustum)))
+
+    def render(self, light_vector=aq.Q([0,0,0]), frustum=None):
+        if (frustum is None or frustum.visible(self, drawable=True)) and self.use_level_of_detail(frustum):
+            graphics.draw_triangles(self.get_world_triangles() - get_origin(frustum), self.shade(light_vector))
+
+    @classmethod
+    def resolution(cls, m, n):
+        return max(3, m), max(3, n)
+
+    @classmethod
+    def get_template(cls, m, n):
+        """
+        Returns the shared (unit vertices, triangles, normals) of a unit sphere, built once per resolution.
+        The arrays are read-only, since every sphere of that resolution refers to them.
+        """
+        key = Sphere.resolution(m, n)
+        if key not in Sphere.templates:
+            unit_vertices = Sphere.get_vertices(1, *key)
+            triangles = Sphere.get_faces(*key)
+            normals = graphics.triangle_normals(unit_vertices[triangles])
+            for array in (unit_vertices, triangles, normals):
+                array.flags.writeable = False
+            Sphere.templates[key] = unit_vertices, triangles, normals
+        return Sphere.templates[key]
 
     @classmethod
     def vertices_in_row(cls, m, n, row):
@@ -155,18 +455,18 @@ class Sphere(Mesh):
 
     @classmethod
     def get_vertices(cls, radius, m, n):
-        m = max(2, m)
-        n = max(3, n)
-
-        vertices = []
-        for i in range(m):
-            if i == 0:
-                vertices.append((0,0,radius))
-            elif i == m-1:
-                vertices.append((0,0,-radius))
-            else:
-                for j in range(n):
-                    vertices.append(Sphere.vertex_position(radius, m, n, i, j))
+        """Returns an (number_of_vertices, 3) array, in the order given by vertex_number"""
+        m, n = Sphere.resolution(m, n)
+
+        latitude = np.arange(1, m-1)[:, None] / (m-1) * math.pi
+        longitude = np.arange(n)[None, :] / n * math.tau
+        
+        vertices = np.empty((Sphere.number_of_vertices(m, n), 3))
+        vertices[0] = (0, 0, radius)
+        vertices[-1] = (0, 0, -radius)
+        vertices[1:-1, 0] = (radius * np.sin(latitude) * np.cos(longitude)).ravel()
+        vertices[1:-1, 1] = (radius * np.sin(latitude) * np.sin(longitude)).ravel()
+        vertices[1:-1, 2] = np.repeat(radius * np.cos(latitude).ravel(), n)
         
         return vertices
     
@@ -176,51 +476,315 @@ class Sphere(Mesh):
 
     @classmethod
     def get_faces(cls, m, n):
-        faces: list[tuple[float]] = [(0,)]*Sphere.number_of_faces(m, n)
-        current_face_number = 0
-        for i in range(m-1):
-            for j in range(n):
-                if i == 0:
-                    vertex0 = Sphere.vertex_number(m, n, i, j)
-                    vertex1 = Sphere.vertex_number(m, n, i+1, j)
-                    vertex2 = Sphere.vertex_number(m, n, i+1, j+1)
-
-                    current_face_number += 1
-                    faces[current_face_number-1] = (vertex0, vertex1, vertex2)
-                elif i == m-2:
-                    vertex0 = Sphere.vertex_number(m, n, i, j)
-                    vertex1 = Sphere.vertex_number(m, n, i+1, j)
-                    vertex2 = Sphere.vertex_number(m, n, i, j+1)
-
-                    current_face_number += 1
-                    faces[current_face_number-1] = (vertex0, vertex1, vertex2)
-                else:
-                    vertex0 = Sphere.vertex_number(m, n, i, j)
-                    vertex1 = Sphere.vertex_number(m, n, i+1, j)
-                    vertex2 = Sphere.vertex_number(m, n, i+1, j+1)
-                    vertex3 = Sphere.vertex_number(m, n, i, j+1)
-
-                    current_face_number += 1
-                    faces[current_face_number-1] = (vertex0, vertex1, vertex2)
-                    current_face_number += 1
-                    faces[current_face_number-1] = (vertex0, vertex2, vertex3)
-
-        return faces
+        """Returns a (number_of_faces, 3) index array, row by row from the north pole"""
+        m, n = Sphere.resolution(m, n)
+
+        j = np.arange(n)
+        next_j = (j + 1) % n
+        south_pole = Sphere.number_of_vertices(m, n) - 1
+        
+        top = np.stack([np.zeros(n, dtype=int), 1 + j, 1 + next_j], axis=1)
+
+        # Row i (1 <= i <= m-2) starts at vertex 1 + (i-1)*n
+        upper = 1 + np.arange(m-3)[:, None]*n
+        lower = upper + n
+        quads = (upper + j, lower + j, lower + next_j, upper + next_j)
+        middle = np.stack([
+            np.stack([quads[0], quads[1], quads[2]], axis=-1),
+            np.stack([quads[0], quads[2], quads[3]], axis=-1)], axis=2).reshape(-1, 3)
+
+        last_row = 1 + (m-3)*n
+        bottom = np.stack([last_row + j, np.full(n, south_pole), last_row + next_j], axis=1)
+
+        return np.concatenate([top, middle, bottom]).astype(np.int32)
+
+
+class InstancedMesh(Node):
+    """
+    Many copies of one mesh, drawn with a single instanced draw call.
+
+    mesh: the shared geometry (its own position and unit_vectors are ignored)
+    positions: (n, 3) instance positions in the frame of the InstancedMesh
+    orientations: (n, 3, 3) instance unit vectors as rows (identity by default)
+    scales: (n,) instance scales, applied on top of mesh.scale
+    colors: (n, 3) instance colors, multiplied with the mesh colors
+    point_pixels: below this projected radius an instance is drawn as a single point instead
+                  (by default the mesh's own point_pixels, which a Sphere has)
+
+    With a Sphere as the mesh, its levels apply to every instance on its own: the instances are sorted
+    by projected radius into one instance buffer per level, each drawn with that level's template.
+    """
+
+    # With a floating origin, instances stay uploaded around the render origin of their last upload, and the
+    # offset from there to the current one goes into the (float64) draw matrix. They are only uploaded again
+    # once the camera is farther from that origin than rebase_ratio times its distance to the nearest instance,
+    # which keeps the float32 error of the offset far below a pixel
+    rebase_ratio = 100
+
+    def __init__(self, mesh, positions, orientations=None, scales=None, colors=None, position=None, unit_vectors=None,
+                 point_pixels=None):
+        self.world_triangles = None
+        self.world_matrix = None
+        self.shaded_light = None
+        super().__init__(position, unit_vectors)
+
+        self.mesh = mesh
+        self.point_pixels = getattr(mesh, 'point_pixels', None) if point_pixels is None else point_pixels
+        # Projected radii below which the coarser levels of a Sphere are used
+        self.level_pixels = np.array([level[2] for level in getattr(mesh, 'levels', ())[1:]])
+        self.level_meshes = {0: mesh}
+        # The instances drawn as triangles this frame, by level of detail
+        self.buckets = {0: ALL}
+        # By level: the instance buffer, and the instances it holds
+        self.instance_buffers = {}
+        self.uploaded_instances = {}
+        self.uploaded_origin = None
+        self.set_instances(positions, orientations, scales, colors)
+
+    @property
+    def count(self):
+        return len(self.positions)
+
+    @property
+    def volume(self):
+        return self.mesh.volume * np.sum(self.scales**3)
+
+    def set_instances(self, positions=None, orientations=None, scales=None, colors=None):
+        """
+        Replaces any of the per-instance arrays. Arrays that are left out are kept,
+        or reset to their defaults if the number of instances changed.
+        """
+        if positions is not None:
+            self.positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        n = len(self.positions)
+        
+        if orientations is not None:
+            self.orientations = np.asarray(orientations, dtype=float).reshape(-1, 3, 3)
+        elif len(getattr(self, 'orientations', ())) != n:
+            self.orientations = np.broadcast_to(IDENTITY, (n, 3, 3))
+        
+        if scales is not None:
+            self.scales = np.asarray(scales, dtype=float).reshape(-1)
+        elif len(getattr(self, 'scales', ())) != n:
+            self.scales = np.ones(n)
+        
+        if colors is not None:
+            self.colors = np.asarray(colors, dtype=float).reshape(-1, 3)
+        elif len(getattr(self, 'colors', ())) != n:
+            self.colors = np.ones((n, 3))
+
+        self.instances_changed = True
+        self.invalidate()
+        return self
+
+    def get_instance_rotations(self):
+        """(n, 3, 3) orientation rows with both scales applied"""
+        return (self.mesh.scale*self.scales)[:, None, None] * self.orientations
+
+    def transform_changed(self):
+        self.world_triangles = None
+        self.world_matrix = None
+        self.shaded_light = None
+
+    def get_world_matrix(self):
+        if self.world_matrix is None:
+            self.world_matrix = transform_matrix(self.world_position, self.world_rotation)
+        return self.world_matrix
+
+    def update_bounds(self):
+        scales = self.mesh.scale*self.scales
+        centers = np.einsum('nj,njk->nk', scales[:, None]*self.mesh.bounding_center, self.orientations) + self.positions
+        self.instance_centers = centers @ self.world_rotation + self.world_position
+        self.instance_radii = scales*self.mesh.bounding_radius
+        self.world_center, self.world_radius = enclosing_sphere(self.instance_centers, self.instance_radii)
+
+    def get_bounds(self):
+        return self.instance_centers, self.instance_radii
+
+    def get_level_mesh(self, level):
+        """The mesh drawn for a level of detail: the mesh itself, or a Sphere of the same radius at a coarser resolution"""
+        if level not in self.level_meshes:
+            vertical_n, horizontal_n, _ = self.mesh.levels[level]
+            self.level_meshes[level] = Sphere(radius=self.mesh.radius, color=self.mesh.color, vertical_n=vertical_n, horizontal_n=horizontal_n)
+        return self.level_meshes[level]
+
+    def use_level_of_detail(self, frustum):
+        """
+        Sorts this frame's instances into levels of detail by their projected radii, and queues the ones
+        below point_pixels on the frustum as points. Returns False if no instance is left to draw as triangles.
+        """
+        if frustum is None or frustum.height is None or (not len(self.level_pixels) and self.point_pixels is None):
+            buckets = {0: ALL}
+        else:
+            pixels = frustum.projected_radii(self.instance_centers, self.instance_radii)
+            points = np.zeros(self.count, dtype=bool) if self.point_pixels is None else pixels < self.point_pixels
+            if np.any(points):
+                colors = self.colors[points] * np.mean(self.mesh.colors, axis=0)
+                frustum.points.extend(zip(self.instance_centers[points], colors, 2*pixels[points]))
+            instance_levels = np.sum(pixels[:, None] < self.level_pixels, axis=1)
+            instance_levels[points] = -1
+
+            if not np.any(points) and np.all(instance_levels == instance_levels[:1]):
+                buckets = {int(instance_levels[0]): ALL} if self.count else {}
+            else:
+                buckets = {int(level): np.flatnonzero(instance_levels == level) for level in np.unique(instance_levels) if level >= 0}
+
+        if buckets.keys() != self.buckets.keys() or not all(same_instances(buckets[level], self.buckets[level]) for level in buckets):
+            self.buckets = buckets
+            self.world_triangles = None
+            self.shaded_light = None
+        return bool(buckets)
+
+    def get_world_triangles(self):
+        """Returns the world-space triangles of every instance drawn as triangles, as one (n*m, 3, 3) array"""
+        if self.world_triangles is None:
+            rotations = self.get_instance_rotations()
+            world_triangles = [np.zeros((0, 3, 3))]
+            for level, instances in self.buckets.items():
+                mesh = self.get_level_mesh(level)
+                vertices = np.einsum('vj,njk->nvk', mesh.vertices, rotations[instances]) + self.positions[instances, None]
+                vertices = vertices @ self.world_rotation + self.world_position
+                world_triangles.append(vertices[:, mesh.triangles].reshape(-1, 3, 3))
+            self.world_triangles = np.concatenate(world_triangles)
+        return self.world_triangles
+
+    def shade(self, light_vector, ambient_light=0.5):
+        """Per-instance version of Mesh.shade, returning one color per triangle of every instance"""
+        light_vector = vector3(light_vector)
+        if self.shaded_light is None or not np.array_equal(light_vector, self.shaded_light):
+            with profiler.stage('shading'):
+                # The light in the model space of every instance
+                model_light_vectors = self.orientations @ (self.world_rotation @ light_vector)
+                norm = np.linalg.norm(light_vector)
+                face_colors = [np.zeros((0, 3))]
+                # In the same order as get_world_triangles
+                for level, instances in self.buckets.items():
+                    mesh = self.get_level_mesh(level)
+                    if norm:
+                        diffuse = np.maximum(0, -(model_light_vectors[instances] @ mesh.normals.T) / norm)
+                    else:
+                        diffuse = np.zeros((len(model_light_vectors[instances]), len(mesh.normals)))
+                    light_factors = ambient_light + (1 - ambient_light)*diffuse
+                    face_colors.append((mesh.colors[None] * self.colors[instances][:, None] * light_factors[..., None]).reshape(-1, 3))
+                self.face_colors = np.concatenate(face_colors)
+            self.shaded_light = light_vector
+        return self.face_colors
+
+    def draw(self, frustum=None):
+        if frustum is not None and not frustum.visible(self, drawable=True):
+            return
+        if not self.use_level_of_detail(frustum):
+            return
+
+        # Instance positions are uploaded relative to the render origin (in the local frame),
+        # since far-apart instances would lose their precision as float32 otherwise
+        origin = get_origin(frustum)
+        local_origin = (origin - self.world_position) @ self.world_rotation.T
+        if self.instances_changed or self.needs_rebase(origin, local_origin):
+            self.uploaded_instances.clear()
+            self.instances_changed = False
+            self.uploaded_origin = local_origin
+
+        matrix = relative_matrix(self.get_world_matrix(), origin - self.uploaded_origin @ self.world_rotation)
+        for level, instances in self.buckets.items():
+            if level not in self.instance_buffers:
+                self.instance_buffers[level] = graphics.InstanceBuffer()
+            # A level's buffer is only uploaded again when instances moved in or out of it
+            if not same_instances(instances, self.uploaded_instances.get(level)):
+                self.instance_buffers[level].upload(np.concatenate([
+                    self.positions[instances] - self.uploaded_origin,
+                    self.get_instance_rotations()[instances].reshape(-1, 9),
+                    self.colors[instances]], axis=1))
+                self.uploaded_instances[level] = instances
+            self.instance_buffers[level].draw(self.get_level_mesh(level).get_buffer(), matrix)
+
+    def needs_rebase(self, origin, local_origin):
+        """Whether the instances have to be uploaded around the render origin again (see rebase_ratio)"""
+        if self.uploaded_origin is None:
+            return True
+        offset = np.linalg.norm(local_origin - self.uploaded_origin)
+        if not offset:
+            return False
+        nearest = np.min(np.linalg.norm(self.instance_centers - origin, axis=1) - self.instance_radii, initial=np.inf)
+        return offset > self.rebase_ratio * nearest
+
+    def render(self, light_vector=aq.Q([0,0,0]), frustum=None):
+        if (frustum is None or frustum.visible(self, drawable=True)) and self.use_level_of_detail(frustum):
+            graphics.draw_triangles(self.get_world_triangles() - get_origin(frustum), self.shade(light_vector))
 
 
 # Groups are for putting together Mesh objects
-class Group:
+class Group(Node):
     
     def __init__(self, shapes=None, position=None, unit_vectors=None):
+        super().__init__(position, unit_vectors)
         self.shapes = [] if shapes is None else shapes
-        self.position = aq.Q([0,0,0]) if position is None else aq.Q(position)
-        self.unit_vectors = aq.UV.copy() if unit_vectors is None else unit_vectors
         self.volume = sum([shape.volume for shape in self.shapes])
-    
-    def render(self, position=aq.Q([0,0,0]), unit_vectors=None, light_vector=aq.Q([0,0,0])):
-        unit_vectors = aq.UV.copy() if unit_vectors is None else unit_vectors
+        self.baked = None
+
+    @property
+    def children(self):
+        return self.shapes if self.baked is None else (self.baked,)
+
+    def get_meshes(self, rotation=IDENTITY, position=ORIGIN):
+        """
+        Yields (mesh, rotation, position) for every mesh in the subtree,
+        with the transform relative to this group's own frame
+        """
         for shape in self.shapes:
-            if isinstance(shape, Mesh):
-                shape.render(position + self.position.morphed(*unit_vectors), self.unit_vectors.morphed(*unit_vectors), light_vector)
-            elif isinstance(shape, Group):
-                shape.render(position + self.position.morphed(*unit_vectors), self.unit_vectors.morphed(*unit_vectors), light_vector)
\ No newline at end of file
+            shape_rotation = basis(shape.unit_vectors) @ rotation
+            shape_position = vector3(shape.position) @ rotation + position
+            if isinstance(shape, Group):
+                yield from shape.get_meshes(shape_rotation, shape_position)
+            elif isinstance(shape, Mesh):
+                yield shape, shape_rotation, shape_position
+            else:
+                raise TypeError(f"Can't bake {type(shape).__name__} into a mesh.")
+
+    def bake(self):
+        """
+        Merges every mesh in the subtree into one mesh in this group's frame,
+        which is then transformed and drawn in place of the children.
+
+        Changes made to the children afterwards are not seen until unbake (or bake again) is called.
+        """
+        self.unbake()
+
+        vertices, triangles, normals, colors = [], [], [], []
+        offset = 0
+        for mesh, rotation, position in self.get_meshes():
+            vertices.append(mesh.vertices @ (mesh.scale*rotation) + position)
+            triangles.append(mesh.triangles + offset)
+            normals.append(mesh.normals @ rotation)
+            colors.append(mesh.colors)
+            offset += len(mesh.vertices)
+
+        if not vertices:
+            return self
+
+        self.baked = Mesh(
+            (0,0,0),
+            np.concatenate(vertices),
+            np.concatenate(triangles),
+            np.concatenate(colors),
+            normals=np.concatenate(normals))
+        self.invalidate()
+        return self
+
+    def unbake(self):
+        if self.baked is not None:
+            if self.baked.buffer is not None:
+                self.baked.buffer.delete()
+            self.baked = None
+            self.invalidate()
+        return self
+    
+    def render(self, light_vector=aq.Q([0,0,0]), frustum=None):
+        if frustum is None or frustum.visible(self):
+            for shape in self.children:
+                shape.render(light_vector, frustum)
+
+    def draw(self, frustum=None):
+        if frustum is None or frustum.visible(self):
+            for shape in self.children:
+                shape.draw(frustum)
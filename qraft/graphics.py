@@ -1,11 +1,34 @@
 
 import math
+import ctypes
+
+import numpy as np
 
 from OpenGL.GL import glBegin, glEnd, glColor3fv, glVertex3fv, glLineWidth, GL_LINES, GL_TRIANGLES, GLfloat
+from OpenGL.GL import glPointSize, GL_POINTS, glBufferSubData, GL_LINE_STRIP, GL_LINE_LOOP
+from OpenGL.GL import glGenBuffers, glDeleteBuffers, glBindBuffer, glBufferData, glDrawArrays, GL_ARRAY_BUFFER, GL_STATIC_DRAW
+from OpenGL.GL import glEnableClientState, glDisableClientState, glVertexPointer, glNormalPointer, glColorPointer, GL_FLOAT
+from OpenGL.GL import GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_COLOR_ARRAY, glPushMatrix, glPopMatrix, glMultMatrixf
+from OpenGL.GL import glEnable, glDisable, glLightfv, glLightModelfv, glColorMaterial, GL_LIGHTING, GL_LIGHT0, GL_POSITION
+from OpenGL.GL import GL_AMBIENT, GL_DIFFUSE, GL_LIGHT_MODEL_AMBIENT, GL_COLOR_MATERIAL, GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE, GL_NORMALIZE
+from OpenGL.GL import glUseProgram, glEnableVertexAttribArray, glDisableVertexAttribArray, glVertexAttribPointer, glVertexAttribDivisor
+from OpenGL.GL import glDrawArraysInstanced, GL_DYNAMIC_DRAW, GL_FALSE, GL_VERTEX_SHADER, GL_FRAGMENT_SHADER
+from OpenGL.GL.shaders import compileProgram, compileShader
 
 import aquaternion as aq
 
 
+# Draw calls and triangles sent since the last reset_counters, for profiling
+counters = {'draw_calls': 0, 'triangles': 0}
+
+def reset_counters():
+    """Returns the counters so far and starts again from zero"""
+    counts = dict(counters)
+    for key in counters:
+        counters[key] = 0
+    return counts
+
+
 def drop_vertex(position, color):
     glColor3fv(color)
     glVertex3fv(position)
@@ -29,7 +52,7 @@ def triangle_light_factor1(vertices, light_vector, ambient_light):
     return ambient_light + (1 - ambient_light)*max(0, math.cos(anomaly))
 
 def triangle_light_factor(vertices: tuple[aq.Quaternion], light_vector: aq.Quaternion, ambient_light: float):
-    light_vector.normalize()
+    light_vector = light_vector.normalized
     if len(vertices) != 3:
         raise IndexError(f"Need 3 vertices to make a three dimensional normal vector.")
     p1, p2, p3 = vertices
@@ -48,6 +71,61 @@ def draw_triangle(vertices=[aq.Q([-5,-5,0]), aq.Q([5,-5,0]), aq.Q([0,5,0])], col
         glVertex3fv(qvector.vector3)
 
 
+def triangle_normals(triangles):
+    """
+    Returns the unit normals of an (n, 3, 3) array of triangles, oriented like triangle_light_factor's
+    """
+    p1, p2, p3 = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    normals = np.cross(p2 - p1, p3 - p2)
+    norms = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, norms, out=np.zeros_like(normals), where=norms > 0)
+
+
+def light_factors(normals, light_vector, ambient_light=0.5):
+    """
+    Batched triangle_light_factor for an (n, 3) array of unit normals
+
+    light_vector: Quaternion or array, need not be normalized
+    """
+    light = np.asarray(getattr(light_vector, 'vector3', light_vector), dtype=float)
+    norm = np.linalg.norm(light)
+    if not norm:
+        return np.full(len(normals), float(ambient_light))
+    return ambient_light + (1 - ambient_light)*np.maximum(0, normals @ (-light / norm))
+
+
+def draw_triangles(triangles, colors):
+    """
+    Draws an (n, 3, 3) array of already transformed triangles inside glBegin(GL_TRIANGLES)
+
+    colors: (n, 3) array of already shaded triangle colors
+    """
+    counters['triangles'] += len(triangles)
+    for color, triangle in zip(colors, triangles):
+        glColor3fv(color)
+        glVertex3fv(triangle[0])
+        glVertex3fv(triangle[1])
+        glVertex3fv(triangle[2])
+
+
+def draw_points(points):
+    """
+    Draws (position, color, size) points, as queued by level of detail, with one glBegin per point size
+    """
+    sizes = {}
+    for position, color, size in points:
+        sizes.setdefault(max(1, round(size)), []).append((position, color))
+
+    counters['draw_calls'] += len(sizes)
+    for size, group in sizes.items():
+        glPointSize(size)
+        glBegin(GL_POINTS)
+        for position, color in group:
+            glColor3fv(color)
+            glVertex3fv(position)
+        glEnd()
+
+
 def draw_tetragon(vertices, color=(1,1,1), light_vector=aq.Q([0,0,1])):
     if len(vertices) != 4:
         raise IndexError(f"Can't draw tetragon with {len(vertices)} vertices.")
@@ -80,4 +158,240 @@ class DrawBuffer:
             glBegin(GL_TRIANGLES)
             for triangle in self.triangles:
                 draw_triangle(triangle)
-            glEnd()
\ No newline at end of file
+            glEnd()
+
+
+def enable_lighting(light_vector, ambient_light=0.5):
+    """
+    Sets up fixed-function lighting so that retained meshes are shaded like draw_triangle.
+    
+    light_vector: direction the light travels in, in eye coordinates
+    """
+    direction = -np.asarray(light_vector.vector3, dtype=float)
+    norm = np.linalg.norm(direction)
+    if norm:
+        direction /= norm
+
+    glLightModelfv(GL_LIGHT_MODEL_AMBIENT, (0, 0, 0, 1))
+    glLightfv(GL_LIGHT0, GL_POSITION, (*direction, 0))
+    glLightfv(GL_LIGHT0, GL_AMBIENT, (ambient_light, ambient_light, ambient_light, 1))
+    glLightfv(GL_LIGHT0, GL_DIFFUSE, (1-ambient_light, 1-ambient_light, 1-ambient_light, 1))
+    glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+
+    glEnable(GL_LIGHTING)
+    glEnable(GL_LIGHT0)
+    glEnable(GL_COLOR_MATERIAL)
+    glEnable(GL_NORMALIZE)
+
+
+def disable_lighting():
+    glDisable(GL_LIGHTING)
+    glDisable(GL_LIGHT0)
+    glDisable(GL_COLOR_MATERIAL)
+
+
+class LineBuffer:
+    """
+    A GPU buffer of line vertices that can be rewritten in parts, drawn as line strips in one color.
+
+    size: number of vertices the buffer holds
+    """
+
+    def __init__(self, size, usage=GL_STATIC_DRAW):
+        self.size = size
+        self.vertex_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glBufferData(GL_ARRAY_BUFFER, size * 12, None, usage)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def upload(self, vertices, first=0):
+        """Writes (n, 3) vertices into the buffer from vertex `first` on"""
+        data = np.ascontiguousarray(vertices, dtype=np.float32)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, first * 12, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self, matrix, color, width=1, strips=None, loop=False):
+        """
+        matrix: 4x4 model transform in row-vector form
+        strips: (first, count) vertex ranges, each drawn as a line strip; all of the buffer by default
+        loop: close the strips into loops
+        """
+        glPushMatrix()
+        glMultMatrixf(np.ascontiguousarray(matrix, dtype=np.float32))
+        glColor3fv(color)
+        glLineWidth(GLfloat(width))
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        for first, count in ((0, self.size),) if strips is None else strips:
+            glDrawArrays(GL_LINE_LOOP if loop else GL_LINE_STRIP, first, count)
+            counters['draw_calls'] += 1
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glPopMatrix()
+
+    def delete(self):
+        glDeleteBuffers(1, [self.vertex_buffer])
+
+
+class MeshBuffer:
+    """
+    Triangle data of a mesh, uploaded to GPU buffers once.
+
+    Vertices are not shared between triangles so that every face keeps its own flat normal.
+    
+    vertices, normals, colors: (n, 3) arrays with one row per triangle corner
+    """
+    
+    def __init__(self, vertices, normals, colors):
+        self.count = len(vertices)
+        self.vertex_buffer, self.normal_buffer, self.color_buffer = glGenBuffers(3)
+        
+        for buffer, data in ((self.vertex_buffer, vertices), (self.normal_buffer, normals), (self.color_buffer, colors)):
+            data = np.ascontiguousarray(data, dtype=np.float32)
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def bind(self):
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.normal_buffer)
+        glNormalPointer(GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.color_buffer)
+        glColorPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def unbind(self):
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+    
+    def draw(self, matrix):
+        """
+        matrix: 4x4 model transform in row-vector form, i.e. (x, y, z, 1) @ matrix
+        """
+        # A row-vector matrix in C order has the memory layout of its column-major transpose
+        glPushMatrix()
+        glMultMatrixf(np.ascontiguousarray(matrix, dtype=np.float32))
+        self.bind()
+        glDrawArrays(GL_TRIANGLES, 0, self.count)
+        counters['draw_calls'] += 1
+        counters['triangles'] += self.count // 3
+        self.unbind()
+        glPopMatrix()
+    
+    def delete(self):
+        glDeleteBuffers(3, [self.vertex_buffer, self.normal_buffer, self.color_buffer])
+
+
+# Instance attributes use locations that the fixed-function attributes of MeshBuffer never alias
+INSTANCE_ATTRIBUTE_LOCATION = 10
+
+INSTANCE_VERTEX_SHADER = """
+#version 330 compatibility
+
+layout(location = 10) in vec3 instance_position;
+layout(location = 11) in vec3 instance_x;
+layout(location = 12) in vec3 instance_y;
+layout(location = 13) in vec3 instance_z;
+layout(location = 14) in vec3 instance_color;
+
+out vec3 color;
+
+void main() {
+    // Rows of the instance orientation, so that position = vertex @ orientation + instance_position
+    mat3 orientation = mat3(instance_x, instance_y, instance_z);
+    vec3 position = orientation * gl_Vertex.xyz + instance_position;
+    
+    // Same shading as enable_lighting gives the fixed-function pipeline
+    vec3 normal = normalize(gl_NormalMatrix * (orientation * gl_Normal));
+    float light_factor = gl_LightSource[0].ambient.r
+        + gl_LightSource[0].diffuse.r * max(0.0, dot(normal, gl_LightSource[0].position.xyz));
+
+    color = gl_Color.rgb * instance_color * light_factor;
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(position, 1.0);
+}
+"""
+
+INSTANCE_FRAGMENT_SHADER = """
+#version 330 compatibility
+
+in vec3 color;
+
+void main() {
+    gl_FragColor = vec4(color, 1.0);
+}
+"""
+
+instance_program = None
+
+def get_instance_program():
+    """Compiles the instancing shader on first use (a GL context must exist by then)."""
+    global instance_program
+    if instance_program is None:
+        instance_program = compileProgram(
+            compileShader(INSTANCE_VERTEX_SHADER, GL_VERTEX_SHADER),
+            compileShader(INSTANCE_FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+    return instance_program
+
+
+class InstanceBuffer:
+    """
+    Per-instance data for drawing one MeshBuffer many times in a single call.
+
+    Every instance is 15 floats: position, the three (scaled) orientation rows and color.
+    """
+
+    attributes = 5
+
+    def __init__(self):
+        self.buffer = glGenBuffers(1)
+        self.count = 0
+
+    def upload(self, instances):
+        instances = np.ascontiguousarray(instances, dtype=np.float32).reshape(-1, 3*InstanceBuffer.attributes)
+        self.count = len(instances)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self, mesh_buffer, matrix):
+        """
+        matrix: 4x4 row-vector transform applied to every instance
+        """
+        glUseProgram(get_instance_program())
+        glPushMatrix()
+        glMultMatrixf(np.ascontiguousarray(matrix, dtype=np.float32))
+        mesh_buffer.bind()
+
+        stride = 4*3*InstanceBuffer.attributes
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        for i in range(InstanceBuffer.attributes):
+            location = INSTANCE_ATTRIBUTE_LOCATION + i
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(4*3*i))
+            glVertexAttribDivisor(location, 1)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        glDrawArraysInstanced(GL_TRIANGLES, 0, mesh_buffer.count, self.count)
+        counters['draw_calls'] += 1
+        counters['triangles'] += mesh_buffer.count // 3 * self.count
+
+        for i in range(InstanceBuffer.attributes):
+            location = INSTANCE_ATTRIBUTE_LOCATION + i
+            glVertexAttribDivisor(location, 0)
+            glDisableVertexAttribArray(location)
+        
+        mesh_buffer.unbind()
+        glPopMatrix()
+        glUseProgram(0)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.buffer])
@@ -0,0 +1,172 @@
+import numpy as np
+
+
+# Gravitational parameter of the Sun, in m^3/s^2
+SUN_MU = 1.32712440018e20
+
+
+def wrap(angles):
+    """Angles into [-pi, pi)"""
+    return (angles + np.pi) % (2*np.pi) - np.pi
+
+
+def solve_kepler(mean_anomalies, eccentricities, guesses=None, tolerance=1e-12, max_iterations=30):
+    """
+    Solves M = E - e sin E for the eccentric anomalies E of every (elliptic) orbit at once with Newton's method.
+    Returns the anomalies and the number of iterations that were needed.
+
+    guesses: starting anomalies, e.g. the previous solution advanced by the change in M
+    """
+    if guesses is None:
+        # Starting at pi converges for any eccentricity, M + e sin M is closer for small ones
+        guesses = np.where(eccentricities < 0.8, mean_anomalies + eccentricities*np.sin(mean_anomalies), np.pi*np.sign(mean_anomalies))
+    anomalies = np.array(guesses, dtype=float)
+    for iteration in range(1, max_iterations + 1):
+        steps = (anomalies - eccentricities*np.sin(anomalies) - mean_anomalies) / (1 - eccentricities*np.cos(anomalies))
+        anomalies -= steps
+        if not len(steps) or np.max(np.abs(steps)) < tolerance:
+            break
+    return anomalies, iteration
+
+
+class Orbits:
+    """
+    Keplerian orbits of many bodies, as arrays of elements, propagated together.
+
+    Every orbit is kept as its semi-major axis, eccentricity and mean anomaly at the epoch,
+    and the unit vectors P (towards periapsis) and Q (90 degrees further along) of its plane,
+    so that positions are a(cos E - e) P + a sqrt(1 - e^2) sin E Q around the central body.
+
+    mu: gravitational parameter of the central body of every orbit
+    parents: index of the orbit that a body's central body follows (moons of planets), or -1
+    """
+
+    def __init__(self, semi_major_axes, eccentricities, inclinations=0, ascending_nodes=0, arguments_of_periapsis=0,
+                 mean_anomalies=0, mu=SUN_MU, epoch=0, parents=None):
+        self.semi_major_axes = np.array(semi_major_axes, dtype=float).reshape(-1)
+        n = len(self.semi_major_axes)
+        self.eccentricities = np.broadcast_to(np.asarray(eccentricities, dtype=float), n).copy()
+        if np.any(self.eccentricities >= 1):
+            raise ValueError("Only elliptic orbits (eccentricity below 1) can be propagated.")
+        self.mean_anomalies = np.broadcast_to(np.asarray(mean_anomalies, dtype=float), n).copy()
+        self.mu = np.broadcast_to(np.asarray(mu, dtype=float), n).copy()
+        self.epoch = epoch
+        self.parents = np.full(n, -1) if parents is None else np.asarray(parents, dtype=int)
+
+        i, node, periapsis = (np.broadcast_to(np.asarray(angle, dtype=float), n) for angle in (inclinations, ascending_nodes, arguments_of_periapsis))
+        self.P = np.stack([
+            np.cos(node)*np.cos(periapsis) - np.sin(node)*np.sin(periapsis)*np.cos(i),
+            np.sin(node)*np.cos(periapsis) + np.cos(node)*np.sin(periapsis)*np.cos(i),
+            np.sin(periapsis)*np.sin(i)], axis=1)
+        self.Q = np.stack([
+            -np.cos(node)*np.sin(periapsis) - np.sin(node)*np.cos(periapsis)*np.cos(i),
+            -np.sin(node)*np.sin(periapsis) + np.cos(node)*np.cos(periapsis)*np.cos(i),
+            np.cos(periapsis)*np.sin(i)], axis=1)
+
+        self.reset()
+
+    @classmethod
+    def from_state_vectors(cls, positions, velocities, mu=SUN_MU, epoch=0, parents=None):
+        """Orbits through (n, 3) positions with (n, 3) velocities relative to their central bodies at the epoch"""
+        r = np.array(positions, dtype=float).reshape(-1, 3)
+        v = np.array(velocities, dtype=float).reshape(-1, 3)
+        mu = np.broadcast_to(np.asarray(mu, dtype=float), len(r))
+
+        distances = np.linalg.norm(r, axis=1)
+        speeds_squared = np.einsum('ij,ij->i', v, v)
+        h = np.cross(r, v)
+        h /= np.linalg.norm(h, axis=1, keepdims=True)
+        e = ((speeds_squared - mu/distances)[:, None]*r - np.einsum('ij,ij->i', r, v)[:, None]*v) / mu[:, None]
+        eccentricities = np.linalg.norm(e, axis=1)
+
+        # Circular orbits have no periapsis; their anomalies are measured from the position at the epoch
+        P = np.where(eccentricities[:, None] > 1e-12, e / np.maximum(eccentricities, 1e-300)[:, None], r / distances[:, None])
+        Q = np.cross(h, P)
+
+        true_anomalies = np.arctan2(np.einsum('ij,ij->i', r, Q), np.einsum('ij,ij->i', r, P))
+        eccentric_anomalies = np.arctan2(np.sqrt(1 - eccentricities**2)*np.sin(true_anomalies), eccentricities + np.cos(true_anomalies))
+
+        orbits = cls(1 / (2/distances - speeds_squared/mu), eccentricities, 0, 0, 0,
+                     eccentric_anomalies - eccentricities*np.sin(eccentric_anomalies), mu, epoch, parents)
+        orbits.P, orbits.Q = P, Q
+        return orbits
+
+    def __len__(self):
+        return len(self.semi_major_axes)
+
+    @property
+    def mean_motions(self):
+        return np.sqrt(self.mu / self.semi_major_axes**3)
+
+    @property
+    def periods(self):
+        return 2*np.pi / self.mean_motions
+
+    def reset(self):
+        """Forgets the last solution, after the elements (or parents) have been changed"""
+        depths = np.zeros(len(self), dtype=int)
+        ancestors = self.parents.copy()
+        while np.any(ancestors >= 0):
+            depths += ancestors >= 0
+            ancestors = np.where(ancestors >= 0, self.parents[ancestors], -1)
+            if np.max(depths) > len(self):
+                raise ValueError("The parents of the orbits form a cycle.")
+        self.levels = [np.flatnonzero(depths == depth) for depth in range(1, np.max(depths, initial=0) + 1)]
+
+        self.last_mean_anomalies = None
+        self.eccentric_anomalies = None
+        self.iterations = 0
+        self.positions = np.zeros((len(self), 3))
+        self.velocities = np.zeros((len(self), 3))
+
+    def propagate(self, t):
+        """Positions and velocities of every body at time t, around the central body of the orbits without parents"""
+        mean_anomalies = wrap(self.mean_anomalies + self.mean_motions*(t - self.epoch))
+        guesses = None
+        if self.eccentric_anomalies is not None:
+            # Warm start: the last anomalies, moved on by as much as the mean anomalies moved
+            guesses = self.eccentric_anomalies + wrap(mean_anomalies - self.last_mean_anomalies)
+        anomalies, self.iterations = solve_kepler(mean_anomalies, self.eccentricities, guesses)
+        self.eccentric_anomalies, self.last_mean_anomalies = wrap(anomalies), mean_anomalies
+        self.positions, self.velocities = self.get_state_vectors(anomalies)
+        return self.positions, self.velocities
+
+    def get_states(self, times):
+        """Positions and velocities of every body at many times, as (times, bodies, 3) arrays (not warm-started)"""
+        times = np.asarray(times, dtype=float).reshape(-1, 1)
+        mean_anomalies = wrap(self.mean_anomalies + self.mean_motions*(times - self.epoch))
+        anomalies, _ = solve_kepler(mean_anomalies, self.eccentricities)
+        return self.get_state_vectors(anomalies)
+
+    def get_state_vectors(self, anomalies):
+        """Positions and velocities at eccentric anomalies of shape (..., bodies)"""
+        a, e = self.semi_major_axes[:, None], self.eccentricities[:, None]
+        cosines, sines = np.cos(anomalies)[..., None], np.sin(anomalies)[..., None]
+        root = np.sqrt(1 - e**2)
+        positions = a*(cosines - e)*self.P + a*root*sines*self.Q
+        rates = self.mean_motions[:, None] / (1 - e*cosines)
+        velocities = a*rates*(-sines*self.P + root*cosines*self.Q)
+
+        # Bodies orbiting other bodies are moved along with them, one level of nesting after the other
+        for level in self.levels:
+            positions[..., level, :] += positions[..., self.parents[level], :]
+            velocities[..., level, :] += velocities[..., self.parents[level], :]
+        return positions, velocities
+
+    def get_paths(self, points=60):
+        """(n, points, 3) points of every orbit relative to its central body, spaced evenly in eccentric anomaly"""
+        anomalies = np.linspace(0, 2*np.pi, points, endpoint=False)
+        a, e = self.semi_major_axes[:, None, None], self.eccentricities[:, None, None]
+        cosines, sines = np.cos(anomalies)[None, :, None], np.sin(anomalies)[None, :, None]
+        return a*(cosines - e)*self.P[:, None] + a*np.sqrt(1 - e**2)*sines*self.Q[:, None]
+
+    def sync(self, objects, scale=1):
+        """
+        Writes the last positions (times scale) to renderable objects:
+        either an InstancedMesh with one instance per body, or a sequence of objects with a position.
+        """
+        if hasattr(objects, 'set_instances'):
+            objects.set_instances(positions=self.positions * scale)
+        else:
+            for obj, position in zip(objects, self.positions * scale):
+                obj.position = position
@@ -1,5 +1,5 @@
 
-from geometry import Group
+from .geometry import Group
 
 class Part(Group):
 
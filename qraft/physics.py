@@ -0,0 +1,271 @@
+import numpy as np
+
+
+def direct_accelerations(positions, masses, G=1, softening=0, chunk_size=2**20, targets=None):
+    """
+    Returns the (n, 3) gravitational accelerations of all bodies by direct summation over every pair.
+
+    softening: Plummer softening length, which keeps close encounters finite
+    chunk_size: rows are processed in blocks of about chunk_size pairs, to bound memory use
+    targets: indices of the bodies to compute accelerations for, all of them by default
+    """
+    n = len(positions)
+    targets = np.arange(n) if targets is None else np.asarray(targets)
+    accelerations = np.zeros((len(targets), 3))
+    rows = max(1, chunk_size // max(1, n))
+
+    for start in range(0, len(targets), rows):
+        block = targets[start:start + rows]
+        separations = positions[None, :, :] - positions[block, None, :] # r_j - r_i
+        distances_squared = np.einsum('ijk,ijk->ij', separations, separations) + softening**2
+
+        with np.errstate(divide='ignore'):
+            inverse_cubes = distances_squared**-1.5
+        inverse_cubes[np.arange(len(block)), block] = 0 # no self-interaction
+
+        accelerations[start:start + rows] = G * np.einsum('ij,ijk->ik', inverse_cubes * masses[None, :], separations)
+
+    return accelerations
+
+
+def direct_jerks(positions, velocities, masses, G=1, softening=0, chunk_size=2**20, targets=None):
+    """
+    Returns the (n, 3) gravitational accelerations and (n, 3) jerks (their rates of change) by direct summation.
+
+    Takes the same arguments as direct_accelerations, besides the (n, 3) velocities.
+    The pairs are worked on one coordinate at a time, as (targets, n) arrays, which is much faster
+    than reducing over a last axis of length 3.
+    """
+    n = len(positions)
+    targets = np.arange(n) if targets is None else np.asarray(targets)
+    accelerations = np.zeros((len(targets), 3))
+    jerks = np.zeros((len(targets), 3))
+    rows = max(1, chunk_size // max(1, n))
+    x, v = np.ascontiguousarray(positions.T), np.ascontiguousarray(velocities.T)
+
+    for start in range(0, len(targets), rows):
+        block = targets[start:start + rows]
+        dx, dy, dz = separations = x[:, None, :] - x[:, block, None]
+        dvx, dvy, dvz = relative_velocities = v[:, None, :] - v[:, block, None]
+
+        with np.errstate(divide='ignore'):
+            inverse_squares = 1 / (dx*dx + dy*dy + dz*dz + softening**2)
+        inverse_squares[np.arange(len(block)), block] = 0 # no self-interaction
+        weights = G * masses * inverse_squares * np.sqrt(inverse_squares)
+        rates = 3 * inverse_squares * (dx*dvx + dy*dvy + dz*dvz)
+
+        accelerations[start:start + rows] = np.einsum('kn,ckn->kc', weights, separations)
+        jerks[start:start + rows] = np.einsum('kn,ckn->kc', weights, relative_velocities) \
+            - np.einsum('kn,ckn->kc', weights*rates, separations)
+
+    return accelerations, jerks
+
+
+def potential_energy(positions, masses, G=1, softening=0, chunk_size=2**20):
+    n = len(positions)
+    energy = 0
+    rows = max(1, chunk_size // max(1, n))
+
+    for start in range(0, n, rows):
+        stop = min(n, start + rows)
+        separations = positions[None, :, :] - positions[start:stop, None, :]
+        distances = np.sqrt(np.einsum('ijk,ijk->ij', separations, separations) + softening**2)
+
+        # Only count the pairs with j > i
+        pairs = np.arange(n)[None, :] > np.arange(start, stop)[:, None]
+        energy -= G * np.sum(np.where(pairs, masses[start:stop, None] * masses[None, :] / np.where(pairs, distances, 1), 0))
+
+    return energy
+
+
+def euler(system, dt):
+    """Semi-implicit (symplectic) Euler: velocities first, then positions with the new velocities"""
+    system.velocities += system.get_accelerations() * dt
+    system.positions += system.velocities * dt
+    system.accelerations = None
+
+
+def leapfrog(system, dt):
+    """Kick-drift-kick leapfrog, i.e. velocity Verlet. Needs one force evaluation per step."""
+    system.velocities += 0.5 * dt * system.get_accelerations()
+    system.positions += system.velocities * dt
+    system.accelerations = None
+    system.velocities += 0.5 * dt * system.get_accelerations()
+
+
+def rk4(system, dt):
+    """Classical fourth order Runge-Kutta. Accurate over short spans, but not symplectic."""
+    x0, v0 = system.positions.copy(), system.velocities.copy()
+
+    def derivative(x, v):
+        return v, system.solver(x, system.masses, system.G, system.softening)
+
+    k1x, k1v = derivative(x0, v0)
+    k2x, k2v = derivative(x0 + 0.5*dt*k1x, v0 + 0.5*dt*k1v)
+    k3x, k3v = derivative(x0 + 0.5*dt*k2x, v0 + 0.5*dt*k2v)
+    k4x, k4v = derivative(x0 + dt*k3x, v0 + dt*k3v)
+
+    system.positions += dt/6 * (k1x + 2*k2x + 2*k3x + k4x)
+    system.velocities += dt/6 * (k1v + 2*k2v + 2*k3v + k4v)
+    system.accelerations = None
+
+
+class BlockHermite:
+    """
+    Fourth order Hermite integration with individual block timesteps, for systems where a few close pairs
+    (a moon around its planet, a pass by the sun) need much smaller steps than everything else.
+
+    Every body steps by dt / 2**level, its level chosen from its acceleration and the derivatives of it
+    by Aarseth's criterion. Only the bodies that are due at a block time are moved (to positions predicted
+    for all the others); times are counted in integer ticks of the smallest step, so the schedule is exact
+    and the same on every run, and all bodies are synchronized again at the end of dt.
+
+    Forces come from direct_jerks, whatever the system's solver, since the jerks are needed as well.
+
+    accuracy: eta of the timestep criterion
+    start_accuracy: eta of the first steps, which only have the acceleration and jerk to go by
+    max_level: the smallest step is dt / 2**max_level
+    evaluations: number of single-body force evaluations so far, over all systems stepped
+    """
+
+    def __init__(self, accuracy=0.02, start_accuracy=0.01, max_level=20):
+        self.accuracy = accuracy
+        self.start_accuracy = start_accuracy
+        self.max_level = max_level
+        self.evaluations = 0
+
+    def get_levels(self, steps, dt):
+        """The levels whose steps are at most the given ones"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            levels = np.ceil(np.log2(dt / steps))
+        # No change in the forces at all (0 / 0) needs no small step either
+        levels[np.isnan(levels)] = 0
+        return np.clip(levels, 0, self.max_level).astype(np.int64)
+
+    def __call__(self, system, dt):
+        n = len(system)
+        G, softening, masses = system.G, system.softening, system.masses
+        if system.accelerations is None or system.jerks is None or len(system.levels) != n:
+            system.accelerations, system.jerks = direct_jerks(system.positions, system.velocities, masses, G, softening)
+            self.evaluations += n
+            vectors = np.stack([system.accelerations, system.jerks])
+            a, j = np.sqrt(np.einsum('kni,kni->kn', vectors, vectors))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                system.levels = self.get_levels(self.start_accuracy * a / j, dt)
+
+        x, v, a, j = system.positions, system.velocities, system.accelerations, system.jerks
+        ticks = 1 << self.max_level
+        tick = dt / ticks
+        last = np.zeros(n, dtype=np.int64)
+        now = 0
+
+        while now < ticks:
+            steps = ticks >> system.levels
+            now = np.min(last + steps)
+            active = np.flatnonzero(last + steps == now)
+
+            # Everyone is predicted to the block time (as sources), only the active bodies are corrected
+            elapsed = ((now - last) * tick)[:, None]
+            half_a, sixth_j = a/2, j/6
+            predicted_x = x + elapsed*(v + elapsed*(half_a + elapsed*sixth_j))
+            predicted_v = v + elapsed*(a + elapsed*(3*sixth_j))
+            a1, j1 = direct_jerks(predicted_x, predicted_v, masses, G, softening, targets=active)
+            self.evaluations += len(active)
+
+            h = elapsed[active]
+            a0, j0, v0 = a[active], j[active], v[active]
+            da, h2 = a0 - a1, h*h
+            v1 = v0 + h*(a0 + a1)/2 + h2*(j0 - j1)/12
+            x[active] += h*(v0 + v1)/2 + h2*da/12
+            v[active] = v1
+
+            # Aarseth's criterion, with the second and third derivatives from the Hermite interpolant
+            crackles = (12*da + 6*h*(j0 + j1)) / (h2*h)
+            snaps = (-6*da - h*(4*j0 + 2*j1)) / h2 + h*crackles
+            vectors = np.stack([a1, j1, snaps, crackles])
+            a_norm, j_norm, s_norm, c_norm = np.sqrt(np.einsum('kni,kni->kn', vectors, vectors))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ideal = np.sqrt(self.accuracy * (a_norm*s_norm + j_norm**2) / (j_norm*c_norm + s_norm**2))
+            required, levels = self.get_levels(ideal, dt), system.levels[active]
+            # Steps may only grow where the doubled step stays in line with the block times
+            grow = (required < levels) & (now % (2*steps[active]) == 0)
+            system.levels[active] = np.where(required > levels, required, levels - grow)
+
+            a[active], j[active] = a1, j1
+            last[active] = now
+
+
+integrators = {
+    'euler': euler,
+    'leapfrog': leapfrog,
+    'verlet': leapfrog,
+    'rk4': rk4,
+    'hermite': BlockHermite(),
+}
+
+
+class NBody:
+    """
+    A gravitating system stored as arrays.
+
+    positions, velocities: (n, 3)
+    masses: (n,)
+    softening: Plummer softening length
+    integrator: a name from physics.integrators, or a function (system, dt)
+    solver: function (positions, masses, G, softening) returning accelerations, direct_accelerations by default
+    """
+
+    def __init__(self, positions, velocities, masses, G=1, softening=0, integrator='leapfrog', solver=direct_accelerations):
+        self.positions = np.array(positions, dtype=float).reshape(-1, 3)
+        self.velocities = np.array(velocities, dtype=float).reshape(-1, 3)
+        self.masses = np.array(masses, dtype=float).reshape(-1)
+
+        if not len(self.positions) == len(self.velocities) == len(self.masses):
+            raise IndexError(f"Got {len(self.positions)} positions, {len(self.velocities)} velocities and {len(self.masses)} masses.")
+
+        self.G = G
+        self.softening = softening
+        self.integrator = integrators[integrator] if isinstance(integrator, str) else integrator
+        self.solver = solver
+        self.accelerations = None
+        # Kept by the block timestep integrator
+        self.jerks = None
+        self.levels = np.zeros(0, dtype=np.int64)
+        self.t = 0
+
+    def __len__(self):
+        return len(self.masses)
+
+    def get_accelerations(self):
+        """Accelerations at the current positions, evaluated at most once per position update"""
+        if self.accelerations is None:
+            self.accelerations = self.solver(self.positions, self.masses, self.G, self.softening)
+        return self.accelerations
+
+    def step(self, dt, steps=1):
+        for _ in range(steps):
+            self.integrator(self, dt)
+            self.t += dt
+
+    def kinetic_energy(self):
+        return 0.5 * np.sum(self.masses * np.einsum('ij,ij->i', self.velocities, self.velocities))
+
+    def potential_energy(self):
+        return potential_energy(self.positions, self.masses, self.G, self.softening)
+
+    def energy(self):
+        return self.kinetic_energy() + self.potential_energy()
+
+    def center_of_mass(self):
+        return self.masses @ self.positions / np.sum(self.masses)
+
+    def sync(self, objects, scale=1):
+        """
+        Writes the positions (times scale) back to renderable objects:
+        either an InstancedMesh with one instance per body, or a sequence of objects with a position.
+        """
+        if hasattr(objects, 'set_instances'):
+            objects.set_instances(positions=self.positions * scale)
+        else:
+            for obj, position in zip(objects, self.positions * scale):
+                obj.position = position
@@ -0,0 +1,386 @@
+import math
+import heapq
+import weakref
+
+import numpy as np
+
+from . import geometry as gm
+from .barneshut import morton_keys, concatenated_ranges
+
+
+def hit_boxes(lows, highs, origins, inverse_directions, max_distances):
+    """Whether rays pass through axis-aligned boxes (slab test), between 0 and max_distances along them"""
+    with np.errstate(invalid='ignore'):
+        near_planes = (lows - origins) * inverse_directions
+        far_planes = (highs - origins) * inverse_directions
+    near_planes, far_planes = np.minimum(near_planes, far_planes), np.maximum(near_planes, far_planes)
+
+    # A ray parallel to a slab never crosses its planes (0 * inf would be NaN there):
+    # it is inside the slab all along, or never
+    parallel = np.isinf(inverse_directions)
+    inside = (lows <= origins) & (origins <= highs)
+    near_planes = np.where(parallel, np.where(inside, -np.inf, np.inf), near_planes)
+    far_planes = np.where(parallel, np.where(inside, np.inf, -np.inf), far_planes)
+
+    near, far = np.max(near_planes, axis=1), np.min(far_planes, axis=1)
+    return np.all(lows <= highs, axis=1) & (far >= np.maximum(near, 0)) & (near <= max_distances)
+
+
+def intersect_triangles(origins, directions, triangles):
+    """Distances along rays to (m, 3, 3) triangles (Moller-Trumbore, both sides), inf where they miss"""
+    edges1 = triangles[:, 1] - triangles[:, 0]
+    edges2 = triangles[:, 2] - triangles[:, 0]
+    p = np.cross(directions, edges2)
+    determinants = np.einsum('ni,ni->n', edges1, p)
+    s = origins - triangles[:, 0]
+    q = np.cross(s, edges1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse = 1 / determinants
+        u = np.einsum('ni,ni->n', s, p) * inverse
+        v = np.einsum('ni,ni->n', directions, q) * inverse
+        distances = np.einsum('ni,ni->n', edges2, q) * inverse
+        hit = (u >= 0) & (v >= 0) & (u + v <= 1) & (distances >= 0)
+    return np.where(hit, distances, np.inf)
+
+
+class BVH:
+    """
+    A bounding volume hierarchy over axis-aligned boxes, as an implicit complete binary tree.
+
+    The items are sorted along a Morton curve and cut into leaves of leaf_size; node k has the children
+    2k and 2k + 1 (the root is node 1), and the leaves are the nodes from 2**depth on. Both building and
+    queries are array operations over a whole level of the tree at a time, except for nearest, which
+    walks the tree for a single ray nearest box first, and stops as soon as no box can be nearer than a hit.
+    """
+
+    def __init__(self, lows, highs, leaf_size=4):
+        lows = np.asarray(lows, dtype=float).reshape(-1, 3)
+        highs = np.asarray(highs, dtype=float).reshape(-1, 3)
+        self.count = n = len(lows)
+        self.leaf_size = leaf_size
+
+        centers = (lows + highs) / 2
+        low = centers.min(axis=0) if n else gm.ORIGIN
+        side = (np.max(centers.max(axis=0) - low) if n else 0) or 1
+        cells = np.clip(((centers - low) / side * 1024).astype(np.int64), 0, 1023)
+        self.order = np.argsort(morton_keys(cells), kind='stable')
+
+        self.depth = math.ceil(math.log2(max(1, -(-n // leaf_size))))
+        first_leaf = 2**self.depth
+        # Leaves past the last item stay empty, with inverted boxes that no ray passes through
+        self.lows = np.full((2*first_leaf, 3), np.inf)
+        self.highs = np.full((2*first_leaf, 3), -np.inf)
+        if n:
+            starts = np.arange(0, n, leaf_size)
+            self.lows[first_leaf:first_leaf + len(starts)] = np.minimum.reduceat(lows[self.order], starts)
+            self.highs[first_leaf:first_leaf + len(starts)] = np.maximum.reduceat(highs[self.order], starts)
+        for level in range(self.depth - 1, -1, -1):
+            nodes = np.arange(2**level, 2**(level + 1))
+            self.lows[nodes] = np.minimum(self.lows[2*nodes], self.lows[2*nodes + 1])
+            self.highs[nodes] = np.maximum(self.highs[2*nodes], self.highs[2*nodes + 1])
+        # Python floats for nearest, where numpy calls on single boxes would cost more than the tests
+        self.box_list = np.concatenate([self.lows, self.highs], axis=1).tolist()
+
+    def intersect(self, origins, directions, max_distances=np.inf):
+        """
+        Returns (m,) ray indices and (m,) item indices of the items whose boxes the rays pass through,
+        closer than max_distances; origins and directions are (r, 3), for r rays at once
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+        max_distances = np.broadcast_to(np.asarray(max_distances, dtype=float), len(origins))
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1 / directions
+
+        rays = np.arange(len(origins))
+        nodes = np.ones(len(origins), dtype=np.int64)
+        for level in range(self.depth + 1):
+            keep = hit_boxes(self.lows[nodes], self.highs[nodes], origins[rays], inverse_directions[rays], max_distances[rays])
+            rays, nodes = rays[keep], nodes[keep]
+            if level < self.depth:
+                rays = np.repeat(rays, 2)
+                nodes = (2*nodes[:, None] + (0, 1)).reshape(-1)
+
+        starts = (nodes - 2**self.depth) * self.leaf_size
+        counts = np.clip(self.count - starts, 0, self.leaf_size)
+        items = np.repeat(starts, counts) + concatenated_ranges(counts)
+        return np.repeat(rays, counts), self.order[items]
+
+    def enter(self, node, origin, inverse_direction, max_distance):
+        """Distance along a single ray to where it enters the box of a node, or None if it misses it before max_distance"""
+        box = self.box_list[node]
+        near, far = 0.0, max_distance
+        for axis in range(3):
+            low, high, o, inverse = box[axis], box[axis + 3], origin[axis], inverse_direction[axis]
+            if low > high:
+                return None
+            if math.isinf(inverse):
+                if not low <= o <= high:
+                    return None
+                continue
+            t1, t2 = (low - o) * inverse, (high - o) * inverse
+            if t1 > t2:
+                t1, t2 = t2, t1
+            near, far = max(near, t1), min(far, t2)
+            if near > far:
+                return None
+        return near
+
+    def nearest(self, origin, direction, test, max_distance=np.inf):
+        """
+        The nearest hit of a single ray, as (distance, item), or (max_distance, -1) if nothing is hit.
+
+        test(items, max_distance) is called with the item indices of a leaf, nearest leaf first,
+        and returns the (distance, item) of the nearest of them that the ray hits closer than max_distance,
+        or (inf, -1).
+        """
+        origin = np.asarray(origin, dtype=float).reshape(3).tolist()
+        with np.errstate(divide='ignore'):
+            inverse_direction = (1 / np.asarray(direction, dtype=float).reshape(3)).tolist()
+        first_leaf = 2**self.depth
+        best, best_item = float(max_distance), -1
+
+        entry = self.enter(1, origin, inverse_direction, best)
+        heap = [] if entry is None else [(entry, 1)]
+        while heap:
+            entry, node = heapq.heappop(heap)
+            if entry > best:
+                break
+            if node >= first_leaf:
+                start = (node - first_leaf) * self.leaf_size
+                distance, item = test(self.order[start:min(start + self.leaf_size, self.count)], best)
+                if distance < best:
+                    best, best_item = distance, item
+                continue
+            for child in (2*node, 2*node + 1):
+                entry = self.enter(child, origin, inverse_direction, best)
+                if entry is not None:
+                    heapq.heappush(heap, (entry, child))
+        return best, best_item
+
+
+# Triangle BVHs by (id(vertices), id(triangles)), as (vertices reference, triangles reference, BVH)
+trees = {}
+
+
+def get_tree(mesh):
+    """
+    The BVH over a mesh's triangles in model space (before scaling), built on first use.
+
+    Trees are kept per pair of vertex and triangle arrays, not per mesh, so every sphere sharing a template
+    (and every level of detail it switches to) shares one tree. Only weak references to the arrays are held,
+    and a tree is dropped with its arrays.
+    """
+    vertices, triangles = mesh.vertices, mesh.triangles
+    key = id(vertices), id(triangles)
+    cached = trees.get(key)
+    # The ids of collected arrays can be reused, before the finalizer below has run
+    if cached is None or cached[0]() is not vertices or cached[1]() is not triangles:
+        corners = vertices[triangles]
+        cached = trees[key] = (weakref.ref(vertices), weakref.ref(triangles), BVH(corners.min(axis=1), corners.max(axis=1)))
+        for array in (vertices, triangles):
+            weakref.finalize(array, trees.pop, key, None)
+    return cached[2]
+
+
+def cast_mesh(mesh, origins, directions, max_distances=np.inf):
+    """
+    Casts rays given in a mesh's model space at its triangles.
+    Returns the distance to the nearest hit of every ray (inf if none) and the index of the triangle hit (-1 if none).
+    """
+    rays, triangles = get_tree(mesh).intersect(origins, directions, max_distances)
+    distances = intersect_triangles(origins[rays], directions[rays], mesh.vertices[mesh.triangles[triangles]])
+
+    nearest = np.full(len(origins), np.inf)
+    nearest_triangles = np.full(len(origins), -1)
+    order = np.lexsort((distances, rays))
+    first = order[np.append(True, rays[order][1:] != rays[order][:-1])] if len(order) else order
+    hit = distances[first] < np.broadcast_to(max_distances, len(origins))[rays[first]]
+    nearest[rays[first][hit]] = distances[first][hit]
+    nearest_triangles[rays[first][hit]] = triangles[first][hit]
+    return nearest, nearest_triangles
+
+
+def nearest_triangle(mesh, origin, direction, max_distance=np.inf):
+    """Casts a single ray given in a mesh's model space, returning the distance (max_distance if none) and triangle (-1 if none) hit"""
+    (ox, oy, oz), (dx, dy, dz) = origin.tolist(), direction.tolist()
+
+    # intersect_triangles on Python floats, as the leaves only have a few triangles
+    def test(triangles, limit):
+        best, best_triangle = np.inf, -1
+        for triangle, ((ax, ay, az), (bx, by, bz), (cx, cy, cz)) in zip(
+                triangles.tolist(), mesh.vertices[mesh.triangles[triangles]].tolist()):
+            e1x, e1y, e1z, e2x, e2y, e2z = bx - ax, by - ay, bz - az, cx - ax, cy - ay, cz - az
+            px, py, pz = dy*e2z - dz*e2y, dz*e2x - dx*e2z, dx*e2y - dy*e2x
+            determinant = e1x*px + e1y*py + e1z*pz
+            if determinant == 0:
+                continue
+            inverse = 1 / determinant
+            sx, sy, sz = ox - ax, oy - ay, oz - az
+            u = (sx*px + sy*py + sz*pz) * inverse
+            if u < 0 or u > 1:
+                continue
+            qx, qy, qz = sy*e1z - sz*e1y, sz*e1x - sx*e1z, sx*e1y - sy*e1x
+            v = (dx*qx + dy*qy + dz*qz) * inverse
+            distance = (e2x*qx + e2y*qy + e2z*qz) * inverse
+            if v >= 0 and u + v <= 1 and 0 <= distance < min(best, limit):
+                best, best_triangle = distance, triangle
+        return best, best_triangle
+    return get_tree(mesh).nearest(origin, direction, test, max_distance)
+
+
+def get_meshes(node):
+    """The nodes of a scene graph subtree that have triangles: meshes (including baked groups) and instanced meshes"""
+    if isinstance(node, (gm.Mesh, gm.InstancedMesh)):
+        yield node
+    else:
+        for child in node.children:
+            yield from get_meshes(child)
+
+
+def get_ray(camera, width, height, pixel):
+    """
+    World origin and unit direction of the ray from a camera through a pixel of a width x height view,
+    counted from the top left as pygame does (e.g. Mouse.position)
+    """
+    tangent = math.tan(math.radians(camera.field_of_view) / 2)
+    x = (2*(pixel[0] + 0.5) / width - 1) * tangent * width / height
+    y = (1 - 2*(pixel[1] + 0.5) / height) * tangent
+    direction = np.array([x, y, -1]) @ gm.basis(camera.unit_vectors)
+    return gm.vector3(camera.position), direction / np.linalg.norm(direction)
+
+
+class Hit:
+    """
+    Where a ray hit a mesh.
+
+    distance: along the ray, whose direction is a unit vector
+    point, normal: world position, and the outward normal of the triangle there
+    object: the object (from Picker.objects) the mesh is part of
+    mesh: the Mesh, or InstancedMesh, that was hit
+    instance: index of the instance of an InstancedMesh, otherwise -1
+    triangle: index of the triangle in the mesh's triangles
+    """
+
+    def __init__(self, distance, point, normal, obj, mesh, instance, triangle):
+        self.distance = distance
+        self.point = point
+        self.normal = normal
+        self.object = obj
+        self.mesh = mesh
+        self.instance = instance
+        self.triangle = triangle
+
+    def __repr__(self):
+        return f"Hit({type(self.mesh).__name__} at {self.distance:.6g}, triangle {self.triangle})"
+
+
+class Picker:
+    """
+    Ray casting against the triangles of scene objects.
+
+    A top-level BVH over the bounding spheres of every mesh (and every instance of an InstancedMesh)
+    finds the meshes along a ray; the rays are then moved into the model space of each of them and cast
+    through the mesh's own triangle BVH, which is built when the mesh is first hit and kept for later casts.
+    cast works on many rays at once, level by level; cast_ray (and pick) search for a single ray nearest first.
+
+    The top-level BVH is built from the world transforms of the last update, and refresh has to be called
+    after the objects moved (e.g. after Scene.update).
+    """
+
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self.refresh()
+
+    def refresh(self):
+        # One item per mesh or instance: (object index, mesh, instance)
+        self.items = []
+        centers, radii = [], []
+        for index, obj in enumerate(self.objects):
+            for mesh in get_meshes(obj):
+                if isinstance(mesh, gm.InstancedMesh):
+                    self.items.extend((index, mesh, instance) for instance in range(mesh.count))
+                else:
+                    self.items.append((index, mesh, -1))
+                mesh_centers, mesh_radii = mesh.get_bounds()
+                centers.append(mesh_centers)
+                radii.append(mesh_radii)
+        centers = np.concatenate(centers) if centers else np.zeros((0, 3))
+        radii = np.concatenate(radii)[:, None] if radii else np.zeros((0, 1))
+        self.tree = BVH(centers - radii, centers + radii)
+
+    def get_model_transform(self, mesh, instance):
+        """The mesh (or instance) model-space geometry, with the row-vector map v -> v @ matrix + position into world space"""
+        if instance < 0:
+            return mesh, mesh.scale*mesh.world_rotation, mesh.world_position
+        rotation = mesh.get_instance_rotations()[instance]
+        return mesh.mesh, rotation @ mesh.world_rotation, mesh.positions[instance] @ mesh.world_rotation + mesh.world_position
+
+    def cast(self, origins, directions, max_distance=np.inf):
+        """Casts (r, 3) rays, returning a Hit, or None, for each of them"""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        distances = np.full(len(origins), float(max_distance))
+        triangles = np.full(len(origins), -1)
+        hit_items = np.full(len(origins), -1)
+
+        rays, items = self.tree.intersect(origins, directions, distances)
+        for item in np.unique(items):
+            _, mesh, instance = self.items[item]
+            geometry, matrix, position = self.get_model_transform(mesh, instance)
+            inverse = np.linalg.inv(matrix)
+            # Model-space directions keep the length that makes distances along them world distances
+            candidates = rays[items == item]
+            nearest, nearest_triangles = cast_mesh(
+                geometry, (origins[candidates] - position) @ inverse, directions[candidates] @ inverse, distances[candidates])
+            closer = nearest < distances[candidates]
+            distances[candidates[closer]] = nearest[closer]
+            triangles[candidates[closer]] = nearest_triangles[closer]
+            hit_items[candidates[closer]] = item
+
+        return [self.get_hit(origins[ray], directions[ray], distances[ray], hit_items[ray], triangles[ray])
+                for ray in range(len(origins))]
+
+    def get_hit(self, origin, direction, distance, item, triangle):
+        if item < 0:
+            return None
+        index, mesh, instance = self.items[item]
+        geometry, matrix, _ = self.get_model_transform(mesh, instance)
+        normal = geometry.normals[triangle] @ matrix
+        return Hit(distance, origin + distance*direction, normal / np.linalg.norm(normal), self.objects[index], mesh, instance, triangle)
+
+    def cast_ray(self, origin, direction, max_distance=np.inf):
+        """
+        The nearest Hit of a single ray, or None.
+
+        Unlike cast, both the meshes and their triangles are visited nearest first, and the search stops at the
+        first hit that nothing else can be nearer than, which is much faster for a single ray.
+        """
+        origin = gm.vector3(origin)
+        direction = gm.vector3(direction)
+        direction = direction / np.linalg.norm(direction)
+        triangles = {}
+
+        def test(items, limit):
+            best, best_item = np.inf, -1
+            for item in items:
+                _, mesh, instance = self.items[item]
+                geometry, matrix, position = self.get_model_transform(mesh, instance)
+                inverse = np.linalg.inv(matrix)
+                distance, triangles[item] = nearest_triangle(geometry, (origin - position) @ inverse, direction @ inverse, min(best, limit))
+                if triangles[item] >= 0:
+                    best, best_item = distance, item
+            return best, best_item
+
+        distance, item = self.tree.nearest(origin, direction, test, max_distance)
+        return self.get_hit(origin, direction, distance, item, triangles.get(item, -1))
+
+    def pick(self, camera, width, height, pixel, max_distance=np.inf):
+        """The nearest Hit under a pixel of the view (e.g. Mouse.position), or None"""
+        return self.cast_ray(*get_ray(camera, width, height, pixel), max_distance)
+
+    def line_of_sight(self, start, end):
+        """Whether nothing lies between two world points"""
+        offset = gm.vector3(end) - gm.vector3(start)
+        return self.cast_ray(gm.vector3(start), offset, np.linalg.norm(offset)) is None
@@ -0,0 +1,144 @@
+import numpy as np
+
+from . import graphics
+from . import geometry as gm
+
+
+def as_points(points):
+    """(n, 3) float64 array of a sequence of quaternions or vectors, such as a QuaternionArray"""
+    if isinstance(points, np.ndarray) and points.shape[-1:] == (3,):
+        return np.array(points, dtype=float)
+    return np.array([gm.vector3(point) for point in points], dtype=float).reshape(-1, 3)
+
+
+def as_polyline(line):
+    """Scene.lines may also hold (points, color) tuples, which are turned into Polylines"""
+    return line if isinstance(line, Polyline) else Polyline(*line)
+
+
+class Polyline:
+    """
+    A line strip through world-space points, uploaded to a GPU buffer once and drawn with one call.
+
+    The points are stored relative to the first one, so that the float32 buffer keeps its
+    precision far from the world origin; the offset is applied as a matrix when drawing.
+
+    closed: join the last point back to the first
+    """
+
+    def __init__(self, points, color=(1,1,1), width=1, closed=False):
+        self.color = color
+        self.width = width
+        self.closed = closed
+        self.buffer = None
+        self.set_points(points)
+
+    def set_points(self, points):
+        self.points = as_points(points)
+        self.anchor = self.points[0].copy() if len(self.points) else gm.ORIGIN
+        self.changed = True
+        return self
+
+    def get_points(self):
+        """The points in drawing order, as an (n, 3) array"""
+        return self.points
+
+    def get_matrix(self, origin=gm.ORIGIN):
+        matrix = np.identity(4)
+        matrix[3, :3] = self.anchor
+        return gm.relative_matrix(matrix, origin)
+
+    def draw(self, origin=gm.ORIGIN):
+        if len(self.points) < 2:
+            return
+        if self.changed:
+            if self.buffer is not None:
+                self.buffer.delete()
+            self.buffer = graphics.LineBuffer(len(self.points))
+            self.buffer.upload(self.points - self.anchor)
+            self.changed = False
+        self.buffer.draw(self.get_matrix(origin), self.color, self.width, loop=self.closed)
+
+    def delete(self):
+        if self.buffer is not None:
+            self.buffer.delete()
+            self.buffer = None
+
+
+class Trail(Polyline):
+    """
+    The last `capacity` points of a path, kept in a ring buffer.
+
+    Appending a point only writes that point (on the next draw), instead of rebuilding the line.
+    The ring has one extra slot repeating slot 0, so that after wrapping around the line
+    is still drawn as two strips joined end to start.
+    """
+
+    def __init__(self, capacity, color=(1,1,1), width=1):
+        self.capacity = capacity
+        self.ring = np.zeros((capacity + 1, 3))
+        self.head = 0
+        self.count = 0
+        self.pending = 0
+        super().__init__((), color, width)
+        self.anchor = None
+
+    def set_points(self, points):
+        self.clear()
+        return self.extend(as_points(points))
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.pending = 0
+        return self
+
+    def append(self, point):
+        return self.extend(gm.vector3(point)[None])
+
+    def extend(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 3)[-self.capacity:]
+        if not len(points):
+            return self
+        if self.anchor is None:
+            self.anchor = points[0].copy()
+
+        slots = (self.head + np.arange(len(points))) % self.capacity
+        self.ring[slots] = points
+        self.ring[self.capacity] = self.ring[0]
+
+        self.head = (self.head + len(points)) % self.capacity
+        self.count = min(self.count + len(points), self.capacity)
+        self.pending = min(self.pending + len(points), self.capacity)
+        return self
+
+    def get_points(self):
+        if self.count < self.capacity:
+            return self.ring[:self.count]
+        return np.concatenate([self.ring[self.head:self.capacity], self.ring[:self.head]])
+
+    def get_strips(self):
+        """(first, count) ranges of the ring, oldest first"""
+        if self.count < self.capacity or self.head == 0:
+            return [(0, self.count)]
+        return [(self.head, self.capacity - self.head + 1), (0, self.head)]
+
+    def upload(self):
+        """Writes the slots appended since the last draw"""
+        start = (self.head - self.pending) % self.capacity
+        end = start + self.pending
+        ranges = [(start, end)] if end <= self.capacity else [(start, self.capacity), (0, end - self.capacity)]
+        if start == 0 or end > self.capacity:
+            ranges.append((self.capacity, self.capacity + 1))
+        for first, last in ranges:
+            self.buffer.upload(self.ring[first:last] - self.anchor, first)
+        self.pending = 0
+
+    def draw(self, origin=gm.ORIGIN):
+        if self.count < 2:
+            return
+        if self.buffer is None:
+            self.buffer = graphics.LineBuffer(self.capacity + 1, graphics.GL_DYNAMIC_DRAW)
+        if self.pending:
+            self.upload()
+        self.buffer.draw(self.get_matrix(origin), self.color, self.width, self.get_strips())
@@ -0,0 +1,185 @@
+import csv
+import json
+import time
+import tracemalloc
+import contextlib
+from collections import deque
+
+import numpy as np
+
+import pygame
+from OpenGL.GL import glWindowPos2i, glDrawPixels, glEnable, glDisable, glIsEnabled, GL_RGBA, GL_UNSIGNED_BYTE, GL_DEPTH_TEST
+
+
+# The profiler that stage() reports to, set by Profiler.start
+active = None
+
+NO_STAGE = contextlib.nullcontext()
+
+def stage(name):
+    """
+    Times a `with` block as part of the named stage of the frame, if a profiler is active.
+    A stage entered several times in a frame adds up; nested stages are included in the ones around them,
+    and a stage entered again inside itself (e.g. by recursion) only counts the outermost entry.
+    """
+    if active is None:
+        return NO_STAGE
+    return active.stage(name)
+
+
+class Stage:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        # One start time per entry that hasn't exited yet, as the same Stage is reused for every entry
+        self.starts = []
+
+    def __enter__(self):
+        self.starts.append(time.perf_counter())
+
+    def __exit__(self, *exception):
+        start = self.starts.pop()
+        if not self.starts:
+            times = self.profiler.current
+            times[self.name] = times.get(self.name, 0) + time.perf_counter() - start
+
+
+class Profiler:
+    """
+    Collects the time of every stage of a frame, and per-frame counts such as Scene.stats,
+    over a rolling window of frames.
+
+        profiler = Profiler().start()
+        while running:
+            profiler.begin_frame()
+            with profiler.stage('input'):
+                ...
+            profiler.end_frame(**scene.stats)
+
+    window: number of frames that percentiles are taken over
+    record: also keep every frame, for dump
+    track_allocations: keep the peak_allocated_bytes of every frame, how far the memory traced by tracemalloc
+        rose above where it was at the start of the frame (which slows everything down). Memory allocated
+        and freed again below that peak isn't counted.
+    """
+
+    def __init__(self, window=300, record=False, track_allocations=False):
+        self.frames = deque(maxlen=window)
+        self.trace = [] if record else None
+        self.track_allocations = track_allocations
+        self.stages = {}
+        self.current = {}
+        self.frame_start = None
+        self.frame_memory = 0
+
+        self.overlay = None
+        self.overlay_frame = 0
+
+    def start(self):
+        global active
+        active = self
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    def stop(self):
+        global active
+        if active is self:
+            active = None
+        if self.track_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return self
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(self, name)
+        return self.stages[name]
+
+    def begin_frame(self):
+        self.current = {}
+        self.frame_start = time.perf_counter()
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+            self.frame_memory = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self, **counts):
+        """Closes the frame, with any counts (nodes, triangles, draw calls...) to keep along with its times"""
+        frame = {'frame': time.perf_counter() - self.frame_start, **self.current, **counts}
+        if self.track_allocations:
+            frame['peak_allocated_bytes'] = tracemalloc.get_traced_memory()[1] - self.frame_memory
+        self.frames.append(frame)
+        if self.trace is not None:
+            self.trace.append(frame)
+        return frame
+
+    def get_columns(self, frames=None):
+        columns = {}
+        for frame in self.frames if frames is None else frames:
+            columns.update(dict.fromkeys(frame))
+        return list(columns)
+
+    def get_values(self, name):
+        """The values of a stage or count over the window, with 0 for frames that didn't have it"""
+        return np.array([frame.get(name, 0) for frame in self.frames], dtype=float)
+
+    def histogram(self, name, bins=20):
+        return np.histogram(self.get_values(name), bins)
+
+    def percentiles(self, name, q=(50, 95, 99)):
+        values = self.get_values(name)
+        if not len(values):
+            return dict.fromkeys((f'p{p}' for p in q), 0.0)
+        return dict(zip((f'p{p}' for p in q), np.percentile(values, q).tolist()))
+
+    def summary(self):
+        """p50, p95 and p99 of every stage and count over the window"""
+        return {name: self.percentiles(name) for name in self.get_columns()}
+
+    def dump(self, filename):
+        """Writes the recorded frames (or the window) to a .json file with the summary, or to a .csv file"""
+        frames = list(self.frames if self.trace is None else self.trace)
+        if filename.endswith('.csv'):
+            with open(filename, 'w', newline='') as file:
+                writer = csv.DictWriter(file, self.get_columns(frames), restval=0)
+                writer.writeheader()
+                writer.writerows(frames)
+        else:
+            with open(filename, 'w') as file:
+                json.dump({'summary': self.summary(), 'frames': frames}, file, indent=4)
+
+    def get_overlay_lines(self):
+        lines = [f"{'':<16}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, values in self.summary().items():
+            # Times are shown in milliseconds, counts as they are
+            scale = 1000 if name == 'frame' or name in self.stages else 1
+            lines.append(f"{name:<16}" + ''.join(f"{value*scale:>9.2f}" for value in values.values()))
+        return lines
+
+    def draw_overlay(self, scene, position=(8, 8), interval=15):
+        """
+        Draws the summary in the corner of an OpenGL scene, after it has rendered.
+        The text is only laid out again every `interval` frames.
+        """
+        if not self.frames:
+            return
+        if self.overlay is None or self.overlay_frame % interval == 0:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.SysFont('monospace', 14)
+            lines = [font.render(line, True, (255, 255, 255), (0, 0, 0)) for line in self.get_overlay_lines()]
+            surface = pygame.Surface((max(line.get_width() for line in lines), sum(line.get_height() for line in lines)))
+            y = 0
+            for line in lines:
+                surface.blit(line, (0, y))
+                y += line.get_height()
+            self.overlay = (pygame.image.tostring(surface, 'RGBA', True), surface.get_size())
+        self.overlay_frame += 1
+
+        pixels, (width, height) = self.overlay
+        depth_test = glIsEnabled(GL_DEPTH_TEST)
+        glDisable(GL_DEPTH_TEST)
+        glWindowPos2i(position[0], scene.height - position[1] - height)
+        glDrawPixels(width, height, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        if depth_test:
+            glEnable(GL_DEPTH_TEST)
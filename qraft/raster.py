@@ -0,0 +1,194 @@
+import math
+
+import numpy as np
+
+from . import environment as env
+from . import polylines
+from . import profiler
+
+
+class Rasterizer:
+    """
+    A z-buffered triangle and line rasterizer writing into an in-memory (height, width, 4) framebuffer.
+
+    Takes eye-space coordinates (camera looking down -z, as in OpenGL) and projects them like gluPerspective.
+    Triangles reaching in front of the near plane are dropped rather than clipped.
+    """
+
+    def __init__(self, width, height, field_of_view=60, near=0.1, far=200.0):
+        self.width = width
+        self.height = height
+        self.near = near
+        self.far = far
+        self.set_FOV(field_of_view)
+
+        self.color = np.zeros((height, width, 4), dtype=np.uint8)
+        self.depth = np.ones((height, width))
+
+    def set_FOV(self, FOV):
+        self.field_of_view = FOV
+        self.focal_length = 1 / math.tan(math.radians(FOV) / 2)
+
+    def clear(self, background_color=(0, 0, 0, 1)):
+        self.color[...] = np.round(np.clip(background_color, 0, 1) * 255).astype(np.uint8)
+        self.depth[...] = 1
+
+    def project(self, points):
+        """
+        Returns screen coordinates (x right, y down, in pixels) and NDC depth of (..., 3) eye-space points
+        """
+        w = -points[..., 2]
+        x = self.focal_length * self.height / self.width * points[..., 0] / w
+        y = self.focal_length * points[..., 1] / w
+        z = ((self.far + self.near) / (self.far - self.near) * w - 2 * self.far * self.near / (self.far - self.near)) / w
+        return np.stack([(x + 1) / 2 * self.width, (1 - y) / 2 * self.height, z], axis=-1)
+
+    def draw_triangles(self, triangles, colors):
+        """
+        triangles: (n, 3, 3) eye-space triangles
+        colors: (n, 3) colors in [0, 1]
+        """
+        visible = np.all(triangles[..., 2] < -self.near, axis=1)
+        screen = self.project(triangles[visible])
+        colors = np.round(np.clip(colors[visible], 0, 1) * 255).astype(np.uint8)
+
+        # Triangles entirely off-screen or without area are skipped before any per-pixel work
+        low = np.floor(np.min(screen[..., :2], axis=1) - 0.5).astype(int)
+        high = np.ceil(np.max(screen[..., :2], axis=1) - 0.5).astype(int)
+        low = np.maximum(low, 0)
+        high = np.minimum(high, (self.width - 1, self.height - 1))
+        (x0, y0), (x1, y1), (x2, y2) = screen[:, 0, :2].T, screen[:, 1, :2].T, screen[:, 2, :2].T
+        areas = (x1 - x0)*(y2 - y0) - (x2 - x0)*(y1 - y0)
+        keep = np.flatnonzero(np.all(high >= low, axis=1) & (areas != 0))
+
+        for i in keep:
+            self.fill_triangle(screen[i], areas[i], low[i], high[i], colors[i])
+
+    def fill_triangle(self, screen, area, low, high, color):
+        xs = np.arange(low[0], high[0] + 1) + 0.5
+        ys = np.arange(low[1], high[1] + 1)[:, None] + 0.5
+        (x0, y0, z0), (x1, y1, z1), (x2, y2, z2) = screen
+
+        # Barycentric coordinates from edge functions; all three share the sign of the area inside
+        w0 = ((x2 - x1)*(ys - y1) - (y2 - y1)*(xs - x1)) / area
+        w1 = ((x0 - x2)*(ys - y2) - (y0 - y2)*(xs - x2)) / area
+        w2 = 1 - w0 - w1
+        depth = w0*z0 + w1*z1 + w2*z2
+
+        region = (slice(low[1], high[1] + 1), slice(low[0], high[0] + 1))
+        covered = (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & (depth < self.depth[region]) & (depth >= -1)
+        self.depth[region][covered] = depth[covered]
+        self.color[region][covered, :3] = color
+        self.color[region][covered, 3] = 255
+
+    def draw_point(self, point, color, size=1):
+        """Draws a square point of `size` pixels at an eye-space position"""
+        if point[2] >= -self.near:
+            return
+        x, y, z = self.project(point)
+        half = max(1, round(size)) / 2
+        region = (
+            slice(max(0, int(y - half + 0.5)), max(0, int(y + half + 0.5))),
+            slice(max(0, int(x - half + 0.5)), max(0, int(x + half + 0.5))))
+        front = z <= self.depth[region]
+        self.depth[region][front] = z
+        self.color[region][front, :3] = np.round(np.clip(color, 0, 1) * 255).astype(np.uint8)
+        self.color[region][front, 3] = 255
+
+    def draw_polyline(self, points, color):
+        """
+        points: (n, 3) eye-space points joined by straight segments
+        """
+        color = np.round(np.clip(color, 0, 1) * 255).astype(np.uint8)
+        for start, end in zip(points[:-1], points[1:]):
+            if start[2] >= -self.near or end[2] >= -self.near:
+                continue
+            (xa, ya, za), (xb, yb, zb) = self.project(np.array([start, end]))
+            samples = int(max(abs(xb - xa), abs(yb - ya))) + 1
+            t = np.linspace(0, 1, samples)
+            x = np.floor(xa + (xb - xa)*t).astype(int)
+            y = np.floor(ya + (yb - ya)*t).astype(int)
+            z = za + (zb - za)*t
+
+            inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            x, y, z = x[inside], y[inside], z[inside]
+            front = z <= self.depth[y, x]
+            self.depth[y[front], x[front]] = z[front]
+            self.color[y[front], x[front], :3] = color
+            self.color[y[front], x[front], 3] = 255
+
+
+def get_triangles(node, light_vector, frustum=None):
+    """Yields the (world triangles, shaded colors) of every drawable in a scene graph, skipping culled subtrees"""
+    drawable = hasattr(node, 'get_world_triangles')
+    if frustum is not None and not frustum.visible(node, drawable):
+        return
+    if drawable:
+        if hasattr(node, 'use_level_of_detail') and not node.use_level_of_detail(frustum):
+            return
+        yield node.get_world_triangles(), node.shade(light_vector)
+    else:
+        for child in node.children:
+            yield from get_triangles(child, light_vector, frustum)
+
+
+class HeadlessScene:
+    """
+    A Scene that renders with the NumPy Rasterizer into memory, without a window or GL context.
+
+    Takes the same objects, lines, cameras and light vectors as environment.Scene;
+    after render, get_buffer returns the frame as a (height, width, 4) uint8 array.
+    """
+
+    def __init__(self, name, width, height, background_color=(0.2, 0.2, 0.3, 1.0), FPS=60, culling=True):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.background_color = background_color
+        self.culling = culling
+        self.rasterizer = Rasterizer(width, height)
+        self.stats = {'nodes': 0, 'drawn': 0, 'culled': 0, 'points': 0, 'triangles': 0}
+
+        self.objects = []
+        self.lines = []
+
+    def update(self):
+        self.rasterizer.clear(self.background_color)
+
+    def render(self, camera, light_vector):
+        view_matrix = camera.get_view_matrix()
+        rotation, translation = view_matrix[:3, :3], view_matrix[3, :3]
+        frustum = env.Frustum(
+            camera, self.rasterizer.field_of_view, self.width/self.height,
+            self.rasterizer.near, self.rasterizer.far, self.height, self.culling)
+
+        with profiler.stage('transform'):
+            for obj in self.objects:
+                obj.update_transform()
+
+        triangle_count = 0
+        with profiler.stage('draw'):
+            for obj in self.objects:
+                for triangles, colors in get_triangles(obj, light_vector, frustum):
+                    self.rasterizer.draw_triangles(triangles @ rotation + translation, colors)
+                    triangle_count += len(triangles)
+
+            for position, color, size in frustum.points:
+                self.rasterizer.draw_point(position @ rotation + translation, color, size)
+
+        self.stats = {
+            'nodes': frustum.tested, 'drawn': frustum.drawn, 'culled': frustum.culled,
+            'points': len(frustum.points), 'triangles': triangle_count}
+
+        self.lines[:] = [polylines.as_polyline(line) for line in self.lines]
+        for line in self.lines:
+            points = line.get_points()
+            if line.closed:
+                points = np.concatenate([points, points[:1]])
+            self.rasterizer.draw_polyline(points @ rotation + translation, line.color)
+
+    def set_FOV(self, FOV):
+        self.rasterizer.set_FOV(FOV)
+
+    def get_buffer(self):
+        return self.rasterizer.color.copy()
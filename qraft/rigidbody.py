@@ -0,0 +1,206 @@
+import numpy as np
+
+from . import geometry as gm
+
+
+# Unit quaternions are kept as (w, x, y, z) rows, rotating body coordinates into world coordinates
+
+def multiply(a, b):
+    """Hamilton products of (n, 4) quaternions"""
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw*bw - ax*bx - ay*by - az*bz,
+        aw*bx + ax*bw + ay*bz - az*by,
+        aw*by - ax*bz + ay*bw + az*bx,
+        aw*bz + ax*by - ay*bx + az*bw], axis=-1)
+
+
+def exponential(rotation_vectors):
+    """Unit quaternions of rotations by the angle |r| about r, for (n, 3) rotation vectors r"""
+    angles = np.linalg.norm(rotation_vectors, axis=-1, keepdims=True)
+    # sin(a/2)/a, which tends to 1/2 for small angles
+    factors = np.where(angles > 1e-12, np.sin(angles/2) / np.where(angles > 1e-12, angles, 1), 0.5)
+    return np.concatenate([np.cos(angles/2), factors*rotation_vectors], axis=-1)
+
+
+def get_bases(quaternions):
+    """(n, 3, 3) rotations in the repo's row-vector form: the rows are the body axes in world coordinates"""
+    w, x, y, z = np.moveaxis(quaternions, -1, 0)
+    return np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y + w*z), 2*(x*z - w*y)], axis=-1),
+        np.stack([2*(x*y - w*z), 1 - 2*(x*x + z*z), 2*(y*z + w*x)], axis=-1),
+        np.stack([2*(x*z + w*y), 2*(y*z - w*x), 1 - 2*(x*x + y*y)], axis=-1)], axis=-2)
+
+
+def from_bases(bases):
+    """Unit quaternions of (n, 3, 3) row-vector rotations, by the eigenvector method (robust to slightly skewed bases)"""
+    m = np.swapaxes(np.asarray(bases, dtype=float), -1, -2)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+    k = np.stack([
+        np.stack([m00 - m11 - m22, m10 + m01, m20 + m02, m21 - m12], axis=-1),
+        np.stack([m10 + m01, m11 - m00 - m22, m21 + m12, m02 - m20], axis=-1),
+        np.stack([m20 + m02, m21 + m12, m22 - m00 - m11, m10 - m01], axis=-1),
+        np.stack([m21 - m12, m02 - m20, m10 - m01, m00 + m11 + m22], axis=-1)], axis=-2) / 3
+    x, y, z, w = np.moveaxis(np.linalg.eigh(k)[1][..., -1], -1, 0)
+    quaternions = np.stack([w, x, y, z], axis=-1)
+    return quaternions * np.where(w < 0, -1, 1)[..., None]
+
+
+# Mass properties are (mass, center of mass, inertia tensor about the center of mass) in some frame
+
+def combine(properties):
+    """Mass properties of several bodies taken together, all given in the same frame"""
+    if not properties:
+        return 0.0, gm.ORIGIN, np.zeros((3, 3))
+    masses = np.array([mass for mass, _, _ in properties])
+    centers = np.array([center for _, center, _ in properties]).reshape(-1, 3)
+    inertias = np.array([inertia for _, _, inertia in properties]).reshape(-1, 3, 3)
+
+    mass = np.sum(masses)
+    center = masses @ centers / mass if mass else gm.ORIGIN
+    # Parallel axis theorem, to move every inertia to the common center of mass
+    offsets = centers - center
+    shifts = masses[:, None, None] * (np.einsum('ni,ni->n', offsets, offsets)[:, None, None]*np.identity(3) - offsets[:, :, None]*offsets[:, None, :])
+    return mass, center, np.sum(inertias + shifts, axis=0)
+
+
+def transform(properties, rotation, position):
+    """Mass properties moved from a frame into its parent, where v -> v @ rotation + position"""
+    mass, center, inertia = properties
+    return mass, center @ rotation + position, rotation.T @ inertia @ rotation
+
+
+def get_mesh_properties(vertices, triangles, density):
+    """Mass properties of a closed triangle mesh, as a sum of signed tetrahedra with a corner at the origin"""
+    a, b, c = np.moveaxis(vertices[triangles], 1, 0)
+    determinants = np.einsum('ni,ni->n', a, np.cross(b, c))
+    # Inward-facing triangles give a negative volume
+    determinants *= np.sign(np.sum(determinants)) or 1
+    volume = np.sum(determinants) / 6
+    if not volume:
+        return 0.0, gm.ORIGIN, np.zeros((3, 3))
+    center = determinants @ (a + b + c) / 4 / 6 / volume
+
+    # Second moments about the origin: the integral of x x^T over every tetrahedron
+    corners = a[:, :, None]*a[:, None, :] + b[:, :, None]*b[:, None, :] + c[:, :, None]*c[:, None, :]
+    total = (a + b + c)[:, :, None] * (a + b + c)[:, None, :]
+    moments = density * np.einsum('n,nij->ij', determinants, corners + total) / 120
+
+    mass = density * volume
+    inertia = np.trace(moments)*np.identity(3) - moments
+    inertia -= mass * (center @ center * np.identity(3) - np.outer(center, center))
+    return mass, center, inertia
+
+
+def get_mass_properties(shape, density=1000):
+    """
+    Mass properties of a shape in its own frame. Spheres and cuboids are solved exactly,
+    other meshes from their triangles; groups are put together from their shapes,
+    with the density of a Part overriding the one passed down.
+    """
+    density = getattr(shape, 'density', density)
+    if isinstance(shape, gm.Group):
+        return combine([
+            transform(get_mass_properties(child, density), gm.basis(child.unit_vectors), gm.vector3(child.position))
+            for child in shape.shapes])
+    if isinstance(shape, gm.Sphere):
+        mass = density * shape.volume
+        return mass, gm.ORIGIN, 2/5 * mass * shape.radius**2 * np.identity(3)
+    if isinstance(shape, gm.Cuboid):
+        mass = density * shape.volume
+        a, b, c = np.square(shape.size)
+        return mass, gm.ORIGIN, mass/12 * np.diag([b + c, a + c, a + b])
+    return get_mesh_properties(shape.model_vertices, shape.triangles, density)
+
+
+class RigidBodies:
+    """
+    The states of many rigid bodies in compact arrays, integrated together.
+
+    positions and velocities are those of the centers of mass, in world coordinates.
+    Orientations are unit quaternions; rotation is integrated through the world-frame angular momenta,
+    which torques change exactly, and the orientations are turned by the exponential of
+    the angular velocity over each step, so that they stay rotations however fast the bodies spin.
+
+    Forces and torques (world frame) add up in self.forces and self.torques until the next step.
+    """
+
+    def __init__(self):
+        self.masses = np.zeros(0)
+        self.inertias = np.zeros((0, 3, 3))
+        self.inverse_inertias = np.zeros((0, 3, 3))
+        self.positions = np.zeros((0, 3))
+        self.velocities = np.zeros((0, 3))
+        self.orientations = np.zeros((0, 4))
+        self.angular_momenta = np.zeros((0, 3))
+        self.forces = np.zeros((0, 3))
+        self.torques = np.zeros((0, 3))
+
+    def __len__(self):
+        return len(self.masses)
+
+    def add(self, mass, inertia, position=gm.ORIGIN, velocity=gm.ORIGIN, orientation=(1, 0, 0, 0), angular_momentum=gm.ORIGIN):
+        """Appends a body (inertia in the body frame, about the center of mass) and returns its index"""
+        self.masses = np.append(self.masses, mass)
+        self.inertias = np.concatenate([self.inertias, [inertia]])
+        self.inverse_inertias = np.concatenate([self.inverse_inertias, [np.linalg.pinv(inertia)]])
+        self.positions = np.concatenate([self.positions, [position]])
+        self.velocities = np.concatenate([self.velocities, [velocity]])
+        self.orientations = np.concatenate([self.orientations, [orientation]])
+        self.angular_momenta = np.concatenate([self.angular_momenta, [angular_momentum]])
+        self.forces = np.concatenate([self.forces, np.zeros((1, 3))])
+        self.torques = np.concatenate([self.torques, np.zeros((1, 3))])
+        return len(self) - 1
+
+    def remove(self, index):
+        """Takes a body out, returning its state as the keyword arguments of add"""
+        state = {
+            'mass': self.masses[index], 'inertia': self.inertias[index].copy(),
+            'position': self.positions[index].copy(), 'velocity': self.velocities[index].copy(),
+            'orientation': self.orientations[index].copy(), 'angular_momentum': self.angular_momenta[index].copy()}
+        for name in ('masses', 'inertias', 'inverse_inertias', 'positions', 'velocities',
+                     'orientations', 'angular_momenta', 'forces', 'torques'):
+            setattr(self, name, np.delete(getattr(self, name), index, axis=0))
+        return state
+
+    def set_mass(self, index, mass, inertia):
+        self.masses[index] = mass
+        self.inertias[index] = inertia
+        self.inverse_inertias[index] = np.linalg.pinv(inertia)
+
+    def get_bases(self, rows=slice(None)):
+        return get_bases(self.orientations[rows])
+
+    def get_angular_velocities(self, rows=slice(None), bases=None):
+        """World-frame angular velocities, from the angular momenta and the inertia in the current orientations"""
+        bases = self.get_bases(rows) if bases is None else bases
+        body_momenta = np.einsum('nij,nj->ni', bases, self.angular_momenta[rows])
+        return np.einsum('ni,nij->nj', np.einsum('nij,nj->ni', self.inverse_inertias[rows], body_momenta), bases)
+
+    def apply_force(self, index, force, point=None):
+        """Adds a world-frame force, through the center of mass or at a world point (which adds a torque)"""
+        self.forces[index] += force
+        if point is not None:
+            self.torques[index] += np.cross(point - self.positions[index], force)
+
+    def step(self, dt, rows=slice(None)):
+        """Integrates the bodies (or only some rows) over dt, and clears their forces and torques"""
+        masses = self.masses[rows][:, None]
+        self.velocities[rows] += np.divide(self.forces[rows], masses, out=np.zeros_like(self.forces[rows]), where=masses > 0) * dt
+        self.positions[rows] += self.velocities[rows] * dt
+
+        self.angular_momenta[rows] += self.torques[rows] * dt
+        angular_velocities = self.get_angular_velocities(rows)
+        orientations = multiply(exponential(angular_velocities * dt), self.orientations[rows])
+        self.orientations[rows] = orientations / np.linalg.norm(orientations, axis=1, keepdims=True)
+
+        self.forces[rows] = 0
+        self.torques[rows] = 0
+
+    def kinetic_energy(self):
+        angular_velocities = self.get_angular_velocities()
+        return 0.5*np.sum(self.masses * np.einsum('ni,ni->n', self.velocities, self.velocities)) \
+            + 0.5*np.sum(np.einsum('ni,ni->n', angular_velocities, self.angular_momenta))
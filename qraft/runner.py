@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+
+from . import profiler
+
+
+class InterpolatedState:
+    """
+    Keeps the previous and the current value of a simulated array,
+    so that frames drawn between two fixed steps can be blended.
+    """
+
+    def __init__(self, value):
+        self.current = np.array(value, dtype=float)
+        self.previous = self.current.copy()
+
+    def update(self, value):
+        self.previous, self.current = self.current, self.previous
+        self.current[...] = value
+
+    def get(self, alpha):
+        return self.previous + (self.current - self.previous) * alpha
+
+
+class Runner:
+    """
+    Advances a simulation in fixed steps, independently of the frame rate.
+
+    step: function (dt) advancing the simulation by one fixed step
+    dt: length of a step, in simulation time
+    time_scale: simulation time per second of real time
+    max_steps: most steps run per frame; when rendering can't keep up, the rest of the backlog is dropped
+    max_skipped_frames: frames in a row that may go unrendered while catching up on a backlog
+    """
+
+    def __init__(self, step, dt=1/60, time_scale=1, max_steps=8, max_skipped_frames=0):
+        self.step = step
+        self.dt = dt
+        self.time_scale = time_scale
+        self.max_steps = max_steps
+        self.max_skipped_frames = max_skipped_frames
+
+        self.t = 0
+        self.accumulator = 0
+        self.skipped_frames = 0
+
+        self.steps = 0
+        self.frames = 0
+        self.unrendered_frames = 0
+        self.dropped_time = 0
+
+    @property
+    def alpha(self):
+        """How far the simulation is between its last step and the next one, for interpolating render states"""
+        return self.accumulator / self.dt
+
+    def advance(self, elapsed):
+        """
+        Runs the steps that `elapsed` seconds of real time call for.
+        Returns whether this frame should be rendered.
+        """
+        self.frames += 1
+        self.accumulator += elapsed * self.time_scale
+
+        steps = 0
+        with profiler.stage('physics'):
+            while self.accumulator >= self.dt and steps < self.max_steps:
+                self.step(self.dt)
+                self.accumulator -= self.dt
+                self.t += self.dt
+                steps += 1
+        self.steps += steps
+
+        if self.accumulator >= self.dt:
+            if self.skipped_frames < self.max_skipped_frames:
+                self.skipped_frames += 1
+                self.unrendered_frames += 1
+                return False
+
+            # Still behind: give up on the backlog rather than falling further behind every frame
+            backlog = self.accumulator - self.accumulator % self.dt
+            self.dropped_time += backlog
+            self.accumulator -= backlog
+
+        self.skipped_frames = 0
+        return True
+
+    def run_headless(self, duration=None, steps=None, callback=None, callback_interval=1):
+        """
+        Steps as fast as possible, without rendering, for `duration` of simulation time or a number of steps.
+
+        callback: optional function (runner) called every callback_interval steps, e.g. to save a frame
+        """
+        if steps is None:
+            if duration is None:
+                raise ValueError("Need a duration or a number of steps.")
+            steps = round(duration / self.dt)
+
+        start = time.perf_counter()
+        for i in range(steps):
+            self.step(self.dt)
+            self.t += self.dt
+            self.steps += 1
+            if callback is not None and (i + 1) % callback_interval == 0:
+                callback(self)
+
+        return time.perf_counter() - start
@@ -0,0 +1,172 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import orbits as ob
+
+
+def stumpff(psi):
+    """The Stumpff functions C(psi) and S(psi) of universal-variable orbits, for an array of psi"""
+    positive, negative = psi > 1e-6, psi < -1e-6
+    root = np.sqrt(np.abs(psi))
+    safe = np.where(positive | negative, psi, 1)
+    safe_root = np.where(positive | negative, root, 1)
+
+    # Series around 0, where the closed forms lose all their digits
+    c = 1/2 - psi/24 + psi**2/720
+    s = 1/6 - psi/120 + psi**2/5040
+    c = np.where(positive, (1 - np.cos(safe_root)) / safe, c)
+    s = np.where(positive, (safe_root - np.sin(safe_root)) / safe_root**3, s)
+    c = np.where(negative, (np.cosh(safe_root) - 1) / -safe, c)
+    s = np.where(negative, (np.sinh(safe_root) - safe_root) / safe_root**3, s)
+    return c, s
+
+
+def lambert(r1, r2, flight_times, mu=ob.SUN_MU, prograde=True, iterations=64):
+    """
+    Solves Lambert's problem for many (zero-revolution) transfers at once, by universal variables.
+
+    r1, r2: (n, 3) departure and arrival positions around the central body
+    flight_times: (n,) times of flight
+    prograde: go the way round that has the angular momentum along +z
+
+    Returns the (n, 3) velocities at departure and at arrival; NaN where there is no solution.
+    The time of flight increases with psi, so psi is found by bisection, the same number of
+    iterations for every transfer, which keeps the whole grid in array operations.
+    """
+    r1, r2 = np.asarray(r1, dtype=float), np.asarray(r2, dtype=float)
+    flight_times = np.asarray(flight_times, dtype=float)
+    lengths1, lengths2 = np.linalg.norm(r1, axis=-1), np.linalg.norm(r2, axis=-1)
+
+    cosines = np.clip(np.einsum('...i,...i->...', r1, r2) / (lengths1*lengths2), -1, 1)
+    short_way = (np.cross(r1, r2)[..., 2] >= 0) == prograde
+    a = np.where(short_way, 1, -1) * np.sqrt(lengths1*lengths2*(1 + cosines))
+
+    def get_y(psi):
+        c, s = stumpff(psi)
+        return lengths1 + lengths2 + a*(psi*s - 1)/np.sqrt(c), c, s
+
+    low = np.full(np.shape(flight_times), -4*np.pi)
+    high = np.full(np.shape(flight_times), 4*np.pi**2)
+    for _ in range(iterations):
+        psi = (low + high) / 2
+        y, c, s = get_y(psi)
+        # Negative y means psi is too small for this geometry
+        times = np.where(y >= 0, (np.sqrt(np.maximum(y, 0)/c)**3*s + a*np.sqrt(np.maximum(y, 0))) / np.sqrt(mu), -np.inf)
+        too_short = times < flight_times
+        low = np.where(too_short, psi, low)
+        high = np.where(too_short, high, psi)
+
+    y, _, _ = get_y((low + high) / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = 1 - y/lengths1
+        g = a*np.sqrt(y/mu)
+        g_dot = 1 - y/lengths2
+        departure = (r2 - f[..., None]*r1) / g[..., None]
+        arrival = (g_dot[..., None]*r2 - r1) / g[..., None]
+
+    # Opposite positions fix no plane, and bisection that stayed at a bound didn't converge
+    failed = (np.abs(a) < 1e-12*(lengths1 + lengths2)) | ~np.isfinite(g) \
+        | (high >= 4*np.pi**2*(1 - 1e-9)) | (low <= -4*np.pi*(1 - 1e-9))
+    departure[failed] = np.nan
+    arrival[failed] = np.nan
+    return departure, arrival
+
+
+def get_burns(states, mu, prograde):
+    """Departure and arrival velocity changes of transfers given as the states of both bodies at both ends"""
+    r1, v1, r2, v2, flight_times = states
+    departure, arrival = lambert(r1, r2, flight_times, mu, prograde)
+    return departure - v1, v2 - arrival
+
+
+def get_relative(states, body, parent):
+    """A body's (times, 3) positions or velocities from (times, n, 3) ones, relative to its parent (if not -1)"""
+    return states[:, body] - states[:, parent] if parent >= 0 else states[:, body]
+
+
+class Porkchop:
+    """
+    Delta-v of transfers from one orbiting body to another over a grid of departure times and times of flight.
+
+    departure_burns and arrival_burns are (departure times, flight times, 3) arrays of the velocity changes
+    needed to leave the first body's orbit onto the transfer and to match the second body's at arrival,
+    departure_delta_v and arrival_delta_v their sizes (the porkchop plots). Unsolvable cells are NaN.
+    """
+
+    def __init__(self, orbits, departure_body, arrival_body, departure_times, flight_times, prograde=True, workers=None):
+        """
+        orbits: Orbits that both bodies (given by index) are part of, around the same central body
+            (the central body of the orbits, or the same parent, in which case positions and velocities are relative to it)
+        workers: split the grid between this many processes (0 for one per CPU); None computes it in this process
+        """
+        parent = orbits.parents[departure_body]
+        if orbits.parents[arrival_body] != parent:
+            raise ValueError(f"Bodies {departure_body} and {arrival_body} do not orbit the same central body.")
+        self.departure_times = np.asarray(departure_times, dtype=float)
+        self.flight_times = np.asarray(flight_times, dtype=float)
+        self.departure_body = departure_body
+        self.arrival_body = arrival_body
+
+        departure_grid, flight_grid = np.meshgrid(self.departure_times, self.flight_times, indexing='ij')
+        arrival_grid = departure_grid + flight_grid
+        r1, v1 = (get_relative(array, departure_body, parent) for array in orbits.get_states(departure_grid.ravel()))
+        r2, v2 = (get_relative(array, arrival_body, parent) for array in orbits.get_states(arrival_grid.ravel()))
+        self.arrival_positions = r2.reshape(*arrival_grid.shape, 3)
+        self.arrival_velocities = v2.reshape(*arrival_grid.shape, 3)
+        self.departure_velocities = v1.reshape(*departure_grid.shape, 3)
+
+        mu = orbits.mu[departure_body]
+        states = (r1, v1, r2, v2, flight_grid.ravel())
+        if workers is None:
+            departure_burns, arrival_burns = get_burns(states, mu, prograde)
+        else:
+            chunks = np.array_split(np.arange(len(r1)), workers or os.cpu_count())
+            with ProcessPoolExecutor(workers or None) as executor:
+                results = list(executor.map(
+                    get_burns,
+                    [tuple(array[chunk] for array in states) for chunk in chunks],
+                    [mu]*len(chunks), [prograde]*len(chunks)))
+            departure_burns = np.concatenate([result[0] for result in results])
+            arrival_burns = np.concatenate([result[1] for result in results])
+
+        self.departure_burns = departure_burns.reshape(*departure_grid.shape, 3)
+        self.arrival_burns = arrival_burns.reshape(*departure_grid.shape, 3)
+        self.departure_delta_v = np.linalg.norm(self.departure_burns, axis=-1)
+        self.arrival_delta_v = np.linalg.norm(self.arrival_burns, axis=-1)
+
+    @property
+    def total_delta_v(self):
+        return self.departure_delta_v + self.arrival_delta_v
+
+    def best(self, arrival=True):
+        """
+        The transfer with the least delta-v (counting the arrival burn, unless arrival is False), as a dict
+        with the departure time, time of flight, delta-v, the departure burn,
+        and the arrival position and velocity of the target body
+        """
+        delta_v = self.total_delta_v if arrival else self.departure_delta_v
+        if np.all(np.isnan(delta_v)):
+            raise ValueError("No transfer in the grid has a solution.")
+        i, j = np.unravel_index(np.nanargmin(delta_v), delta_v.shape)
+        return {
+            'departure_time': self.departure_times[i],
+            'flight_time': self.flight_times[j],
+            'delta_v': delta_v[i, j],
+            'departure_delta_v': self.departure_delta_v[i, j],
+            'arrival_delta_v': self.arrival_delta_v[i, j],
+            'departure_burn': self.departure_burns[i, j],
+            'arrival_position': self.arrival_positions[i, j],
+            'arrival_velocity': self.arrival_velocities[i, j],
+        }
+
+
+def aim(autopilot, transfer):
+    """
+    Hands a transfer (from Porkchop.best) to an autopilot: point along the departure burn,
+    and hold the arrival point, moving with the target body's velocity there
+    """
+    autopilot.target_direction = transfer['departure_burn']
+    autopilot.target = transfer['arrival_position']
+    autopilot.target_velocity = transfer['arrival_velocity']
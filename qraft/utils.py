@@ -2,12 +2,10 @@
 import datetime
 
 import pygame
-from OpenGL.GL import glReadPixels, GL_RGBA, GL_UNSIGNED_BYTE
 
-def get_buffer(scene):
-    return glReadPixels(0, 0, *scene.window.get_size(), GL_RGBA, GL_UNSIGNED_BYTE)
-
-def save_screenshot(scene, buffer):
+def save_image(array, filename=None):
+    """Saves a (height, width, 4) uint8 array, such as HeadlessScene.get_buffer(), as an image"""
+    height, width = array.shape[:2]
     pygame.image.save(
-        pygame.image.fromstring(buffer, scene.window.get_size(), "RGBA"),
-        f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.png")
\ No newline at end of file
+        pygame.image.frombuffer(array.tobytes(), (width, height), "RGBA"),
+        filename or f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.png")
@@ -16,8 +16,22 @@ def main(width, height, FPS=60):
 
     light_vector = Q([-1,-2,-3])
 
+    # F3 shows the frame profile, F4 writes it to a file
+    frame_profiler = profiler.Profiler().start()
+    show_profile = False
+
+    # Left click picks what is under the cursor; build the picker after adding the objects to the scene
+    picker = picking.Picker(scene.objects)
+    picked = None
+
+    # F2 saves a screenshot and F5 starts or stops recording; frames are read back without stalling the render loop
+    # and written to PNG files in the background, screenshots to the working directory
+    screenshots = capture.FrameCapture(capture.PNGSequence(prefix=f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-"))
+    recording = None
+
     running = True
     while running:
+        frame_profiler.begin_frame()
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
@@ -26,25 +40,40 @@ def main(width, height, FPS=60):
                 camera.field_of_view -= event.y
                 scene.set_FOV(camera.field_of_view)
 
-        mouse.update()
-        keyboard.update()
-        camera.update(mouse, keyboard)
+        with profiler.stage('input'):
+            mouse.update()
+            keyboard.update()
+            camera.update(mouse, keyboard)
+
+        if keyboard.downs[pygame.K_F3]: show_profile = not show_profile
+        if keyboard.downs[pygame.K_F4]: frame_profiler.dump(f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-profile.json")
 
         # Do stuff here
 
         scene.update()
+        if mouse.downclicks[0] and mouse.position is not None:
+            picker.refresh()
+            picked = picker.pick(camera, width, height, mouse.position)
         scene.render(camera, light_vector)
+        if show_profile: frame_profiler.draw_overlay(scene)
 
         t += dt / FPS
         clock.tick(FPS); fps = clock.get_fps()
-        pygame.display.set_caption(f'{scene.name} (FPS: {fps:.2f}, FOV: {camera.field_of_view})')
+        pygame.display.set_caption(f'{scene.name} (FPS: {fps:.2f}, FOV: {camera.field_of_view}, picked: {picked}{f", recording: {recording.captured} frames" if recording is not None else ""})')
 
-        if keyboard.downs[pygame.K_F2]: buffer = utils.get_buffer(scene)
+        if keyboard.downs[pygame.K_F2]: screenshots.capture(scene)
+        else: screenshots.flush()
+        if keyboard.downs[pygame.K_F5]:
+            if recording is None: recording = capture.FrameCapture(capture.PNGSequence(f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-recording"))
+            else: recording.close(); recording = None
+        if recording is not None: recording.capture(scene)
 
-        pygame.display.flip()
-        
-        if keyboard.downs[pygame.K_F2]: utils.save_screenshot(scene, buffer)
+        with profiler.stage('flip'):
+            pygame.display.flip()
+        frame_profiler.end_frame(**scene.stats)
 
+    screenshots.close()
+    if recording is not None: recording.close()
     pygame.quit()
 
 if __name__ == '__main__':
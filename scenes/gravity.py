@@ -13,24 +13,7 @@ class Planet:
         self.radius = radius
         self.color = color
 
-        self.sphere = gm.Group([gm.Sphere(radius=radius, color=color, vertical_n=10, horizontal_n=10)])
-
-    def update_position(self, dt, FPS=60):
-        self.position += self.velocity * dt / FPS
-    
-    def update_velocity(self, planets, dt, FPS=60):
-        net_acceleration = Q([0,0,0])
-        for planet in planets:
-            if planet is self:
-                continue
-            dist = planet.position - self.position
-            acceleration = G * planet.mass * (dist * dist.norm**-3)
-            net_acceleration += acceleration
-        self.velocity += net_acceleration * dt / FPS
-    
-    def render(self, position, unit_vectors, light_vector):
-        self.sphere.position = self.position
-        self.sphere.render(position, unit_vectors, light_vector)
+        self.sphere = gm.Group([gm.Sphere(radius=radius, color=color, vertical_n=10, horizontal_n=10, levels=[(6, 8, 24), (4, 6, 8)], point_pixels=1.5)], position)
 
 def main(width, height, FPS=60):
     t = 0
@@ -50,7 +33,44 @@ def main(width, height, FPS=60):
     sun = Planet("Sun", 1, Q([0,0,0]), Q([0,0,0]), 0.1, (0.8, 0.7, 0.204))
     earth = Planet("Earth", 10**-10, Q([1,0,0]), Q([0,0.7,0]).rotate(qi, 1), 0.03, (0.145, 0.439, 0.804))
     mars = Planet("Mars", 10**-10, Q([1.2,0,0]), Q([0,0.8,0]).rotate(qi, 0), 0.03, (0.804, 0.239, 0.145))
-    scene.objects = [sun, mars]
+    planets = [sun, earth, mars]
+    scene.objects = [sun.sphere, mars.sphere]
+
+    # The paths of the last few orbits, one point per physics step
+    trails = [polylines.Trail(4000, planet.color) for planet in planets]
+    scene.lines.extend(trails)
+
+    system = physics.NBody(
+        [gm.vector3(planet.position) for planet in planets],
+        [gm.vector3(planet.velocity) for planet in planets],
+        [planet.mass for planet in planets],
+        G=G, integrator='hermite')
+
+    # Rendering blends between the last two physics steps, which run at a fixed dt whatever the frame rate
+    positions = runner.InterpolatedState(system.positions)
+    velocities = runner.InterpolatedState(system.velocities)
+
+    # Planets that touch bounce off each other instead of passing through
+    radii = [planet.radius for planet in planets]
+
+    def step(dt):
+        system.step(dt)
+        contacts = collision.Colliders.from_spheres(system.positions, radii).detect()
+        if len(contacts):
+            collision.resolve(contacts, system.positions, system.velocities, system.masses, restitution=0.5)
+            system.accelerations = None
+        positions.update(system.positions)
+        velocities.update(system.velocities)
+        for trail, position in zip(trails, system.positions):
+            trail.append(position)
+
+    simulation = runner.Runner(step, dt / FPS)
+    elapsed = 0
+
+    # F2 saves a screenshot and F5 starts or stops recording; frames are read back without stalling the render loop
+    # and written to PNG files in the background, screenshots to the working directory
+    screenshots = capture.FrameCapture(capture.PNGSequence(prefix=f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-"))
+    recording = None
 
     running = True
     while running:
@@ -64,7 +84,14 @@ def main(width, height, FPS=60):
 
         mouse.update()
         keyboard.update()
-        camera.update(mouse, keyboard)
+        camera.update(mouse, keyboard, elapsed)
+
+        render_frame = simulation.advance(elapsed)
+        t = simulation.t
+
+        for planet, position, velocity in zip(planets, positions.get(simulation.alpha), velocities.get(simulation.alpha)):
+            planet.position, planet.velocity = Q(position.tolist()), Q(velocity.tolist())
+            planet.sphere.position = planet.position
 
         camera.position = earth.position.copy()
         #x = earth.velocity.normalized
@@ -75,24 +102,25 @@ def main(width, height, FPS=60):
 
         #print(camera.unit_vectors)
 
-        for planet in [sun, earth, mars]:
-            planet.update_velocity(scene.objects, dt, FPS)
-        for planet in [sun, earth, mars]:
-            planet.update_position(dt, FPS)
-
-        scene.update()
-        scene.render(camera, light_vector)
+        if render_frame:
+            scene.update()
+            scene.render(camera, light_vector)
 
-        t += dt / FPS
-        clock.tick(FPS); fps = clock.get_fps()
-        pygame.display.set_caption(f'Gravity (FPS: {fps:.2f}, FOV: {camera.field_of_view})')
+        elapsed = clock.tick(FPS) / 1000; fps = clock.get_fps()
+        pygame.display.set_caption(f'Gravity (FPS: {fps:.2f}, FOV: {camera.field_of_view}{f", recording: {recording.captured} frames" if recording is not None else ""})')
 
-        if keyboard.downs[pygame.K_F2]: buffer = utils.get_buffer()
+        if keyboard.downs[pygame.K_F5]:
+            if recording is None: recording = capture.FrameCapture(capture.PNGSequence(f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-recording"))
+            else: recording.close(); recording = None
 
-        pygame.display.flip()
-        
-        if keyboard.downs[pygame.K_F2]: utils.save_screenshot(scene, buffer)
+        if render_frame:
+            if keyboard.downs[pygame.K_F2]: screenshots.capture(scene)
+            else: screenshots.flush()
+            if recording is not None: recording.capture(scene)
+            pygame.display.flip()
 
+    screenshots.close()
+    if recording is not None: recording.close()
     pygame.quit()
 
 if __name__ == '__main__':
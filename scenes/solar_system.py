@@ -9,7 +9,8 @@ def main(width, height, FPS=60):
     dt = 1e0
     clock = pygame.time.Clock()
 
-    scene = env.Scene('Scene', width, height, (0.05, 0.05, 0.1, 1))
+    # Positions stay in float64 AU; the scene is drawn around the camera with near/far planes fitted every frame
+    scene = env.Scene('Scene', width, height, (0.05, 0.05, 0.1, 1), floating_origin=True, dynamic_depth=True)
 
     camera = env.Camera(Q([0,0,2]), UV.copy(), 60)
     mouse = env.Mouse(width, height)
@@ -19,23 +20,59 @@ def main(width, height, FPS=60):
 
     light_vector = Q([-1,-1,-2])
 
+    # Bodies are drawn at true scale (radii in AU); from across the system they are far below a pixel,
+    # and are drawn as points until they are close enough to be seen as spheres
+    true_scale = True
 
-    for star in sm.bodies.stars.values():
-        star.model = gm.Sphere(radius=4e-4*(star.radius**0.3), color=star.color, vertical_n = 6, horizontal_n = 8)
-        scene.objects.append(star.model)
+    def get_scale(radius, exaggerated):
+        return radius / sm.constants.AU if true_scale else exaggerated
+
+
+    # Every star and every planet shares one sphere, and each group is drawn with one instanced call per level of detail:
+    # a fine sphere up close, coarser ones further away, and a point below a pixel
+    def body_template():
+        return gm.Sphere(radius=1, vertical_n=32, horizontal_n=48, levels=[(16, 24, 64), (6, 8, 12)], point_pixels=1)
+
+    stars = list(sm.bodies.stars.values())
+    star_models = gm.InstancedMesh(
+        body_template(),
+        positions=np.zeros((len(stars), 3)),
+        scales=[get_scale(star.radius, 4e-4*(star.radius**0.3)) for star in stars],
+        colors=[star.color for star in stars])
+    scene.objects.append(star_models)
     
-    for planet in sm.bodies.planets.values():
-        planet.model = gm.Sphere(radius=1.5e-4*(planet.radius**0.4), color=planet.color, vertical_n = 4, horizontal_n = 6)
-        scene.objects.append(planet.model)
-        
-        planet.path_points = planet.orbit.get_path_points(60, 2 / sm.constants.AU)
-        scene.lines.append((QuaternionArray(planet.path_points), planet.color))
+    planets = list(sm.bodies.planets.values())
+    planet_models = gm.InstancedMesh(
+        body_template(),
+        positions=np.zeros((len(planets), 3)),
+        scales=[get_scale(planet.radius, 1.5e-4*(planet.radius**0.4)) for planet in planets],
+        colors=[planet.color for planet in planets])
+    scene.objects.append(planet_models)
+    
+    # The orbits are fitted once to the planets' own ephemerides (positions an hour apart give the velocities),
+    # and after that every planet is propagated in one batched call per frame
+    def get_positions(t):
+        for planet in planets:
+            planet.update_position(t)
+        return np.array([gm.vector3(planet.position) for planet in planets])
+
+    hour = 3600
+    planet_orbits = orbits.Orbits.from_state_vectors(
+        get_positions(t), (get_positions(t + hour) - get_positions(t - hour)) / (2*hour), epoch=t)
+
+    for planet, path in zip(planets, planet_orbits.get_paths(120) / sm.constants.AU):
+        scene.lines.append(polylines.Polyline(path, planet.color, closed=True))
     
     # TODO: make camera follow a planet
     # TODO: maybe come up with a way to perform Hohmann transfers?
     # TODO: planet axis of rotation
 
 
+    # F2 saves a screenshot and F5 starts or stops recording; frames are read back without stalling the render loop
+    # and written to PNG files in the background, screenshots to the working directory
+    screenshots = capture.FrameCapture(capture.PNGSequence(prefix=f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-"))
+    recording = None
+
     running = True
     while running:
         t = time.time()#t += dt / FPS
@@ -49,27 +86,34 @@ def main(width, height, FPS=60):
 
         mouse.update()
         keyboard.update()
+        # Slow down when approaching a surface, so that a planet can be reached from across the system
+        centers, radii = np.concatenate([star_models.positions, planet_models.positions]), np.concatenate([star_models.scales, planet_models.scales])
+        camera.speed_distance = max(np.min(np.linalg.norm(centers - gm.vector3(camera.position), axis=1) - radii), 1e-7)
         camera.update(mouse, keyboard)
         
         if keyboard.downs[pygame.K_f]:
             mouse.toggle_focus = True
 
-        for planet in sm.bodies.planets.values():
-            planet.update_position(t)
-            planet.model.position = planet.position / sm.constants.AU
+        planet_orbits.propagate(t)
+        planet_orbits.sync(planet_models, 1 / sm.constants.AU)
 
         scene.update()
         scene.render(camera, light_vector)
 
         clock.tick(FPS); fps = clock.get_fps()
-        pygame.display.set_caption(f'{scene.name} (FPS: {fps:.2f}, FOV: {camera.field_of_view})')
+        pygame.display.set_caption(f'{scene.name} (FPS: {fps:.2f}, FOV: {camera.field_of_view}{f", recording: {recording.captured} frames" if recording is not None else ""})')
 
-        if keyboard.downs[pygame.K_F2]: buffer = utils.get_buffer(scene)
+        if keyboard.downs[pygame.K_F2]: screenshots.capture(scene)
+        else: screenshots.flush()
+        if keyboard.downs[pygame.K_F5]:
+            if recording is None: recording = capture.FrameCapture(capture.PNGSequence(f"{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-recording"))
+            else: recording.close(); recording = None
+        if recording is not None: recording.capture(scene)
 
         pygame.display.flip()
-        
-        if keyboard.downs[pygame.K_F2]: utils.save_screenshot(scene, buffer)
 
+    screenshots.close()
+    if recording is not None: recording.close()
     pygame.quit()
 
 if __name__ == '__main__':
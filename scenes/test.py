@@ -27,7 +27,7 @@ def main(width, height, FPS=60):
             gm.Cuboid((0.7, 0.25, 0),(0.3, 0.2, 0.4),(0.3,0.7,0.9)),
             gm.Cuboid((0.8, 0.25, -0.1),(0.05, 0.21, 0.1),(0.8,0.9,1))],
             position=[-0.5, 0, 0])])
-        return amogus
+        return amogus.bake()
         
     amogi = gm.Group([
         gm.Group([(colored_amogus((0.85,0.9,0.2)))], [0,0,1], UV.copy().rotate(qj, math.pi/2)),